@@ -1,63 +1,28 @@
 # add_slot_window.py
-from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QLineEdit, QScrollArea, QLabel, QPushButton, QHBoxLayout,
+import datetime
+
+from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QLineEdit, QLabel, QPushButton, QHBoxLayout,
                              QGridLayout, QMessageBox, QSpacerItem, QSizePolicy)
 from PyQt5.QtCore import Qt, QPoint, QTime, pyqtSignal, QEvent, QRectF
 from PyQt5.QtGui import QPainter, QPen, QColor
 
-from database import execute_query
+from client_list_view import ClientListView
+from database import execute_query, day_range, add_training_slot
 from hover_button import HoverButton
 
-# client_widget.py
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel
-from PyQt5.QtCore import Qt
-
 from utils import center
 
 
-class ClientWidget(QWidget):
-    """виджет клиента."""
-    slot_added = pyqtSignal(dict)
-
-    def __init__(self, selected_client=None):
-        super().__init__()
-        self.selected_client = selected_client  # Установка выбранного клиента
-        self.confirm_clicked = False
-        self.setObjectName('client_widget')
-        self.init_ui(self.selected_client)
-
-    def init_ui(self, client_data):
-        layout = QVBoxLayout(self)
-        name_label = QLabel(client_data['name'])
-        phone_label = QLabel(client_data['phone'])
-
-        name_label.setStyleSheet("font-weight: bold; font-size: 16px; font-family: 'Unbounded'; margin-bottom: 0px;")
-        phone_label.setStyleSheet("color: #555; font-size: 14px; font-family: 'Unbounded';")
-        layout.addWidget(name_label)
-        layout.addWidget(phone_label)
-
-        self.setStyleSheet("""
-            QWidget#client_widget {
-                background-color: white;
-                border: 3px solid #75A9A7;
-                border-radius: 12px;
-                margin: 5px;
-                padding: 5px;
-            }
-            
-        """)
-
-
 class AddSlotWindow(QWidget):
     slot_added = pyqtSignal(dict)
 
-    def __init__(self, selected_client=None, subscription_data=None, existing_slots=None, selected_date=None, trainer_id=None):
+    def __init__(self, selected_client=None, subscription_data=None, selected_date=None, trainer_id=None):
         super().__init__()
         print(selected_client)
         self.selected_client = selected_client
         self.trainer_id = trainer_id
         self.subscription_data = subscription_data
         self.selected_date = selected_date
-        self.existing_slots = existing_slots or []  # список [(start_time, end_time)]
         self.setGeometry(300, 300, 670, 670)
         self.setWindowFlags(Qt.FramelessWindowHint)
         self.setAttribute(Qt.WA_TranslucentBackground)
@@ -123,40 +88,10 @@ class AddSlotWindow(QWidget):
         search_layout.setContentsMargins(10, 5, 10, 5)  # Отступы для строки поиска
         main_layout.addLayout(search_layout)
 
-        # область для списка клиентов
-        self.scroll_area = QScrollArea()
-        self.scroll_area.setObjectName('scroll_clients')
-        self.scroll_area.setWidgetResizable(True)
-        self.scroll_area.setVerticalScrollBarPolicy(Qt.ScrollBarAsNeeded)
-        self.scroll_area.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-        self.scroll_area.setStyleSheet("""
-            QScrollArea#scroll_clients {
-                border: none;
-                background-color: white;
-            }
-            QScrollBar:vertical {
-                width: 8px;
-                background: white;
-            }
-            QScrollBar::handle:vertical {
-                background: #75A9A7;
-                border-radius: 4px;
-            }
-        """)
-        main_layout.addWidget(self.scroll_area)
-
-        self.client_container = QWidget()
-        self.client_container.setObjectName('clients_content')
-        self.client_container.setStyleSheet("""
-            QWidget#clients_content {
-                border: none;
-                background-color: white;
-            }
-        """)
-        self.client_layout = QVBoxLayout(self.client_container)
-        self.client_layout.setAlignment(Qt.AlignTop)
-        self.client_layout.setObjectName('clients_content_layout')
-        self.scroll_area.setWidget(self.client_container)
+        # список клиентов
+        self.client_view = ClientListView(compact=True, id_key="client_id")
+        self.client_view.area_clicked.connect(lambda area, client, rect: self.select_client(client))
+        main_layout.addWidget(self.client_view)
 
         # метка для информации о выбранном клиенте
         if self.selected_client and self.subscription_data:
@@ -410,7 +345,7 @@ class AddSlotWindow(QWidget):
             JOIN 
                 subscription s ON c.subscription = s.subscription_id
             LEFT JOIN 
-                training_slots ts ON ts.client = c.client_id AND DATE(ts.start_time) = %s
+                training_slots ts ON ts.client = c.client_id AND ts.start_time >= %s AND ts.start_time < %s
             WHERE 
                 s.is_valid = TRUE
                 AND s.valid_until >= %s
@@ -418,7 +353,7 @@ class AddSlotWindow(QWidget):
             GROUP BY 
                 c.client_id, c.first_name, c.surname, c.phone_number, s.tariff, s.is_valid, s.valid_until
         """
-        result = execute_query(query, (selected_date, selected_date, selected_date))
+        result = execute_query(query, (*day_range(selected_date), selected_date, selected_date))
 
         self.client_list = []
         if result:
@@ -437,32 +372,10 @@ class AddSlotWindow(QWidget):
 
     def update_client_list(self, clients):
         """Обновляет список клиентов."""
-        for i in reversed(range(self.client_layout.count())):
-            widget = self.client_layout.itemAt(i).widget()
-            if widget:
-                widget.setParent(None)
-
-        for client in clients:
-            client_widget = ClientWidget(client)
-            client_widget.mousePressEvent = lambda event, c=client: self.select_client(c)
-            frame = QWidget()
-            frame.setObjectName("clientFrame")
-            frame.setStyleSheet("""
-                                QWidget#clientFrame {
-                                border: 3px solid #75A9A7; /* Рамка для обертки */
-                                border-radius: 12px;  /* Если нужны скругленные углы */
-                          /* Отступ между элементами */
-                            }
-                    """)
-            frame_layout = QVBoxLayout(frame)
-            frame_layout.addWidget(client_widget)
-            frame_layout.setContentsMargins(0, 0, 0, 0)  # Важно! Убираем отступы
-            self.client_layout.addWidget(frame)
+        self.client_view.client_model.set_clients(clients)
 
     def filter_clients(self):
-        search_text = self.search_input.text().lower()
-        filtered_clients = [c for c in self.client_list if search_text in c['name'].lower()]
-        self.update_client_list(filtered_clients)
+        self.client_view.set_filter(self.search_input.text())
 
     def select_client(self, client):
         self.selected_client = client
@@ -506,11 +419,6 @@ class AddSlotWindow(QWidget):
             self.confirm_clicked = False  # Сброс флага
             return
 
-        for slot_start, slot_end in self.existing_slots:
-            if start_qtime < slot_end and end_qtime > slot_start:
-                QMessageBox.warning(self, "Ошибка", "Время слота пересекается с другим слотом.")
-                return
-
             # проверка ограничений абонемента
         print(self.subscription_data)
         if self.subscription_data:
@@ -522,25 +430,27 @@ class AddSlotWindow(QWidget):
         if not self.can_add_slot(self.selected_client, start_qtime, end_qtime):
             return
 
-
-            # Отправка данных
-        query = """
-                INSERT INTO training_slots (trainer, client, start_time, end_time)
-                VALUES (%s, %s, %s, %s)
-                RETURNING slot_id;
-            """
-        slot_id = execute_query(query, (
-            self.trainer_id,  # Передаем trainer_id
+        # Отправка данных; пересечение с другими слотами тренера проверяет база
+        result = add_training_slot(
+            self.trainer_id,
             self.selected_client["client_id"],
-            f"{self.selected_date} {start_time}:00",
-            f"{self.selected_date} {end_time}:00"
-        ), fetch=True)
+            datetime.datetime.combine(self.selected_date, start_qtime.toPyTime()),
+            datetime.datetime.combine(self.selected_date, end_qtime.toPyTime())
+        )
 
-        if slot_id and slot_id[0][0]:
-            slot_id = slot_id[0][0]
+        if result is None:
+            QMessageBox.warning(self, "Ошибка", "Не удалось добавить слот в базу данных.")
+        elif result["status"] == "conflict":
+            busy = ", ".join(
+                f"{slot['start_time']:%H:%M} - {slot['end_time']:%H:%M} ({slot['client'] or 'без клиента'})"
+                for slot in result["conflicts"]
+            )
+            QMessageBox.warning(self, "Ошибка", f"Время слота пересекается с другим слотом: {busy}.")
+            return
+        else:
             QMessageBox.information(self, "Успешно", "Слот успешно добавлен!")
             slot_data = {
-                "slot_id": slot_id,
+                "slot_id": result["slot_id"],
                 "client": self.selected_client["name"],
                 "client_id": self.selected_client["client_id"],
                 "start_time": start_qtime,
@@ -549,9 +459,6 @@ class AddSlotWindow(QWidget):
             }
             self.slot_added.emit(slot_data)  # Отправляем сигнал с данными слота
 
-        else:
-            QMessageBox.warning(self, "Ошибка", "Не удалось добавить слот в базу данных.")
-
         self.close()
 
 
@@ -568,10 +475,13 @@ class AddSlotWindow(QWidget):
             query = """
                 SELECT COUNT(*)
                 FROM training_slots
-                WHERE client = %s AND start_time::date = %s
+                WHERE client = %s AND start_time >= %s AND start_time < %s
             """
-            slot_count = execute_query(query, (client_id, self.selected_date))[0][0]
-            if slot_count >= 1:
+            result = execute_query(query, (client_id, *day_range(self.selected_date)), fetch_one=True)
+            if result is None:
+                QMessageBox.warning(self, "Ошибка", "Не удалось проверить слоты клиента. Попробуйте ещё раз.")
+                return False
+            if result[0] >= 1:
                 QMessageBox.warning(self, "Ошибка", "Абонемент позволяет только один слот в день.")
                 return False
 
@@ -1,20 +1,21 @@
 import os
 import re
-import time
 
 import bcrypt
-import serial
 from PyQt5.QtWidgets import QVBoxLayout, QLabel, QLineEdit, QGridLayout, QDialog, QMessageBox, QFileDialog, QTextEdit, \
     QSizePolicy, QWidget, QPushButton
-from PyQt5.QtCore import Qt, QRectF, QPoint, pyqtSignal, QByteArray, QBuffer, QTimer, QThread
+from PyQt5.QtCore import Qt, QRectF, QPoint, pyqtSignal, QByteArray, QBuffer, QTimer
 from PyQt5.QtGui import QPainter, QColor, QPen, QPixmap
 
+from card_reader import get_card_reader
 from database import check_phone_in_database, \
     add_subscription_to_existing_user, add_user_to_db, execute_query, check_trainer_phone_in_database, \
-    check_admin_phone_in_database, check_admin_username_in_database, check_card_in_database, add_card_to_user
+    check_admin_phone_in_database, check_admin_username_in_database, check_card_in_database, add_card_to_user, \
+    get_trainer_photo_data, get_admin_photo_data
 from hover_button import HoverButton
+from photo_store import store_photo
 from subscription import SubscriptionWidget
-from utils import WorkerThread, logger, resources_path, center, scan_card, ScanCardThread
+from utils import WorkerThread, logger, resources_path, center, get_tap_pipeline
 
 from PyQt5.QtWidgets import QDialog, QVBoxLayout, QGridLayout, QLabel, QLineEdit, QMessageBox, QSpacerItem, QSizePolicy
 from PyQt5.QtCore import Qt, pyqtSignal
@@ -24,52 +25,6 @@ import re
 
 
 
-class ScanCardThread(QThread):
-    """Поток для сканирования карты."""
-    card_scanned = pyqtSignal(str)
-    scanner_connected = pyqtSignal()
-    scanner_not_found = pyqtSignal()
-
-    def run(self):
-        baudrate = 115200
-        card_number = None
-        scanner_found = False
-
-        while not scanner_found:
-            available_ports = serial.tools.list_ports.comports()
-            if not available_ports:
-                self.scanner_not_found.emit()
-                time.sleep(2)  # Проверяем снова через 2 секунды
-                continue
-
-            self.scanner_connected.emit()
-            scanner_found = True
-
-            for port_info in available_ports:
-                port = port_info.device  # COM-порт (например, COM3 или /dev/ttyUSB0)
-                print(f"Попытка подключения к {port}")
-
-                try:
-                    serial_port = serial.Serial(port, baudrate, timeout=1)
-
-                    while True:
-                        if serial_port.in_waiting > 0:
-                            data = serial_port.read(serial_port.in_waiting).decode('utf-8').strip()
-                            print(f"Полученные данные с {port}: {data}")
-                            if data:
-                                card_number = data
-                                self.card_scanned.emit(card_number)
-                                return  # Завершаем поток после успешного сканирования
-
-                        time.sleep(0.1)
-
-                except serial.SerialException as e:
-                    print(f"Ошибка подключения к {port}: {e}")
-
-                finally:
-                    if 'serial_port' in locals() and serial_port.is_open:
-                        serial_port.close()
-
 class AddCardDialog(QDialog):
     def __init__(self, client_id, parent=None, scan_callback=None):
         super().__init__()
@@ -104,13 +59,32 @@ class AddCardDialog(QDialog):
 
         self.setLayout(self.layout)
 
-        # Запуск потока для ожидания сканера и сканирования карты
-        self.scan_thread = ScanCardThread()
-        self.scan_thread.scanner_connected.connect(self.on_scanner_connected)
-        self.scan_thread.scanner_not_found.connect(self.on_scanner_not_found)
-        self.scan_thread.card_scanned.connect(self.on_card_scanned)
-        self.scan_thread.start()
+        # Подписка на службу считывателя карт; касание привязываемой карты не считается отметкой посещения
+        get_tap_pipeline().pause()
+        self.card_reader = get_card_reader()
+        if self.card_reader.connected:
+            self.on_scanner_connected()
+        else:
+            self.on_scanner_not_found()
+        self.card_reader.connection_changed.connect(self.on_reader_connection_changed)
+        self.card_reader.card_scanned.connect(self.on_card_scanned)
 
+    def done(self, result):
+        try:
+            self.card_reader.card_scanned.disconnect(self.on_card_scanned)
+            self.card_reader.connection_changed.disconnect(self.on_reader_connection_changed)
+        except TypeError:
+            pass  # Уже отписаны
+        else:
+            get_tap_pipeline().resume()
+        super().done(result)
+
+    def on_reader_connection_changed(self, connected):
+        if connected:
+            self.on_scanner_connected()
+        else:
+            self.scanner_connected = False
+            self.on_scanner_not_found()
 
     def cancel_move(self):
 
@@ -790,6 +764,9 @@ class AddTrainerWindow(QDialog):
         self.header_text = "Редактирование тренера" if trainer_data else "Новый тренер"
         self.setGeometry(300, 300, 500, 500)
         self.center()
+        if trainer_data and trainer_data.get("id"):
+            # В списке тренеров хранится уменьшенная копия, а редактируется и сохраняется полная фотография
+            trainer_data = dict(trainer_data, image=get_trainer_photo_data(trainer_data["id"]))
         self.photo_data = None if trainer_data is None else trainer_data.get("image")
         self.trainer_id = trainer_data.get("id") if trainer_data else None
 
@@ -975,6 +952,7 @@ class AddTrainerWindow(QDialog):
                                    fetch=True, fetch_one=True)
 
             if result:
+                store_photo(self.photo_label.photo_data)
                 self.trainer_updated.emit({
                     "id": self.trainer_id,
                     "name": name,
@@ -995,6 +973,7 @@ class AddTrainerWindow(QDialog):
                                    (surname, name, patronymic, phone_number, description, self.photo_label.photo_data))
             if result:
                 trainer_id = result[0][0]
+                store_photo(self.photo_label.photo_data)
                 self.trainer_added.emit({
                     "id": trainer_id,
                     "name": name,
@@ -1102,6 +1081,8 @@ class AddAdministratorWindow(QDialog):
 
         if admin_data:
             self.user_id = admin_data["user_id"]
+            # В списке администраторов хранится уменьшенная копия, а редактируется полная фотография
+            admin_data = dict(admin_data, image=get_admin_photo_data(self.admin_id))
             self.fill_admin_data(admin_data)
 
     def center(self):
@@ -1293,6 +1274,7 @@ class AddAdministratorWindow(QDialog):
                 result2 = execute_query(query2, (username, result[0]), fetch=True, fetch_one=True)
 
             if result and result2:
+                store_photo(self.photo_label.photo_data)
                 self.admin_updated.emit({
                     "admin_id": self.admin_id,
                     "name": name,
@@ -1328,6 +1310,7 @@ class AddAdministratorWindow(QDialog):
 
             if result and result1:
                 admin_id = result[0][0]
+                store_photo(photo_data)
                 user_id = result1[0][0]
                 self.admin_added.emit({
                     "admin_id": admin_id,
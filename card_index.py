@@ -0,0 +1,178 @@
+"""
+Индекс клубных карт в памяти.
+
+Номер карты сопоставляется с клиентом и его абонементом: тариф, срок действия,
+использованные посещения, период заморозки и признак нахождения в зале. Индекс загружается
+целиком при запуске и дочитывает изменения по столбцу updated_at (migrations/009_card_index_sync.sql),
+когда приходит уведомление об изменении клиентов, абонементов или посещений.
+
+По индексу решение о входе принимается на рабочем месте без обращения к базе и повторяет
+порядок проверок серверной функции card_checkin. Сервер остаётся источником истины:
+посещения записывает только он (card_checkin или пачка отметок, database.apply_taps),
+а его результат возвращается в индекс.
+"""
+import datetime
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Поля строки, возвращаемой load_card_index_rows, в порядке столбцов
+CARD_INDEX_FIELDS = ("member_card", "client_id", "name", "subscription_id", "tariff", "valid_until",
+                     "is_valid", "visits_used", "frozen_from", "frozen_until", "in_gym")
+
+# Час, с которого начинается вечернее время тарифов (как в card_checkin)
+EVENING_HOUR = 16
+
+# Решения, после которых карта отправляется на сервер: вход и выход записываются,
+# неизвестная карта и истёкший абонемент перепроверяются (индекс мог отстать от базы)
+SERVER_STATUSES = ("enter", "exit", "unknown_card", "expired")
+
+
+def parse_tariff(tariff):
+    """
+    Разбирает тариф вида <кол-во>_<время>_<период>, например 8_mrn_mnth или unlim_evn_yr.
+    :return: (лимит посещений или None, время: mrn, evn или другое)
+    """
+    parts = (tariff or "").split("_")
+    max_visits = int(parts[0]) if parts[0].isdigit() else None
+    time_type = parts[1] if len(parts) > 1 else ""
+    return max_visits, time_type
+
+
+class CardIndex:
+    """Индекс: номер карты -> запись клиента с абонементом."""
+
+    def __init__(self):
+        self.cards = {}
+        self.card_by_client = {}
+        # Время сервера, с которого нужно дочитывать изменения; None — индекс ещё не загружен
+        self.synced_at = None
+        # Индекс обновляется из фонового потока, а читается при отметке карты
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.cards)
+
+    @property
+    def loaded(self):
+        return self.synced_at is not None
+
+    def load(self, rows, synced_at):
+        """Заменяет содержимое индекса полной выгрузкой."""
+        with self.lock:
+            self.cards = {}
+            self.card_by_client = {}
+            for row in rows:
+                self._put(dict(zip(CARD_INDEX_FIELDS, row)))
+            self.synced_at = synced_at
+        logger.info(f"Индекс карт загружен: {len(self.cards)} карт")
+
+    def update(self, rows, synced_at):
+        """Применяет изменённые строки клиентов: карта могла смениться или быть отвязана."""
+        with self.lock:
+            for row in rows:
+                self._put(dict(zip(CARD_INDEX_FIELDS, row)))
+            self.synced_at = synced_at
+        if rows:
+            logger.debug(f"Индекс карт: обновлено {len(rows)} клиентов")
+
+    def _put(self, record):
+        old_card = self.card_by_client.pop(record["client_id"], None)
+        if old_card is not None:
+            self.cards.pop(old_card, None)
+        card = record["member_card"]
+        if not card:
+            return
+        # Карта, перевыданная другому клиенту, убирается у прежнего владельца
+        previous = self.cards.get(card)
+        if previous is not None:
+            self.card_by_client.pop(previous["client_id"], None)
+        self.cards[card] = record
+        self.card_by_client[record["client_id"]] = card
+
+    def get(self, card_number):
+        with self.lock:
+            record = self.cards.get(card_number)
+            return dict(record) if record is not None else None
+
+    def decide(self, card_number, now=None):
+        """
+        Решение по карте без обращения к базе, в порядке проверок card_checkin.
+        :return: (код решения, копия записи карты или None). Коды: enter, exit, unknown_card,
+                 no_subscription, expired, invalid, frozen, morning_only, evening_only, limit_reached.
+        """
+        now = now or datetime.datetime.now()
+        record = self.get(card_number)
+        if record is None:
+            return "unknown_card", None
+        if record["in_gym"]:
+            return "exit", record
+        if record["subscription_id"] is None:
+            return "no_subscription", record
+        today = now.date()
+        if record["is_valid"] and record["valid_until"] is not None and record["valid_until"] < today:
+            return "expired", record
+        if not record["is_valid"]:
+            return "invalid", record
+        frozen_from, frozen_until = record["frozen_from"], record["frozen_until"]
+        if frozen_from is not None and frozen_until is not None and frozen_from <= today <= frozen_until:
+            return "frozen", record
+        max_visits, time_type = parse_tariff(record["tariff"])
+        if time_type == "mrn" and now.hour >= EVENING_HOUR:
+            return "morning_only", record
+        if time_type == "evn" and now.hour < EVENING_HOUR:
+            return "evening_only", record
+        if max_visits is not None and (record["visits_used"] or 0) >= max_visits:
+            return "limit_reached", record
+        return "enter", record
+
+    def apply_checkin(self, card_number, result):
+        """Переносит в индекс результат card_checkin, не дожидаясь следующей синхронизации."""
+        status = result.get("status")
+        with self.lock:
+            record = self.cards.get(card_number)
+            if status == "unknown_card":
+                if record is not None:
+                    self.cards.pop(card_number, None)
+                    self.card_by_client.pop(record["client_id"], None)
+                return
+            if record is None:
+                return
+            if status == "entered":
+                record["in_gym"] = True
+                record["visits_used"] = result.get("visits_used")
+                max_visits = result.get("max_visits")
+                if max_visits is not None and record["visits_used"] >= max_visits:
+                    record["is_valid"] = False
+            elif status == "exited":
+                record["in_gym"] = False
+            elif status in ("expired", "invalid"):
+                record["is_valid"] = False
+            elif status == "limit_reached":
+                record["visits_used"] = result.get("visits_used")
+
+    def apply_local(self, card_number, decision):
+        """
+        Отмечает в индексе вход или выход, решённый на рабочем месте и ещё не подтверждённый сервером,
+        чтобы следующее касание той же карты решалось с его учётом.
+        """
+        with self.lock:
+            record = self.cards.get(card_number)
+            if record is None:
+                return
+            if decision == "enter":
+                record["in_gym"] = True
+                record["visits_used"] = (record["visits_used"] or 0) + 1
+            elif decision == "exit":
+                record["in_gym"] = False
+
+    def clear(self):
+        with self.lock:
+            self.cards = {}
+            self.card_by_client = {}
+            self.synced_at = None
+
+
+# Общий индекс приложения: заполняется главным окном, читается окном отметки карт
+card_index = CardIndex()
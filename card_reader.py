@@ -0,0 +1,194 @@
+"""
+Служба считывателя карт.
+
+Один поток на всё приложение: находит считыватель один раз, запоминает его порт,
+держит порт открытым и блокирующе читает номера карт. Отключение считывателя
+обнаруживается по ошибке чтения, после чего порт переоткрывается с нарастающей задержкой.
+Номера карт публикуются сигналом card_scanned, на который подписываются окна.
+
+Настройки (секция [card_reader] config.ini):
+    port      — порт считывателя; если не задан, считыватель ищется среди всех портов
+    hint      — подстрока описания или VID:PID порта для поиска (например "CH340" или "1A86:7523")
+    baudrate  — скорость порта, по умолчанию 115200
+"""
+import logging
+import time
+
+import serial
+import serial.tools.list_ports
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from config import get_setting
+
+logger = logging.getLogger(__name__)
+
+# Пауза между байтами, после которой кадр без перевода строки считается законченным (с)
+FRAME_GAP = 0.05
+# Тайм-аут блокирующего чтения: как часто поток проверяет запрос на остановку (с)
+READ_TIMEOUT = 0.5
+
+
+class CardReaderService(QThread):
+    """Долгоживущий поток чтения карт со считывателя на последовательном порту."""
+    # номер отсканированной карты
+    card_scanned = pyqtSignal(str)
+    # True — считыватель подключён и порт открыт, False — считыватель не найден или отключён
+    connection_changed = pyqtSignal(bool)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.baudrate = get_setting("card_reader", "baudrate", 115200, int)
+        self.hint = (get_setting("card_reader", "hint", "") or "").lower()
+        # Порт, на котором считыватель найден; при переподключении проверяется первым
+        self.port = get_setting("card_reader", "port", None)
+        self.connected = False
+        self._stop_requested = False
+
+    def run(self):
+        delay = 1
+        while not self._stop_requested:
+            serial_port = None
+            try:
+                serial_port = self._open_reader()
+                if serial_port is not None:
+                    self._set_connected(True)
+                    delay = 1
+                    self._read_cards(serial_port)
+            except (serial.SerialException, OSError) as e:
+                logger.warning(f"Считыватель карт на {self.port} недоступен: {e}")
+            finally:
+                self._set_connected(False)
+                if serial_port is not None and serial_port.is_open:
+                    serial_port.close()
+            # Пауза перед переподключением с проверкой запроса на остановку
+            deadline = time.monotonic() + delay
+            while not self._stop_requested and time.monotonic() < deadline:
+                time.sleep(0.2)
+            delay = min(delay * 2, 10)
+
+    def _open_port(self, port):
+        return serial.Serial(port, self.baudrate, timeout=READ_TIMEOUT)
+
+    def _candidate_ports(self):
+        ports = serial.tools.list_ports.comports()
+        if self.hint:
+            ports = [p for p in ports if self.hint in f"{p.description} {p.hwid}".lower()]
+        return [p.device for p in ports]
+
+    def _open_reader(self):
+        """
+        Открывает порт считывателя. Запомненный порт открывается сразу; иначе, если подходящий порт один,
+        он и считается считывателем, а если их несколько — считывателем становится порт,
+        с которого первым придёт номер карты.
+        """
+        if self.port:
+            try:
+                return self._open_port(self.port)
+            except (serial.SerialException, OSError) as e:
+                logger.info(f"Порт считывателя {self.port} не открывается ({e}), поиск заново")
+
+        candidates = self._candidate_ports()
+        if not candidates:
+            logger.info("Считыватель карт не найден: нет доступных портов")
+            return None
+        if len(candidates) == 1:
+            self.port = candidates[0]
+            logger.info(f"Считыватель карт: {self.port}")
+            return self._open_port(self.port)
+        return self._discover(candidates)
+
+    def _discover(self, candidates):
+        """Слушает все порты одновременно, пока на одном из них не появится номер карты."""
+        opened = {}
+        for port in candidates:
+            try:
+                opened[port] = self._open_port(port)
+            except (serial.SerialException, OSError) as e:
+                logger.debug(f"Порт {port} недоступен: {e}")
+        if not opened:
+            return None
+        logger.info(f"Поиск считывателя карт среди портов {list(opened)}: ожидание первой карты")
+        self._set_connected(True)
+        try:
+            while not self._stop_requested:
+                for port, serial_port in list(opened.items()):
+                    try:
+                        waiting = serial_port.in_waiting
+                    except (serial.SerialException, OSError):
+                        serial_port.close()
+                        del opened[port]
+                        continue
+                    if waiting:
+                        self.port = port
+                        logger.info(f"Считыватель карт найден на {port}")
+                        del opened[port]
+                        self._emit_frame(self._read_frame(serial_port))
+                        return serial_port
+                if not opened:
+                    return None
+                time.sleep(FRAME_GAP)
+            return None
+        finally:
+            for serial_port in opened.values():
+                serial_port.close()
+
+    def _read_cards(self, serial_port):
+        while not self._stop_requested:
+            frame = self._read_frame(serial_port)
+            if frame:
+                self._emit_frame(frame)
+
+    @staticmethod
+    def _read_frame(serial_port):
+        """
+        Читает кадр с номером карты: блокирующе ждёт первый байт (не дольше READ_TIMEOUT),
+        затем дочитывает до перевода строки или паузы FRAME_GAP между байтами.
+        """
+        frame = serial_port.read(1)
+        if not frame:
+            return frame
+        deadline = time.monotonic() + FRAME_GAP
+        while not frame.endswith((b"\n", b"\r")):
+            waiting = serial_port.in_waiting
+            if waiting:
+                frame += serial_port.read(waiting)
+                deadline = time.monotonic() + FRAME_GAP
+            elif time.monotonic() >= deadline:
+                break
+            else:
+                time.sleep(0.005)
+        return frame
+
+    def _emit_frame(self, frame):
+        for line in frame.decode("utf-8", errors="ignore").splitlines():
+            card_number = line.strip()
+            if card_number:
+                logger.info(f"Отсканирована карта {card_number}")
+                self.card_scanned.emit(card_number)
+
+    def _set_connected(self, connected):
+        if self.connected != connected:
+            self.connected = connected
+            self.connection_changed.emit(connected)
+
+    def stop(self):
+        self._stop_requested = True
+
+
+_service = None
+
+
+def get_card_reader():
+    """Возвращает службу считывателя карт, запуская её при первом обращении."""
+    global _service
+    if _service is None:
+        _service = CardReaderService()
+        _service.start()
+    return _service
+
+
+def stop_card_reader():
+    """Останавливает службу считывателя. Вызывается при завершении работы приложения."""
+    if _service is not None:
+        _service.stop()
+        _service.wait(2000)
@@ -6,6 +6,7 @@ from PyQt5.QtGui import QPainter, QColor, QFont, QBrush, QCursor
 from PyQt5.QtCore import Qt, QMargins, pyqtSignal, QObject
 import datetime
 import logging
+import time
 
 from database import (
     get_max_visitors_per_hour,
@@ -18,11 +19,17 @@ from utils import WorkerThread, resources_path
 logger = logging.getLogger(__name__)
 
 class ChartWidget(QWidget):
+    # Время жизни данных незакрытого периода в кэше, секунд
+    CACHE_TTL = 60
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.current_period = datetime.date.today()
         self.granularity = 'day'  # 'day', 'week', 'month', 'year'
-        self.is_fetching = False  # для управления потоками
+        # Кэш данных диаграммы: (гранулярность, период) -> (время загрузки, данные)
+        self.chart_cache = {}
+        # Выполняющиеся загрузки: (гранулярность, период) -> WorkerThread
+        self.pending_fetches = {}
         self.chart_view = self.create_chart_view()
         self.initUI()
 
@@ -237,88 +244,135 @@ class ChartWidget(QWidget):
         except Exception as e:
             logger.error(f"Ошибка в show_tooltip: {e}")
 
-    def update_chart(self):
+    def period_spec(self, granularity, period):
         """
-        обновление диаграммы в зависимости от текущей гранулярности и периода.
+        Описание периода диаграммы: ключ кэша, функция загрузки с аргументами, подписи и заголовок.
+        closed — период полностью в прошлом, и его данные больше не изменятся.
         """
-        if self.is_fetching:
-            logger.info("Запрос уже выполняется. Ожидание завершения.")
-            return
-
-        self.is_fetching = True
-        self.set_buttons_enabled(False)
-
-        logger.info(f"Обновление диаграммы: Гранулярность={self.granularity}, Период={self.current_period}")
-
-        if self.granularity == 'day':
-            start_date = self.current_period
-            end_date = self.current_period
-            # запрос в отдельном потоке
-            self.fetch_data_thread = WorkerThread(get_max_visitors_per_hour, start_date)
-            self.fetch_data_thread.result_signal.connect(
-                lambda data: self.process_chart_data(
-                    data,
-                    ["08-10", "10-12", "12-14", "14-16", "16-18", "18-20", "20-22"],
-                    f"{start_date.strftime('%d.%m.%Y')}"
-                )
-            )
-            self.fetch_data_thread.finished_signal.connect(self.on_fetch_finished)
-            self.fetch_data_thread.start()
-        elif self.granularity == 'week':
-            start_date = self.current_period - datetime.timedelta(days=self.current_period.weekday())
+        today = datetime.date.today()
+        if granularity == 'day':
+            return {
+                "key": (granularity, period),
+                "func": get_max_visitors_per_hour,
+                "args": (period,),
+                "categories": ["08-10", "10-12", "12-14", "14-16", "16-18", "18-20", "20-22"],
+                "title": f"{period.strftime('%d.%m.%Y')}",
+                "closed": period < today,
+            }
+        if granularity == 'week':
+            start_date = period - datetime.timedelta(days=period.weekday())
             end_date = start_date + datetime.timedelta(days=6)
             week_number = self.get_week_number_within_month(start_date)
-            self.fetch_data_thread = WorkerThread(get_average_visitors_per_weekday, start_date, end_date)
-            self.fetch_data_thread.result_signal.connect(
-                lambda data: self.process_chart_data(
-                    data,
-                    ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс'],
-                    f"Неделя {week_number} {start_date.strftime('%m.%Y')}"
-                )
-            )
-            self.fetch_data_thread.finished_signal.connect(self.on_fetch_finished)
-            self.fetch_data_thread.start()
-        elif self.granularity == 'month':
-            start_date = self.current_period.replace(day=1)
-            next_month = start_date.replace(day=28) + datetime.timedelta(days=4)  # на следующий месяц
-            end_date = next_month - datetime.timedelta(days=next_month.day)
-            month = start_date.month
-            year = start_date.year
-            # Запуск запроса в отдельном потоке
-            self.fetch_data_thread = WorkerThread(get_average_visitors_per_week_in_month, month, year)
-            self.fetch_data_thread.result_signal.connect(
-                lambda data: self.process_chart_data(
-                    data,
-                    ["Нед 1", "Нед 2", "Нед 3", "Нед 4", "Нед 5"],
-                    f"{start_date.strftime('%m.%Y')}"
-                )
-            )
-            self.fetch_data_thread.finished_signal.connect(self.on_fetch_finished)
-            self.fetch_data_thread.start()
-        elif self.granularity == 'year':
-            year = self.current_period.year
-            self.fetch_data_thread = WorkerThread(get_average_visitors_per_month, year)
-            self.fetch_data_thread.result_signal.connect(
-                lambda data: self.process_chart_data(
-                    data,
-                    [f"{i:02}" for i in range(1, 13)],  # числовые значения месяцев
-                    f"{year}"
-                )
-            )
-            self.fetch_data_thread.finished_signal.connect(self.on_fetch_finished)
-            self.fetch_data_thread.start()
-        else:
-            logger.error(f"Неизвестная гранулярность: {self.granularity}")
-            self.is_fetching = False
-            self.set_buttons_enabled(True)
+            return {
+                "key": (granularity, start_date),
+                "func": get_average_visitors_per_weekday,
+                "args": (start_date, end_date),
+                "categories": ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс'],
+                "title": f"Неделя {week_number} {start_date.strftime('%m.%Y')}",
+                "closed": end_date < today,
+            }
+        if granularity == 'month':
+            start_date = period.replace(day=1)
+            next_month = (start_date.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+            return {
+                "key": (granularity, start_date),
+                "func": get_average_visitors_per_week_in_month,
+                "args": (start_date.month, start_date.year),
+                "categories": ["Нед 1", "Нед 2", "Нед 3", "Нед 4", "Нед 5"],
+                "title": f"{start_date.strftime('%m.%Y')}",
+                "closed": next_month <= today,
+            }
+        if granularity == 'year':
+            return {
+                "key": (granularity, period.year),
+                "func": get_average_visitors_per_month,
+                "args": (period.year,),
+                # подписи совпадают с ключами get_average_visitors_per_month
+                "categories": ['Янв', 'Фев', 'Март', 'Апр', 'Май', 'Июнь',
+                               'Июль', 'Авг', 'Сен', 'Окт', 'Ноя', 'Дек'],
+                "title": f"{period.year}",
+                "closed": period.year < today.year,
+            }
+        raise ValueError(f"Неизвестная гранулярность: {granularity}")
+
+    def shift_period(self, period, granularity, step):
+        """Возвращает дату, сдвинутую на step периодов выбранной гранулярности."""
+        if granularity == 'day':
+            return period + datetime.timedelta(days=step)
+        if granularity == 'week':
+            return period + datetime.timedelta(weeks=step)
+        if granularity == 'month':
+            month_index = period.year * 12 + period.month - 1 + step
+            return period.replace(year=month_index // 12, month=month_index % 12 + 1, day=1)
+        if granularity == 'year':
+            return period.replace(year=period.year + step, day=1)
+        return period
+
+    def get_cached(self, spec):
+        """Возвращает данные из кэша: закрытые периоды не устаревают, текущие живут CACHE_TTL секунд."""
+        entry = self.chart_cache.get(spec["key"])
+        if entry is None:
+            return None, False
+        fetched_at, data, closed = entry
+        fresh = closed or time.monotonic() - fetched_at < self.CACHE_TTL
+        return data, fresh
+
+    def fetch_period(self, spec):
+        """Загружает данные периода в фоне, если они ещё не загружаются."""
+        # Завершившиеся потоки удаляются здесь, а не по сигналу, чтобы объект QThread
+        # не уничтожался, пока поток ещё выходит из run()
+        for pending_key, pending_thread in list(self.pending_fetches.items()):
+            if pending_thread.isFinished():
+                del self.pending_fetches[pending_key]
+
+        key = spec["key"]
+        if key in self.pending_fetches:
+            return
+        thread = WorkerThread(spec["func"], *spec["args"])
+        thread.result_signal.connect(
+            lambda data, key=key, closed=spec["closed"]: self.on_period_loaded(key, data, closed))
+        self.pending_fetches[key] = thread
+        thread.start()
+
+    def on_period_loaded(self, key, data, closed):
+        if data is None:
+            logger.error(f"Не удалось загрузить данные диаграммы для {key}")
             return
+        self.chart_cache[key] = (time.monotonic(), data, closed)
+        # Отрисовываем, только если пользователь всё ещё смотрит на этот период
+        spec = self.period_spec(self.granularity, self.current_period)
+        if spec["key"] == key:
+            self.process_chart_data(data, spec["categories"], spec["title"])
+
+    def invalidate_open_periods(self):
+        """Сбрасывает кэш незакрытых периодов, например после новых посещений."""
+        for key, (_, _, closed) in list(self.chart_cache.items()):
+            if not closed:
+                del self.chart_cache[key]
+        spec = self.period_spec(self.granularity, self.current_period)
+        if not spec["closed"]:
+            self.fetch_period(spec)
 
-    def on_fetch_finished(self):
+    def update_chart(self):
         """
-        по завершении потока загрузки данных.
+        обновление диаграммы в зависимости от текущей гранулярности и периода.
+        Данные берутся из кэша, при отсутствии или устаревании загружаются в фоне;
+        соседние периоды загружаются заранее.
         """
-        self.is_fetching = False
-        self.set_buttons_enabled(True)
+        logger.debug(f"Обновление диаграммы: Гранулярность={self.granularity}, Период={self.current_period}")
+
+        spec = self.period_spec(self.granularity, self.current_period)
+        data, fresh = self.get_cached(spec)
+        if data is not None:
+            self.process_chart_data(data, spec["categories"], spec["title"])
+        if not fresh:
+            self.fetch_period(spec)
+
+        for step in (-1, 1):
+            neighbour = self.period_spec(self.granularity,
+                                         self.shift_period(self.current_period, self.granularity, step))
+            if not self.get_cached(neighbour)[1]:
+                self.fetch_period(neighbour)
 
     def process_chart_data(self, data, categories, title):
         """
@@ -326,7 +380,6 @@ class ChartWidget(QWidget):
         """
         if data is None:
             logger.error("Нет данных для обновления диаграммы")
-            self.on_fetch_finished()
             return
 
         self.chart.removeAllSeries()
@@ -365,16 +418,10 @@ class ChartWidget(QWidget):
         self.chart.legend().setVisible(True)
         self.chart.legend().setAlignment(Qt.AlignBottom)
 
-        self.on_fetch_finished()
-
     def set_granularity(self, granularity):
         """
         устанавливка гранулярности и обновление диаграммы.
         """
-        if self.is_fetching:
-            logger.info("Обновление гранулярности уже выполняется. Ожидание завершения.")
-            return  # игнорирование изменение гранулярности
-
         self.granularity = granularity
         logger.info(f"Установка гранулярности: {self.granularity}")
 
@@ -385,51 +432,16 @@ class ChartWidget(QWidget):
 
         self.update_chart()
 
-    def set_buttons_enabled(self, enabled):
-
-        self.prev_button.setEnabled(enabled)
-        self.next_button.setEnabled(enabled)
-        self.day_button.setEnabled(enabled)
-        self.week_button.setEnabled(enabled)
-        self.month_button.setEnabled(enabled)
-        self.year_button.setEnabled(enabled)
-
     def go_prev(self):
         """
         к предыдущему периоду в зависимости от гранулярности.
         """
-        if self.is_fetching:
-            logger.info("Переход к предыдущему периоду уже выполняется. Ожидание завершения.")
-            return
-
-        if self.granularity == 'day':
-            self.current_period -= datetime.timedelta(days=1)
-        elif self.granularity == 'week':
-            self.current_period -= datetime.timedelta(weeks=1)
-        elif self.granularity == 'month':
-            month = self.current_period.month - 1 or 12
-            year = self.current_period.year - 1 if self.current_period.month == 1 else self.current_period.year
-            self.current_period = self.current_period.replace(year=year, month=month, day=1)
-        elif self.granularity == 'year':
-            self.current_period = self.current_period.replace(year=self.current_period.year - 1)
+        self.current_period = self.shift_period(self.current_period, self.granularity, -1)
         self.update_chart()
 
     def go_next(self):
         """
         к следующему периоду в зависимости от гранулярности.
         """
-        if self.is_fetching:
-            logger.info("Переход к следующему периоду уже выполняется. Ожидание завершения.")
-            return
-
-        if self.granularity == 'day':
-            self.current_period += datetime.timedelta(days=1)
-        elif self.granularity == 'week':
-            self.current_period += datetime.timedelta(weeks=1)
-        elif self.granularity == 'month':
-            month = self.current_period.month + 1 if self.current_period.month < 12 else 1
-            year = self.current_period.year + 1 if self.current_period.month == 12 else self.current_period.year
-            self.current_period = self.current_period.replace(year=year, month=month, day=1)
-        elif self.granularity == 'year':
-            self.current_period = self.current_period.replace(year=self.current_period.year + 1)
+        self.current_period = self.shift_period(self.current_period, self.granularity, 1)
         self.update_chart()
@@ -0,0 +1,173 @@
+"""
+Локальный журнал отметок карт на время потери связи с базой.
+
+Пока база недоступна, вход и выход решаются по индексу карт (card_index.py) и записываются
+в SQLite-файл рядом с приложением. После восстановления связи главное окно передаёт отметки
+на сервер по порядку пачками (database.apply_taps). У каждой отметки свой UUID,
+поэтому повторная передача после обрыва не создаёт второго посещения.
+
+Настройки (секция [offline] config.ini):
+    journal            — путь к файлу журнала, по умолчанию checkin_journal.sqlite3 рядом с приложением
+    replay_interval_ms — как часто проверять журнал и передавать накопившиеся отметки
+"""
+import datetime
+import logging
+import sqlite3
+import threading
+import uuid
+from contextlib import closing
+from pathlib import Path
+
+from config import get_setting
+from constants import DIR_APPLICATION
+from database import apply_taps, TAP_ERROR
+
+logger = logging.getLogger(__name__)
+
+# Сколько отметок передавать одним запросом
+REPLAY_BATCH_SIZE = 100
+
+# Результаты передачи, при которых отметка применена без расхождений с данными сервера
+APPLIED_STATUSES = ("entered", "exited")
+
+REPLAY_CONFLICTS = {
+    "over_limit": "посещение записано, но лимит абонемента уже был исчерпан",
+    "already_in_gym": "вход не записан: клиент уже отмечен в зале",
+    "not_in_gym": "выход не записан: у клиента нет открытого посещения",
+    "unknown_card": "карта не привязана ни к одному клиенту",
+    # Отказы по абонементу при передаче текущих отметок (database.apply_taps с live=True)
+    "no_subscription": "вход не записан: у клиента нет абонемента",
+    "expired": "вход не записан: абонемент просрочен",
+    "invalid": "вход не записан: абонемент недействителен",
+    "frozen": "вход не записан: абонемент заморожен",
+    "morning_only": "вход не записан: абонемент действует только до 16:00",
+    "evening_only": "вход не записан: абонемент действует только после 16:00",
+    "limit_reached": "вход не записан: лимит посещений исчерпан",
+    TAP_ERROR: "отметка не применена из-за ошибки на сервере, подробности в журнале приложения",
+}
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS taps (
+        seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+        tap_id      TEXT NOT NULL UNIQUE,
+        card        TEXT NOT NULL,
+        client_id   INTEGER,
+        action      TEXT NOT NULL,
+        tapped_at   TEXT NOT NULL,
+        status      TEXT,
+        visit_id    INTEGER,
+        replayed_at TEXT
+    )
+"""
+
+
+class CheckinJournal:
+    """
+    Журнал отметок в SQLite. Отметка без status ещё не передана на сервер;
+    отметка со status = TAP_ERROR не применена сервером и остаётся в журнале для разбора.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        # Отметка должна пережить падение приложения и отключение питания
+        conn.execute("PRAGMA synchronous = FULL")
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute(_SCHEMA)
+            self._initialized = True
+        return conn
+
+    def append(self, card_number, action, client_id=None):
+        """Записывает новую отметку (action: enter или exit) и возвращает её tap_id."""
+        tap = new_tap(card_number, action, client_id)
+        self.append_taps([tap])
+        return tap["tap_id"]
+
+    def append_taps(self, taps):
+        """
+        Записывает отметки, уже получившие tap_id, например пачку, которую не удалось передать на сервер.
+        Отметка, уже записанная в журнал, повторно не добавляется.
+        """
+        with self.lock, closing(self._connect()) as conn, conn:
+            conn.executemany("INSERT OR IGNORE INTO taps (tap_id, card, client_id, action, tapped_at) "
+                             "VALUES (?, ?, ?, ?, ?)",
+                             [(tap["tap_id"], tap["card"], tap.get("client_id"), tap["action"],
+                               tap["tapped_at"].isoformat(sep=" ", timespec="seconds")) for tap in taps])
+        logger.info(f"В локальный журнал записано отметок: {len(taps)}")
+
+    def pending(self):
+        """Непереданные отметки в порядке записи."""
+        with self.lock, closing(self._connect()) as conn:
+            rows = conn.execute("SELECT tap_id, card, client_id, action, tapped_at FROM taps "
+                                "WHERE status IS NULL ORDER BY seq").fetchall()
+        return [{"tap_id": tap_id, "card": card, "client_id": client_id, "action": action,
+                 "tapped_at": datetime.datetime.fromisoformat(tapped_at)}
+                for tap_id, card, client_id, action, tapped_at in rows]
+
+    def pending_count(self):
+        if not self.path.exists():
+            return 0
+        with self.lock, closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM taps WHERE status IS NULL").fetchone()[0]
+
+    def mark_replayed(self, taps, results):
+        """Сохраняет результаты передачи отметок: results — (status, visit_id) в порядке taps."""
+        replayed_at = datetime.datetime.now().isoformat(sep=" ", timespec="seconds")
+        with self.lock, closing(self._connect()) as conn, conn:
+            conn.executemany("UPDATE taps SET status = ?, visit_id = ?, replayed_at = ? WHERE tap_id = ?",
+                             [(status, visit_id, replayed_at, tap["tap_id"])
+                              for tap, (status, visit_id) in zip(taps, results)])
+
+
+def new_tap(card_number, action, client_id=None):
+    """Отметка карты, решённая на рабочем месте: action — enter или exit."""
+    return {"tap_id": str(uuid.uuid4()), "card": card_number, "client_id": client_id, "action": action,
+            "tapped_at": datetime.datetime.now().replace(microsecond=0)}
+
+
+def tap_conflicts(taps, results):
+    """Отметки, результат передачи которых расходится с решением рабочего места: [(отметка, status)]."""
+    conflicts = []
+    for tap, (status, _) in zip(taps, results):
+        if status not in APPLIED_STATUSES:
+            logger.warning(f"Конфликт при передаче отметки {tap['tap_id']} карты {tap['card']}: {status}")
+            conflicts.append((tap, status))
+    return conflicts
+
+
+def replay_journal(journal):
+    """
+    Передаёт непереданные отметки на сервер по порядку пачками. При потере связи передача останавливается,
+    чтобы выход клиента не попал на сервер раньше его входа; оставшиеся отметки уйдут при следующей попытке.
+    Отметка, которую сервер не смог применить, отмечается результатом TAP_ERROR и не задерживает очередь.
+    :return: (число переданных отметок, список конфликтов [(отметка, status)])
+    """
+    replayed = 0
+    conflicts = []
+    pending = journal.pending()
+    for start in range(0, len(pending), REPLAY_BATCH_SIZE):
+        taps = pending[start:start + REPLAY_BATCH_SIZE]
+        results = apply_taps(taps, live=False)
+        if results is None:
+            break
+        journal.mark_replayed(taps, results)
+        replayed += len(taps)
+        conflicts.extend(tap_conflicts(taps, results))
+    if replayed:
+        logger.info(f"Из локального журнала передано отметок: {replayed}, конфликтов: {len(conflicts)}")
+    return replayed, conflicts
+
+
+def describe_conflict(tap, status):
+    """Строка отчёта о конфликте для администратора."""
+    action = "вход" if tap["action"] == "enter" else "выход"
+    reason = REPLAY_CONFLICTS.get(status, status)
+    return f"{tap['tapped_at']:%d.%m %H:%M}, карта {tap['card']}, {action}: {reason}"
+
+
+checkin_journal = CheckinJournal(get_setting("offline", "journal", DIR_APPLICATION / "checkin_journal.sqlite3"))
@@ -0,0 +1,348 @@
+import logging
+
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QRect, QSize, QSortFilterProxyModel, pyqtSignal
+from PyQt5.QtGui import QColor, QFont, QFontMetrics, QPainter, QPen
+from PyQt5.QtWidgets import QListView, QStyledItemDelegate, QAbstractItemView, QStyle
+
+from client_search_index import ClientSearchIndex
+
+logger = logging.getLogger(__name__)
+
+# Роль модели, по которой отдаётся словарь клиента целиком
+ClientRole = Qt.UserRole + 1
+
+ACTIVE_COLOR = QColor("#05A9A3")
+INACTIVE_COLOR = QColor("#75A9A7")
+DELETE_COLOR = QColor("red")
+NO_SUBSCRIPTION = "Абонемент отсутствует"
+
+
+class ClientListModel(QAbstractListModel):
+    """
+    Модель списка клиентов. Каждый клиент — словарь с ключами id, name, phone, status,
+    subscription, trainer, start_date (в окне добавления слота — client_id, name, phone, tariff ...).
+    """
+
+    def __init__(self, id_key="id", parent=None):
+        super().__init__(parent)
+        self.id_key = id_key
+        self.clients = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.clients)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.clients):
+            return None
+        client = self.clients[index.row()]
+        if role == Qt.DisplayRole:
+            return client.get("name")
+        if role == ClientRole:
+            return client
+        return None
+
+    def set_clients(self, clients):
+        self.beginResetModel()
+        self.clients = list(clients)
+        self.endResetModel()
+
+    def append_clients(self, clients):
+        if not clients:
+            return
+        first = len(self.clients)
+        self.beginInsertRows(QModelIndex(), first, first + len(clients) - 1)
+        self.clients.extend(clients)
+        self.endInsertRows()
+
+    def row_of(self, client_id):
+        for row, client in enumerate(self.clients):
+            if client.get(self.id_key) == client_id:
+                return row
+        return None
+
+    def client_at(self, row):
+        return self.clients[row] if 0 <= row < len(self.clients) else None
+
+    def update_client(self, client_id, **fields):
+        """Обновляет поля клиента и перерисовывает только его строку."""
+        row = self.row_of(client_id)
+        if row is None:
+            return
+        self.clients[row].update(fields)
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+    def remove_client(self, client_id):
+        row = self.row_of(client_id)
+        if row is None:
+            return
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.clients[row]
+        self.endRemoveRows()
+
+
+class ClientFilterProxyModel(QSortFilterProxyModel):
+    """
+    Фильтрует список клиентов по поисковому индексу. Индекс строится один раз и
+    поддерживается по сигналам исходной модели, на каждое нажатие клавиши проверяется
+    только множество ID, найденное индексом.
+    """
+
+    def __init__(self, source_model, parent=None):
+        super().__init__(parent)
+        self.index = ClientSearchIndex()
+        self.query = ""
+        self.matching_ids = None  # None — фильтр не задан
+        # Индекс обновляется раньше, чем прокси-модель обработает те же сигналы и заново отфильтрует строки
+        source_model.modelReset.connect(self.rebuild_index)
+        source_model.rowsInserted.connect(self.on_rows_inserted)
+        source_model.rowsAboutToBeRemoved.connect(self.on_rows_about_to_be_removed)
+        source_model.dataChanged.connect(self.on_data_changed)
+        self.setSourceModel(source_model)
+        self.rebuild_index()
+
+    def _add_rows(self, first, last):
+        model = self.sourceModel()
+        for row in range(first, last + 1):
+            client = model.client_at(row)
+            self.index.add(client.get(model.id_key), client.get("name"), client.get("phone"))
+
+    def rebuild_index(self):
+        self.index.clear()
+        self._add_rows(0, self.sourceModel().rowCount() - 1)
+        self.matching_ids = self.index.search(self.query)
+
+    def on_rows_inserted(self, parent, first, last):
+        self._add_rows(first, last)
+        self.matching_ids = self.index.last_result
+
+    def on_rows_about_to_be_removed(self, parent, first, last):
+        model = self.sourceModel()
+        for row in range(first, last + 1):
+            self.index.remove(model.client_at(row).get(model.id_key))
+
+    def on_data_changed(self, top_left, bottom_right, roles=()):
+        self._add_rows(top_left.row(), bottom_right.row())
+        self.matching_ids = self.index.last_result
+
+    def set_query(self, text):
+        self.query = text
+        self.matching_ids = self.index.search(text)
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if self.matching_ids is None:
+            return True
+        model = self.sourceModel()
+        client = model.client_at(source_row)
+        return client is not None and client.get(model.id_key) in self.matching_ids
+
+
+class ClientItemDelegate(QStyledItemDelegate):
+    """
+    Рисует карточку клиента без создания виджетов.
+    Полная карточка: статус и телефон, абонемент, имя, тренер, дата начала и кнопка удаления.
+    Компактная карточка (окно добавления слота): имя и телефон.
+    """
+    ROW_HEIGHT = 96
+    COMPACT_ROW_HEIGHT = 64
+    MARGIN = 5
+    PADDING = 12
+    DELETE_SIZE = 30
+
+    def __init__(self, compact=False, show_delete=False, parent=None):
+        super().__init__(parent)
+        self.compact = compact
+        self.show_delete = show_delete and not compact
+
+        self.text_font = self._font(14, QFont.Bold)
+        self.name_font = self._font(18 if not compact else 16, QFont.Bold)
+        self.small_font = self._font(13, QFont.Bold)
+        self.phone_font = self._font(14, QFont.Normal)
+        # Метрики шрифтов создаются один раз, а не при каждой отрисовке строки
+        self.metrics = {font.key(): QFontMetrics(font)
+                        for font in (self.text_font, self.name_font, self.small_font, self.phone_font)}
+
+    @staticmethod
+    def _font(pixel_size, weight):
+        font = QFont("Unbounded")
+        font.setPixelSize(pixel_size)
+        font.setWeight(weight)
+        return font
+
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), self.COMPACT_ROW_HEIGHT if self.compact else self.ROW_HEIGHT)
+
+    def card_rect(self, rect):
+        return rect.adjusted(self.MARGIN, self.MARGIN, -self.MARGIN, -self.MARGIN)
+
+    def layout(self, rect):
+        """Возвращает прямоугольники областей карточки (для отрисовки и для обработки нажатий)."""
+        card = self.card_rect(rect)
+        inner = card.adjusted(self.PADDING, 6, -self.PADDING, -6)
+        areas = {"card": card}
+        if self.compact:
+            line_height = inner.height() // 2
+            areas["name"] = QRect(inner.left(), inner.top(), inner.width(), line_height)
+            areas["phone"] = QRect(inner.left(), inner.top() + line_height, inner.width(), line_height)
+            return areas
+
+        if self.show_delete:
+            areas["delete"] = QRect(inner.right() - self.DELETE_SIZE + 1,
+                                    inner.center().y() - self.DELETE_SIZE // 2,
+                                    self.DELETE_SIZE, self.DELETE_SIZE)
+            inner.setRight(inner.right() - self.DELETE_SIZE - 8)
+
+        line_height = inner.height() // 3
+        left_width = inner.width() * 5 // 9
+        right_width = inner.width() - left_width
+        for line, (left, right) in enumerate((("status", "subscription"), ("name", "trainer"), ("start_date", None))):
+            top = inner.top() + line * line_height
+            areas[left] = QRect(inner.left(), top, left_width, line_height)
+            if right:
+                areas[right] = QRect(inner.left() + left_width, top, right_width, line_height)
+        return areas
+
+    def hit_test(self, rect, pos):
+        """Определяет, в какую кликабельную область карточки попала точка."""
+        areas = self.layout(rect)
+        for name in ("delete", "name", "subscription"):
+            if name in areas and areas[name].contains(pos):
+                return name, areas[name]
+        if areas["card"].contains(pos):
+            return "card", areas["card"]
+        return None, None
+
+    def paint(self, painter, option, index):
+        client = index.data(ClientRole)
+        if client is None:
+            return
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        areas = self.layout(option.rect)
+
+        border_color = ACTIVE_COLOR if option.state & QStyle.State_Selected else INACTIVE_COLOR
+        painter.setPen(QPen(border_color, 3))
+        painter.setBrush(Qt.white)
+        painter.drawRoundedRect(areas["card"], 12, 12)
+
+        if self.compact:
+            self._draw_text(painter, areas["name"], client.get("name", ""), self.name_font, Qt.black)
+            self._draw_text(painter, areas["phone"], client.get("phone", ""), self.phone_font, QColor("#555"))
+        else:
+            self._paint_full(painter, areas, client)
+        painter.restore()
+
+    def _paint_full(self, painter, areas, client):
+        status = client.get("status", "")
+        status_color = ACTIVE_COLOR if "В зале" in status else INACTIVE_COLOR
+        status_rect = areas["status"]
+        status_width = self.metrics[self.text_font.key()].horizontalAdvance(status)
+        self._draw_text(painter, status_rect, status, self.text_font, status_color)
+        phone_rect = status_rect.adjusted(status_width + 5, 0, 0, 0)
+        self._draw_text(painter, phone_rect, client.get("phone", ""), self.text_font, Qt.black)
+
+        subscription = client.get("subscription") or NO_SUBSCRIPTION
+        subscription_valid = client.get("subscription_valid", True)
+        subscription_color = (ACTIVE_COLOR if subscription != NO_SUBSCRIPTION and subscription_valid
+                              else INACTIVE_COLOR)
+        self._draw_text(painter, areas["subscription"], subscription, self.text_font, subscription_color,
+                        Qt.AlignRight)
+
+        self._draw_text(painter, areas["name"], client.get("name", ""), self.name_font, Qt.black)
+
+        trainer = client.get("trainer", "")
+        trainer_color = ACTIVE_COLOR if "Тренер" in trainer else INACTIVE_COLOR
+        self._draw_text(painter, areas["trainer"], trainer, self.text_font, trainer_color, Qt.AlignRight)
+
+        self._draw_text(painter, areas["start_date"], f"С {client.get('start_date') or ''}", self.small_font,
+                        ACTIVE_COLOR)
+
+        if "delete" in areas:
+            painter.setPen(QPen(DELETE_COLOR, 2))
+            painter.setBrush(Qt.NoBrush)
+            painter.drawRoundedRect(areas["delete"], 5, 5)
+            self._draw_text(painter, areas["delete"], "✖", self.text_font, DELETE_COLOR, Qt.AlignCenter)
+
+    def _draw_text(self, painter, rect, text, font, color, alignment=Qt.AlignLeft):
+        painter.setFont(font)
+        painter.setPen(QColor(color))
+        elided = self.metrics[font.key()].elidedText(str(text), Qt.ElideRight, rect.width())
+        painter.drawText(rect, alignment | Qt.AlignVCenter, elided)
+
+
+class ClientListView(QListView):
+    """
+    Список клиентов на модели и делегате: строки рисуются делегатом,
+    память и отрисовка не зависят от количества клиентов.
+    Сигнал area_clicked(область, клиент, прямоугольник области в глобальных координатах)
+    отправляется при нажатии на имя, абонемент, кнопку удаления или на карточку.
+    """
+    area_clicked = pyqtSignal(str, object, QRect)
+
+    def __init__(self, compact=False, show_delete=False, id_key="id", parent=None):
+        super().__init__(parent)
+        self.client_model = ClientListModel(id_key, self)
+        self.proxy_model = ClientFilterProxyModel(self.client_model, self)
+        self.client_delegate = ClientItemDelegate(compact, show_delete, self)
+        self.setModel(self.proxy_model)
+        self.setItemDelegate(self.client_delegate)
+
+        self.setUniformItemSizes(True)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.verticalScrollBar().setSingleStep(20)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setSelectionMode(QAbstractItemView.SingleSelection if compact else QAbstractItemView.NoSelection)
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.setFocusPolicy(Qt.NoFocus)
+        self.setMouseTracking(True)
+        self.setObjectName("client_list_view")
+        self.setStyleSheet("""
+            QListView#client_list_view {
+                border: none;
+                background-color: white;
+            }
+            QScrollBar:vertical {
+                width: 8px;
+                background: white;
+            }
+            QScrollBar::handle:vertical {
+                background: #75A9A7;
+                border-radius: 4px;
+            }
+        """)
+
+    def row_height(self):
+        return self.client_delegate.COMPACT_ROW_HEIGHT if self.client_delegate.compact \
+            else self.client_delegate.ROW_HEIGHT
+
+    def content_fits(self):
+        """True, если все строки помещаются в окне и прокручивать нечего."""
+        return self.proxy_model.rowCount() * self.row_height() <= self.viewport().height()
+
+    def set_filter(self, text):
+        """Показывает только клиентов, подходящих под строку поиска."""
+        self.proxy_model.set_query(text)
+
+    def _area_at(self, pos):
+        index = self.indexAt(pos)
+        if not index.isValid():
+            return None, None, None
+        area, rect = self.client_delegate.hit_test(self.visualRect(index), pos)
+        return index, area, rect
+
+    def mouseMoveEvent(self, event):
+        _, area, _ = self._area_at(event.pos())
+        clickable = area in ("name", "subscription", "delete") or (area and self.client_delegate.compact)
+        self.viewport().setCursor(Qt.PointingHandCursor if clickable else Qt.ArrowCursor)
+        super().mouseMoveEvent(event)
+
+    def mouseReleaseEvent(self, event):
+        super().mouseReleaseEvent(event)
+        if event.button() != Qt.LeftButton:
+            return
+        index, area, rect = self._area_at(event.pos())
+        if area is None:
+            return
+        global_rect = QRect(self.viewport().mapToGlobal(rect.topLeft()), rect.size())
+        self.area_clicked.emit(area, index.data(ClientRole), global_rect)
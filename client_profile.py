@@ -1,11 +1,20 @@
-from PyQt5.QtCore import Qt, QPoint, QRectF, QTime, pyqtSignal
+from PyQt5.QtCore import Qt, QPoint, QRectF, QTime, QTimer, pyqtSignal
 from PyQt5.QtGui import QPainter, QPen, QColor
 from PyQt5.QtWidgets import QLabel, QScrollArea, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QFrame, QGridLayout, \
     QSizePolicy, QLineEdit, QMessageBox
+import logging
 from datetime import datetime
 
-from database import execute_query
+from database import execute_query, transaction, fetch_visit_history, get_client_profile, VISIT_HISTORY_COLUMNS, \
+    day_range
 from hover_button import HoverButton
+
+logger = logging.getLogger(__name__)
+
+HISTORY_PREFETCH_DISTANCE = 150  # за сколько пикселей до конца истории подгружать следующую страницу
+SKELETON_COLOR = "#D9E8E7"  # цвет заглушек, пока профиль загружается
+
+
 def some_function():
     from hover_button import HoverButton  # Импорт внутри функции
     button = HoverButton()
@@ -26,6 +35,11 @@ class ClientProfileWindow(QWidget):
         self.oldPos = self.pos()
         self.radius = 18
         self.borderWidth = 5
+        self.visit_widgets = {}  # visit_id -> виджет строки истории посещений
+        self.history_cursor = None  # курсор следующей страницы истории, None — страниц больше нет
+        self.history_generation = 0  # номер загрузки истории, ответы старых загрузок отбрасываются
+        self.history_workers = []  # потоки загрузки истории до их завершения
+        self.history_loading = False
         from utils import center
         center(self)
         self.init_ui()
@@ -173,6 +187,7 @@ class ClientProfileWindow(QWidget):
         self.container_layout.addWidget(self.add_visit_button, alignment=Qt.AlignTop | Qt.AlignHCenter)
 
         self.scroll_area.setWidget(self.container_widget)
+        self.scroll_area.verticalScrollBar().valueChanged.connect(self.on_history_scroll)
         self.history_layout.addWidget(self.scroll_area)
 
         horizontal_layout.addWidget(self.history_frame)
@@ -186,156 +201,138 @@ class ClientProfileWindow(QWidget):
 
         self.load_client_data()
 
-    def load_client_data(self):
-        # Загружаем данные о клиенте
-        query = """
-        WITH client_data AS (
-        SELECT 
-            c.client_id,
-            c.surname || ' ' || c.first_name AS name,
-            c.phone_number AS phone,
-            c.membership_start_date AS start_date,
-            s.tariff AS subscription_type,
-            s.valid_since AS subscription_start,
-            s.valid_until AS subscription_end,
-            s.visit_ids AS visits,
-            t.surname || ' ' || t.first_name AS trainer_name,
-            v.in_gym AS status,
-            ts.start_time AS next_training_start,
-            ts.end_time AS next_training_end,
-            tr.surname || ' ' || tr.first_name AS next_trainer_name,
-            s.is_valid -- Добавляем столбец is_valid
-        FROM client c
-        LEFT JOIN subscription s ON c.subscription = s.subscription_id
-        LEFT JOIN trainer t ON c.client_id = t.trainer_id
-        LEFT JOIN visit_fitness_room v ON c.client_id = v.client
-        LEFT JOIN LATERAL (
-            SELECT ts.start_time, ts.end_time, ts.trainer
-            FROM training_slots ts
-            WHERE ts.client = c.client_id
-              AND ts.start_time > NOW()
-            ORDER BY ts.start_time ASC
-            LIMIT 1
-        ) ts ON true
-        LEFT JOIN trainer tr ON ts.trainer = tr.trainer_id
-        WHERE c.client_id = %s
-    )
-    SELECT 
-        client_id,
-        name,
-        phone,
-        TO_CHAR(start_date, 'DD.MM.YY') AS start_date,
-        subscription_type,
-        TO_CHAR(subscription_start, 'DD.MM.YY') || ' - ' || TO_CHAR(subscription_end, 'DD.MM.YY') AS subscription_period,
-        COALESCE(array_length(visits, 1), 0) AS visits_count,
-        trainer_name,
-        CASE 
-            WHEN status = TRUE THEN '● В зале'
-            ELSE '○ Вне зала'
-        END AS status,
-        TO_CHAR(next_training_start, 'DD.MM.YY HH24:MI') AS next_training_start,
-        TO_CHAR(next_training_end, 'DD.MM.YY HH24:MI') AS next_training_end,
-        next_trainer_name,
-        is_valid 
-    FROM client_data;
+    def show_skeleton(self):
         """
-        result = execute_query(query, (self.client_id,))
-        if result:
-            client_data = result[0]
-            is_valid = client_data[12]  # Индекс колонки is_valid
-
-            # Проверяем наличие незавершённого посещения
-            active_visit_query = """
-                    SELECT time_start, time_end, in_gym
-                    FROM visit_fitness_room
-                    WHERE client = %s AND in_gym = TRUE AND time_end IS NULL
-                    LIMIT 1;
-                    """
-            active_visit_result = execute_query(active_visit_query, (self.client_id,))
-            has_active_visit = bool(active_visit_result)  # True, если есть активное посещение без time_end
-
-            if not is_valid:
-                # Абонемент не активен
-                self.add_visit_button.setEnabled(False)
-                self.add_visit_button.setText("Абонемент не активен")
-                self.add_visit_button.set_border_color("#FF0000")
-                self.add_visit_button.set_font_color("#FF0000")
-                self.add_visit_button.set_hover_border_color("#FF0000")
-                self.add_visit_button.set_hover_text_color("#FF0000")
-            else:
-                if has_active_visit:
-                    # Если клиент находится в зале без завершённого посещения
-                    self.add_visit_button.setEnabled(True)
-                    self.add_visit_button.setText("Закончить посещение")
-                    self.add_visit_button.set_border_color("#FFA500")
-                    self.add_visit_button.set_font_color("#FFA500")
-                    self.add_visit_button.set_hover_border_color("#FFB347")
-                    self.add_visit_button.set_hover_text_color("#FFB347")
-                    # Переназначаем действие кнопки на завершение посещения
-                    self.add_visit_button.clicked.disconnect()
-                    self.add_visit_button.clicked.connect(self.finish_visit)
-                else:
-                    # Клиент не в зале или посещение завершено
-                    self.add_visit_button.setEnabled(True)
-                    self.add_visit_button.setText("Добавить посещение")
-                    self.add_visit_button.set_border_color("#45DB77")
-                    self.add_visit_button.set_font_color("#45DB77")
-                    self.add_visit_button.set_hover_border_color("#4BFF87")
-                    self.add_visit_button.set_hover_text_color("#4BFF87")
-                    # Переназначаем действие кнопки на добавление нового посещения
-                    self.add_visit_button.clicked.disconnect()
-                    self.add_visit_button.clicked.connect(self.show_add_visit_widget)
-
-            self.update_ui_with_client_data(result[0])
-
-        visit_query = """
-            SELECT 
-            v.visit_id,  -- Добавляем visit_id
-            TO_CHAR(v.time_start, 'DD.MM.YY') AS date,
-            TO_CHAR(v.time_start, 'HH24:MI') || ' - ' || TO_CHAR(v.time_end, 'HH24:MI') AS time,
-            CASE 
-                WHEN s.tariff IS NOT NULL THEN 'По абонементу'
-                ELSE 'Разовое посещение'
-            END AS type,
-            CASE 
-                WHEN s.tariff IS NOT NULL AND s.tariff != 'one_time' THEN 
-                    TO_CHAR(s.valid_since, 'DD.MM.YY') || ' - ' || TO_CHAR(s.valid_until, 'DD.MM.YY')
-                ELSE ''
-            END AS period
-            FROM visit_fitness_room v
-            LEFT JOIN client c ON v.client = c.client_id
-            LEFT JOIN subscription s ON c.subscription = s.subscription_id
-            WHERE v.client = %s
-            AND v.time_end IS NOT NULL
-            ORDER BY v.time_start DESC;
+        Показывает заглушки вместо данных клиента, пока профиль загружается.
+        Исходные стили надписей запоминаются и возвращаются в apply_client_data.
         """
+        self.skeleton_styles = {}
+        for label, width in ((self.name_label, 12), (self.status_label, 6), (self.phone_label, 10),
+                             (self.start_date_label, 6), (self.subscription_label, 16), (self.trainer_label, 14)):
+            self.skeleton_styles[label] = label.styleSheet()
+            label.setText("▬" * width)
+            label.setStyleSheet(label.styleSheet() + f" color: {SKELETON_COLOR};")
+        self.add_visit_button.setEnabled(False)
+        self.add_visit_button.setText("Загрузка...")
+
+    def hide_skeleton(self):
+        for label, style in self.skeleton_styles.items():
+            label.setStyleSheet(style)
+        self.skeleton_styles = {}
 
-        visit_results = execute_query(visit_query, (self.client_id,))
-
-        # Очищаем старые записи о посещениях перед добавлением новых
-        for i in reversed(range(self.container_layout.count())):
-            item = self.container_layout.itemAt(i)
-            widget = item.widget()
-            # Удаляем только записи посещений, не затрагивая кнопку "Добавить"
-            if widget and widget is not self.add_visit_button:
-                widget.setParent(None)
-                widget.deleteLater()
-
-        if visit_results:
-            self.existing_visits = [{
-                'visit_id': visit[0],  # Добавляем visit_id
-                'date': visit[1],
-                'time': visit[2],
-                'type': visit[3],
-                'period': visit[4] if visit[3] == "По абонементу" else ""
-            } for visit in visit_results]
-
-            self.container_layout.insertWidget(0, self.add_visit_button)
-            for visit in self.existing_visits:
-                visit_widget = self.create_visit_widget(visit)
-                self.container_layout.insertWidget(1, visit_widget)
+    def load_client_data(self):
+        """Загружает данные профиля в фоновом потоке, окно сразу показывает заглушки."""
+        from utils import WorkerThread  # utils импортирует этот модуль
+        self.show_skeleton()
+        self.profile_worker = WorkerThread(get_client_profile, self.client_id)
+        self.profile_worker.result_signal.connect(self.on_client_data_loaded)
+        self.profile_worker.start()
+
+    def on_client_data_loaded(self, client_data):
+        self.hide_skeleton()
+        if client_data is None:
+            self.name_label.setText("Не удалось загрузить профиль")
+            for label in (self.status_label, self.phone_label, self.start_date_label, self.subscription_label,
+                          self.trainer_label):
+                label.setText("")
+            self.add_visit_button.setText("Нет данных")
+            return
+
+        if not client_data["is_valid"]:
+            # Абонемент не активен
+            self.add_visit_button.setEnabled(False)
+            self.add_visit_button.setText("Абонемент не активен")
+            self.add_visit_button.set_border_color("#FF0000")
+            self.add_visit_button.set_font_color("#FF0000")
+            self.add_visit_button.set_hover_border_color("#FF0000")
+            self.add_visit_button.set_hover_text_color("#FF0000")
+        elif client_data["has_active_visit"]:
+            # Если клиент находится в зале без завершённого посещения
+            self.update_button_for_finish_visit()
         else:
-            self.existing_visits = []
+            # Клиент не в зале или посещение завершено
+            self.update_button_for_add_visit()
+
+        self.update_ui_with_client_data(client_data)
+
+        # История посещений загружается после шапки профиля
+        self.reload_visit_history()
+
+    def reload_visit_history(self):
+        """Очищает историю посещений и загружает её первую страницу в фоновом потоке."""
+        for widget in self.visit_widgets.values():
+            widget.setParent(None)
+            widget.deleteLater()
+        self.visit_widgets = {}
+        self.history_generation += 1
+        self.history_cursor = None
+        self.fetch_history_page(None)
+
+    def fetch_history_page(self, cursor):
+        from utils import WorkerThread  # utils импортирует этот модуль
+        # Завершившиеся потоки удаляются здесь, а не по сигналу finished, чтобы объект QThread
+        # не уничтожался, пока поток ещё выходит из run()
+        self.history_workers = [w for w in self.history_workers if not w.isFinished()]
+        generation = self.history_generation
+        worker = WorkerThread(fetch_visit_history, self.client_id, cursor)
+        worker.result_signal.connect(
+            lambda result, generation=generation: self.on_history_page_loaded(result, generation))
+        worker.finished.connect(self.on_history_fetch_finished)
+        self.history_workers.append(worker)
+        self.history_loading = True
+        worker.start()
+
+    def on_history_fetch_finished(self):
+        # Поток, пославший сигнал, может ещё выполняться, поэтому он не учитывается
+        self.history_loading = any(w.isRunning() for w in self.history_workers if w is not self.sender())
+
+    def load_next_history_page(self):
+        if self.history_cursor is None or self.history_loading:
+            return
+        self.fetch_history_page(self.history_cursor)
+
+    @staticmethod
+    def visit_from_row(row):
+        visit_id, date, time, visit_type, period = row
+        return {
+            'visit_id': visit_id,
+            'date': date,
+            'time': time,
+            'type': visit_type,
+            'period': period if visit_type == "По абонементу" else ""
+        }
+
+    def on_history_page_loaded(self, result, generation):
+        if result is None or generation != self.history_generation:
+            return
+        rows, self.history_cursor = result
+        for row in rows:
+            # Посещение могло уже появиться в начале истории после добавления или завершения
+            if row[0] not in self.visit_widgets:
+                self.append_visit_widget(self.visit_from_row(row))
+        # Страница поместилась целиком и прокрутки нет — подгружаем следующую
+        QTimer.singleShot(0, self.check_history_fill)
+
+    def check_history_fill(self):
+        if self.container_widget.sizeHint().height() <= self.scroll_area.viewport().height():
+            self.load_next_history_page()
+
+    def on_history_scroll(self, value):
+        scroll_bar = self.scroll_area.verticalScrollBar()
+        if value >= scroll_bar.maximum() - HISTORY_PREFETCH_DISTANCE:
+            self.load_next_history_page()
+
+    def append_visit_widget(self, visit):
+        """Добавляет строку посещения в конец истории (более старые посещения)."""
+        visit_widget = self.create_visit_widget(visit)
+        self.visit_widgets[visit['visit_id']] = visit_widget
+        self.container_layout.addWidget(visit_widget, alignment=Qt.AlignTop | Qt.AlignHCenter)
+
+    def prepend_visit_widget(self, visit):
+        """Добавляет строку нового посещения в начало истории, сразу под кнопкой."""
+        visit_widget = self.create_visit_widget(visit)
+        self.visit_widgets[visit['visit_id']] = visit_widget
+        self.container_layout.insertWidget(1, visit_widget, alignment=Qt.AlignTop | Qt.AlignHCenter)
 
     def finish_visit(self):
         # Запрос для получения текущего активного посещения
@@ -360,19 +357,27 @@ class ClientProfileWindow(QWidget):
             else:
                 time_end = current_time
 
-            # Обновляем запись посещения в БД
-            update_query = """
-            UPDATE visit_fitness_room
-            SET time_end = %s, in_gym = FALSE
-            WHERE visit_id = %s
-            RETURNING time_start, time_end;
+            # Обновляем запись посещения в БД и получаем её строку для истории
+            update_query = f"""
+            WITH v AS (
+                UPDATE visit_fitness_room
+                SET time_end = %s, in_gym = FALSE
+                WHERE visit_id = %s
+                RETURNING visit_id, time_start, time_end, subscription
+            )
+            SELECT {VISIT_HISTORY_COLUMNS}
+            FROM v
+            LEFT JOIN subscription s ON v.subscription = s.subscription_id;
             """
             update_result = execute_query(update_query, (time_end, visit_id))
 
             if update_result:
                 self.status_updated.emit("○ Вне зала")
+                self.status_label.setText('<span style="font-size: 28px;">○</span> <span>Вне зала</span>')
+                self.update_button_for_add_visit()
+                # Обновляется только строка завершённого посещения, история не перезагружается
+                self.prepend_visit_widget(self.visit_from_row(update_result[0]))
                 QMessageBox.information(self, "Успех", "Посещение успешно завершено.")
-                self.load_client_data()
 
             else:
                 # Ошибка при обновлении
@@ -385,7 +390,8 @@ class ClientProfileWindow(QWidget):
         """
         Настраивает кнопку для добавления нового посещения.
         """
-        self.add_visit_button.setText("Добавить")
+        self.add_visit_button.setEnabled(True)
+        self.add_visit_button.setText("Добавить посещение")
         self.add_visit_button.set_border_color("#45DB77")
         self.add_visit_button.set_font_color("#45DB77")
         self.add_visit_button.set_hover_border_color("#4BFF87")
@@ -397,11 +403,12 @@ class ClientProfileWindow(QWidget):
         """
         Настраивает кнопку для завершения текущего посещения.
         """
+        self.add_visit_button.setEnabled(True)
         self.add_visit_button.setText("Закончить посещение")
-        self.add_visit_button.set_border_color("#FF0000")
-        self.add_visit_button.set_font_color("#FF0000")
-        self.add_visit_button.set_hover_border_color("#FF0000")
-        self.add_visit_button.set_hover_text_color("#FF0000")
+        self.add_visit_button.set_border_color("#FFA500")
+        self.add_visit_button.set_font_color("#FFA500")
+        self.add_visit_button.set_hover_border_color("#FFB347")
+        self.add_visit_button.set_hover_text_color("#FFB347")
         self.add_visit_button.clicked.disconnect()
         self.add_visit_button.clicked.connect(self.finish_visit)
 
@@ -433,34 +440,22 @@ class ClientProfileWindow(QWidget):
             return f"{tariff_type}, Безлимитные занятия"
 
     def update_ui_with_client_data(self, client_data):
-        self.name_label.setText(client_data[1])
-        status = client_data[8]
-        if status == '● В зале':
+        self.name_label.setText(client_data["name"])
+        if client_data["in_gym"]:
             status_html = '<span style="font-size: 28px;">●</span> <span style="vertical-align: middle;">В зале</span>'
         else:
             status_html = '<span style="font-size: 28px;">○</span> <span>Вне зала</span>'
         self.status_label.setText(status_html)
-        self.phone_label.setText(client_data[2])
-        self.start_date_label.setText(f"С {client_data[3]}")
+        self.phone_label.setText(client_data["phone"])
+        self.start_date_label.setText(f"С {client_data['start_date']}")
 
-        subscription_type = client_data[4]
-        subscription_period = client_data[5]
-        visits_count = client_data[6]
+        subscription_type = client_data["subscription_type"]
+        subscription_period = client_data["subscription_period"]
+        visits_count = client_data["visits_count"]
 
         if subscription_type is not None and subscription_period is not None:
-            # Получаем количество посещений по текущему абонементу
-            current_subscription_visits_query = """
-            SELECT COUNT(*)
-            FROM visit_fitness_room v
-            WHERE v.client = %s
-              AND v.time_start >= (SELECT valid_since FROM subscription WHERE subscription_id = (SELECT subscription FROM client WHERE client_id = %s))
-              AND v.time_end <= (SELECT valid_until FROM subscription WHERE subscription_id = (SELECT subscription FROM client WHERE client_id = %s));
-            """
-            current_subscription_visits = \
-                execute_query(current_subscription_visits_query, (self.client_id, self.client_id, self.client_id),
-                              fetch_one=True)[0]
-
-            tariff_description = self.parse_subscription_type(subscription_type, current_subscription_visits)
+            # visits_count — счётчик посещений текущего абонемента
+            tariff_description = self.parse_subscription_type(subscription_type, visits_count)
             if subscription_type == "one_time":
                 self.subscription_label.setText("Разовое посещение")
             else:
@@ -469,16 +464,8 @@ class ClientProfileWindow(QWidget):
                 )
 
             # Проверка заморозки
-            freeze_query = """
-            SELECT frozen_from, frozen_until
-            FROM subscription
-            WHERE subscription_id = (
-                SELECT subscription FROM client WHERE client_id = %s
-            );
-            """
-            freeze_result = execute_query(freeze_query, (self.client_id,))
-            if freeze_result and freeze_result[0][0] and freeze_result[0][1]:
-                frozen_from, frozen_until = freeze_result[0]
+            frozen_from, frozen_until = client_data["frozen_from"], client_data["frozen_until"]
+            if frozen_from and frozen_until:
                 current_date = datetime.now().date()
                 if frozen_from <= current_date <= frozen_until:
                     self.add_visit_button.setText("Абонемент заморожен")
@@ -491,18 +478,13 @@ class ClientProfileWindow(QWidget):
         else:
             self.subscription_label.setText("Абонемент отсутствует")
 
-        trainer_name = client_data[7]
-        if trainer_name:
-            self.trainer_label.setText(trainer_name)
-        else:
-            self.trainer_label.setText("Нет закрепленных тренеров")
-
-        next_training_start = client_data[9]
-        next_training_end = client_data[10]
-        next_trainer_name = client_data[11]
+        next_training_start = client_data["next_training_start"]
+        next_trainer_name = client_data["next_trainer_name"]
 
         if next_training_start and next_trainer_name:
             self.trainer_label.setText(f"{next_trainer_name}\nБлижайшее занятие: {next_training_start}")
+        else:
+            self.trainer_label.setText("Нет закрепленных тренеров")
 
     def create_visit_widget(self, visit):
         visit_widget = QWidget()
@@ -593,27 +575,22 @@ class ClientProfileWindow(QWidget):
 
         return visit_widget
 
-    def delete_visit_by_id(self, visit_id):
-        print(visit_id["visit_id"])
+    def delete_visit_by_id(self, visit):
         delete_query = """
         DELETE FROM visit_fitness_room
         WHERE visit_id = %s;
         """
-        execute_query(delete_query, (visit_id["visit_id"],))
-
-        # 7. Удаляем виджет посещения из контейнера
-        for i in range(self.container_layout.count()):
-            item = self.container_layout.itemAt(i)
-            widget = item.widget()
-            if widget and isinstance(widget, QWidget) and widget.findChild(QLabel, "visit_id"):
-                # Здесь мы проверяем, есть ли у виджета ID посещения, чтобы удалить нужный
-                if widget.findChild(QLabel, "visit_id").text() == str(visit_id):
-                    widget.setParent(None)
-                    widget.deleteLater()
-                    break  # Найден и удален виджет, выходим из цикла
+        execute_query(delete_query, (visit["visit_id"],), fetch=False)
+
+        # Удаляем только строку этого посещения
+        visit_widget = self.visit_widgets.pop(visit["visit_id"], None)
+        if visit_widget is not None:
+            visit_widget.setParent(None)
+            visit_widget.deleteLater()
+        # Счётчик посещений абонемента уменьшил триггер
+        self.update_visit_count()
 
         QMessageBox.information(self, "Удаление посещения", "Посещение успешно удалено.")
-        self.load_client_data()
 
     def show_add_visit_widget(self):
         add_visit_widget = QWidget()
@@ -670,50 +647,36 @@ class ClientProfileWindow(QWidget):
             in_gym = start_datetime <= current_datetime <= end_datetime
 
             # посещение в базу данных
-            insert_query = """
-                    INSERT INTO visit_fitness_room (client, time_start, time_end, in_gym)
-                    VALUES (%s, %s, %s, %s)
-                    RETURNING visit_id;
+            # посещение привязывается к текущему абонементу клиента, счетчик посещений обновляет триггер;
+            # тариф возвращается для обновления счетчика в интерфейсе
+            insert_query = f"""
+                    WITH v AS (
+                        INSERT INTO visit_fitness_room (client, time_start, time_end, in_gym, subscription)
+                        SELECT c.client_id, %s, %s, %s, c.subscription
+                        FROM client c
+                        WHERE c.client_id = %s
+                        RETURNING visit_id, time_start, time_end, subscription
+                    )
+                    SELECT {VISIT_HISTORY_COLUMNS}, s.tariff
+                    FROM v
+                    LEFT JOIN subscription s ON s.subscription_id = v.subscription;
                     """
-            visit_id = \
-            execute_query(insert_query, (self.client_id, start_timestamp, end_timestamp, in_gym), fetch_one=True)[0]
-
-            # тип абонемента
-            subscription_type_query = """
-            SELECT tariff
-            FROM subscription
-            WHERE subscription_id = (
-                SELECT subscription FROM client WHERE client_id = %s
-            );
-            """
-            subscription_type = execute_query(subscription_type_query, (self.client_id,), fetch_one=True)[0]
-
-            update_subscription_query = """
-            UPDATE subscription
-            SET visit_ids = array_append(visit_ids, %s)
-            WHERE subscription_id = (
-                SELECT subscription FROM client WHERE client_id = %s
-            );
-            """
-            execute_query(update_subscription_query, (visit_id, self.client_id))
-
-            # виджет для нового посещения
-            new_visit = {
-                'date': datetime.now().strftime("%d.%m.%y"),
-                'time': f"{start_time} - {end_time}",
-                'type': "По абонементу",
-                'period': self.subscription_label.text().split("Абонемент ")[1].split("\n")[0]
-            }
-            visit_widget = self.create_visit_widget(new_visit)
-
-            self.existing_visits.append(new_visit)
+            try:
+                with transaction() as tx:
+                    result = tx.execute(insert_query, (start_timestamp, end_timestamp, in_gym, self.client_id),
+                                        fetch_one=True)
+                    subscription_type = result[5] or ""
+            except Exception as e:
+                logger.error(f"Ошибка добавления посещения клиента {self.client_id}: {e}")
+                QMessageBox.critical(self, "Ошибка", "Не удалось добавить посещение.")
+                return
 
             self.add_visit_widget.setParent(None)
-
-            self.container_layout.insertWidget(1, visit_widget)
-
             self.container_layout.insertWidget(0, self.add_visit_button)
 
+            # строка нового посещения добавляется в начало истории
+            self.prepend_visit_widget(self.visit_from_row(result[:5]))
+
             # счетчик посещений (если абонемент не безлимитный)
             if "8" in subscription_type or "12" in subscription_type:
                 self.update_visit_count()
@@ -732,7 +695,10 @@ class ClientProfileWindow(QWidget):
         FROM subscription
         WHERE subscription_id = %s;
         """
-        tariff = execute_query(query, (subscription_id,), fetch_one=True)[0]
+        result = execute_query(query, (subscription_id,), fetch_one=True)
+        if not result:
+            return
+        tariff = result[0]
 
         if "8" in tariff or "12" in tariff:
             total_visits = int(tariff.split('_')[0])  # Получаем общее количество посещений (8 или 12)
@@ -757,28 +723,42 @@ class ClientProfileWindow(QWidget):
                 QMessageBox.warning(self, "Ошибка", "Время начала должно быть меньше времени конца.")
                 return False
 
-            # Проверка на пересечение с другими посещениями
-            for visit in self.existing_visits:
-                existing_time = visit['time'].split(" - ")
-                existing_start = QTime.fromString(existing_time[0], "HH:mm")
-                existing_end = QTime.fromString(existing_time[1], "HH:mm")
-                if (start_qtime < existing_end and end_qtime > existing_start):
-                    QMessageBox.warning(self, "Ошибка", "Время посещения пересекается с другим посещением.")
-                    return False
+            # Проверка на пересечение с другими посещениями за сегодня
+            # (история загружается постранично, поэтому проверка идёт в базе)
+            current_date = datetime.now().strftime("%Y-%m-%d")
+            overlap_query = """
+            SELECT 1
+            FROM visit_fitness_room
+            WHERE client = %s
+              AND time_start < %s
+              AND COALESCE(time_end, NOW()) > %s
+            LIMIT 1;
+            """
+            overlap = execute_query(overlap_query, (self.client_id, f"{current_date} {end_time}",
+                                                    f"{current_date} {start_time}"))
+            if overlap is None:
+                QMessageBox.warning(self, "Ошибка", "Не удалось проверить посещения клиента. Попробуйте ещё раз.")
+                return False
+            if overlap:
+                QMessageBox.warning(self, "Ошибка", "Время посещения пересекается с другим посещением.")
+                return False
 
             # Проверка на одно посещение в день для ограниченных абонементов
             subscription_type = self.get_client_tariff()
             if "8" in subscription_type or "12" in subscription_type:
-                current_date = datetime.now().strftime("%Y-%m-%d")
+                current_date = datetime.now().date()
                 check_daily_visit_query = """
                 SELECT COUNT(*)
                 FROM visit_fitness_room
                 WHERE client = %s
-                  AND DATE(time_start) = %s;
+                  AND time_start >= %s AND time_start < %s;
                 """
-                daily_visits_count = \
-                    execute_query(check_daily_visit_query, (self.client_id, current_date), fetch_one=True)[0]
-                if daily_visits_count > 0:
+                result = execute_query(check_daily_visit_query, (self.client_id, *day_range(current_date)),
+                                       fetch_one=True)
+                if result is None:
+                    QMessageBox.warning(self, "Ошибка", "Не удалось проверить посещения клиента. Попробуйте ещё раз.")
+                    return False
+                if result[0] > 0:
                     QMessageBox.warning(self, "Ошибка", "Допустимо не более одного занятия в день.")
                     return False
 
@@ -835,7 +815,7 @@ class ClientProfileWindow(QWidget):
         Обновляет счетчик посещений и отключает кнопку добавления, если количество посещений достигло максимума.
         """
         query = """
-        SELECT s.tariff, array_length(s.visit_ids, 1) AS visits_count
+        SELECT s.tariff, s.visits_used AS visits_count
         FROM client c
         LEFT JOIN subscription s ON c.subscription = s.subscription_id
         WHERE c.client_id = %s;
@@ -0,0 +1,199 @@
+"""
+Поисковый индекс клиентов в памяти.
+
+Для каждого клиента заранее строится нормализованная запись: имя в нижнем регистре,
+его транслитерация латиницей, цифры телефона и ID строкой. Запрос приводится к тем же формам,
+включая вариант, набранный в другой раскладке клавиатуры ("bdfyjd" — "иванов"),
+поэтому совпадения находятся независимо от алфавита и раскладки.
+"""
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Клавиатурные раскладки QWERTY / ЙЦУКЕН, символы на одних и тех же клавишах
+_LAYOUT_EN = "qwertyuiop[]asdfghjkl;'zxcvbnm,.`"
+_LAYOUT_RU = "йцукенгшщзхъфывапролджэячсмитьбюё"
+_EN_TO_RU = str.maketrans(_LAYOUT_EN, _LAYOUT_RU)
+_RU_TO_EN = str.maketrans(_LAYOUT_RU, _LAYOUT_EN)
+
+_TRANSLIT = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh", "з": "z", "и": "i",
+    "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t",
+    "у": "u", "ф": "f", "х": "kh", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "shch", "ъ": "", "ы": "y", "ь": "",
+    "э": "e", "ю": "yu", "я": "ya",
+}
+_TRANSLIT_TABLE = str.maketrans(_TRANSLIT)
+
+# Разные способы записи одних и тех же звуков латиницей сводятся к одному
+_LATIN_FOLDS = (("shch", "sh"), ("sch", "sh"), ("kh", "h"), ("ts", "c"), ("tz", "c"), ("iu", "yu"),
+                ("ia", "ya"), ("j", "y"), ("yo", "e"), ("w", "v"), ("x", "ks"))
+
+# Обратная транслитерация для поиска на сервере, сначала длинные сочетания
+_FROM_LATIN = (("shch", "щ"), ("sch", "щ"), ("zh", "ж"), ("kh", "х"), ("ts", "ц"), ("ch", "ч"), ("sh", "ш"),
+               ("iu", "ю"), ("ia", "я"), ("a", "а"), ("b", "б"),
+               ("v", "в"), ("w", "в"), ("g", "г"), ("d", "д"), ("e", "е"), ("z", "з"), ("i", "и"), ("k", "к"),
+               ("l", "л"), ("m", "м"), ("n", "н"), ("o", "о"), ("p", "п"), ("r", "р"), ("s", "с"), ("t", "т"),
+               ("u", "у"), ("f", "ф"), ("h", "х"), ("c", "к"), ("q", "к"), ("x", "кс"), ("j", "ж"))
+_FROM_LATIN_RE = re.compile("|".join(latin for latin, _ in _FROM_LATIN))
+_FROM_LATIN_MAP = dict(_FROM_LATIN)
+
+_CYRILLIC_RE = re.compile("[а-яё]")
+_LATIN_RE = re.compile("[a-z]")
+
+
+def normalize(text):
+    """Нижний регистр, ё как е, без лишних пробелов."""
+    return " ".join(str(text or "").lower().replace("ё", "е").split())
+
+
+def digits_only(text):
+    return re.sub(r"\D", "", str(text or ""))
+
+
+def phone_digits(text):
+    """Цифры телефона из запроса; запрос с буквами телефоном не считается."""
+    if re.search(r"[^\d\s+\-()]", text):
+        return None
+    return digits_only(text) or None
+
+
+def fold_latin(text):
+    """Транслитерирует текст латиницей и сводит варианты написания к одному."""
+    text = text.translate(_TRANSLIT_TABLE)
+    for source, target in _LATIN_FOLDS:
+        text = text.replace(source, target)
+    return text
+
+
+def swap_layout(text):
+    """Текст, набранный не в той раскладке: латиница в кириллицу и наоборот."""
+    if _CYRILLIC_RE.search(text):
+        return text.translate(_RU_TO_EN)
+    return text.translate(_EN_TO_RU)
+
+
+def _from_latin(text, y_letter):
+    text = text.replace("yu", "ю").replace("ya", "я").replace("yo", "ё").replace("y", y_letter)
+    return _FROM_LATIN_RE.sub(lambda match: _FROM_LATIN_MAP[match.group(0)], text)
+
+
+def search_variants(text):
+    """
+    Варианты строки поиска по имени для сервера, где имена хранятся кириллицей:
+    сама строка, строка в другой раскладке и обратная транслитерация латиницы
+    (y — то «ы», то «й»: Рыжов, Дмитрий).
+    """
+    text = normalize(text)
+    if not text:
+        return []
+    variants = [text]
+    if _LATIN_RE.search(text) and not _CYRILLIC_RE.search(text):
+        variants.append(swap_layout(text))
+        for y_letter in ("ы", "й"):
+            variants.append(_from_latin(text, y_letter))
+    elif _CYRILLIC_RE.search(text):
+        variants.append(swap_layout(text))
+    return list(dict.fromkeys(variants))
+
+
+def query_forms(text):
+    """
+    Формы запроса по видам полей индекса. Отсутствующая форма (None) значит,
+    что этот вид поля запросом не проверяется.
+    """
+    text = normalize(text)
+    if not text:
+        return None
+    latin = {fold_latin(text), fold_latin(swap_layout(text))}
+    return {
+        "name": text,
+        "latin": tuple(sorted(latin)),
+        "phone": phone_digits(text),
+        "id": text if text.isdigit() else None,
+    }
+
+
+def is_refinement(old_forms, new_forms):
+    """
+    True, если всё, что находит новый запрос, находит и старый, и можно фильтровать
+    только прошлые результаты: каждая форма нового запроса продолжает соответствующую форму старого.
+    """
+    if old_forms is None:
+        return False
+    for kind, new in new_forms.items():
+        old = old_forms.get(kind)
+        if new is None:
+            continue
+        if old is None:
+            return False
+        if kind == "latin":
+            if not all(any(n.startswith(o) for o in old) for n in new):
+                return False
+        elif not new.startswith(old):
+            return False
+    return True
+
+
+class ClientSearchIndex:
+    """
+    Индекс клиентов: client_id -> (имя, имя латиницей, цифры телефона, ID строкой).
+    Уточнение запроса (добавление символов) фильтрует прошлый результат, а не весь список.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.last_forms = None
+        self.last_result = None
+
+    @staticmethod
+    def make_entry(client_id, name, phone):
+        name = normalize(name)
+        return name, fold_latin(name), digits_only(phone), str(client_id)
+
+    @staticmethod
+    def entry_matches(entry, forms):
+        name, latin, phone, client_id = entry
+        if forms["name"] in name:
+            return True
+        if any(form in latin for form in forms["latin"]):
+            return True
+        if forms["phone"] and forms["phone"] in phone:
+            return True
+        return bool(forms["id"]) and forms["id"] in client_id
+
+    def clear(self):
+        self.entries = {}
+        self.last_forms = None
+        self.last_result = None
+
+    def add(self, client_id, name, phone):
+        entry = self.make_entry(client_id, name, phone)
+        self.entries[client_id] = entry
+        # Новый клиент сразу проверяется по текущему запросу, чтобы прошлый результат оставался верным
+        if self.last_result is not None:
+            if self.entry_matches(entry, self.last_forms):
+                self.last_result.add(client_id)
+            else:
+                self.last_result.discard(client_id)
+
+    def remove(self, client_id):
+        self.entries.pop(client_id, None)
+        if self.last_result is not None:
+            self.last_result.discard(client_id)
+
+    def search(self, text):
+        """Возвращает множество ID подходящих клиентов или None, если запрос пустой."""
+        forms = query_forms(text)
+        if forms is None:
+            self.last_forms = None
+            self.last_result = None
+            return None
+        if self.last_result is not None and is_refinement(self.last_forms, forms):
+            candidates = self.last_result
+        else:
+            candidates = self.entries.keys()
+        result = {client_id for client_id in candidates if self.entry_matches(self.entries[client_id], forms)}
+        self.last_forms = forms
+        self.last_result = result
+        return result
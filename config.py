@@ -0,0 +1,50 @@
+import configparser
+import logging
+import os
+from pathlib import Path
+
+from constants import DIR_APPLICATION
+
+logger = logging.getLogger(__name__)
+
+# Файл настроек рабочего места лежит рядом с приложением,
+# путь можно переопределить переменной окружения CRM_CONFIG
+CONFIG_PATH = Path(os.environ.get("CRM_CONFIG", DIR_APPLICATION / "config.ini"))
+
+_parser = None
+
+
+def _load_parser():
+    global _parser
+    if _parser is None:
+        _parser = configparser.ConfigParser()
+        if CONFIG_PATH.exists():
+            try:
+                _parser.read(CONFIG_PATH, encoding="utf-8")
+                logger.info(f"Загружены настройки из {CONFIG_PATH}")
+            except configparser.Error as e:
+                logger.error(f"Ошибка чтения файла настроек {CONFIG_PATH}: {e}")
+    return _parser
+
+
+def get_setting(section, key, default=None, cast=str):
+    """
+    Возвращает значение настройки.
+    Приоритет: переменная окружения CRM_<SECTION>_<KEY>, затем config.ini, затем значение по умолчанию.
+    :param cast: функция приведения типа (int, float, bool, str)
+    """
+    env_name = f"CRM_{section}_{key}".upper()
+    value = os.environ.get(env_name)
+    if value is None:
+        parser = _load_parser()
+        if parser.has_option(section, key):
+            value = parser.get(section, key)
+    if value is None:
+        return default
+    try:
+        if cast is bool:
+            return value.strip().lower() in ("1", "true", "yes", "on", "да")
+        return cast(value)
+    except (TypeError, ValueError):
+        logger.warning(f"Некорректное значение настройки {section}.{key}: {value!r}, используется {default!r}")
+        return default
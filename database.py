@@ -4,12 +4,16 @@ import logging
 import random
 import re
 import sys
+import threading
 import traceback
 from collections import OrderedDict
+from contextlib import contextmanager
 
 import bcrypt
 import psycopg2
 from psycopg2 import pool
+import psycopg2.extensions
+import psycopg2.errors
 from barcode import Code128
 from barcode.writer import ImageWriter
 from io import BytesIO
@@ -27,53 +31,476 @@ import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
-logging.basicConfig(level=logging.INFO)
+from client_search_index import normalize, phone_digits, search_variants
+from config import get_setting
+
 logger = logging.getLogger(__name__)
+# Отдельный логгер для журнала запросов, чтобы его можно было направить в свой файл или отключить
+sql_logger = logging.getLogger(__name__ + ".sql")
+
+
+class DatabaseConfigError(Exception):
+    """Параметры подключения к базе данных не заданы ни в config.ini, ни в переменных окружения."""
+
+
+def load_db_settings():
+    """
+    Читает параметры подключения к базе данных из переменных окружения или config.ini (секция [database]).
+    Если задан dsn, остальные параметры подключения игнорируются.
+    :return: словарь с dsn, размерами пула и таймаутами
+    :raises DatabaseConfigError: не заданы ни dsn, ни host, name и user
+    """
+    dsn = get_setting("database", "dsn")
+    if not dsn:
+        params = {
+            "host": get_setting("database", "host"),
+            "dbname": get_setting("database", "name"),
+            "user": get_setting("database", "user"),
+        }
+        missing = [key for key, value in zip(("host", "name", "user"), params.values()) if not value]
+        if missing:
+            raise DatabaseConfigError(
+                "Не заданы параметры подключения к базе данных: "
+                f"{', '.join(missing)}. Укажите dsn или host, name и user в секции [database] "
+                "файла config.ini (образец — config.example.ini) или в переменных окружения "
+                "CRM_DATABASE_DSN, CRM_DATABASE_HOST, CRM_DATABASE_NAME, CRM_DATABASE_USER."
+            )
+        dsn = psycopg2.extensions.make_dsn(
+            port=get_setting("database", "port", "5432"),
+            password=get_setting("database", "password"),
+            **params,
+        )
+    return {
+        "dsn": dsn,
+        "min_size": get_setting("database", "pool_min", 1, int),
+        "max_size": get_setting("database", "pool_max", 20, int),
+        "prewarm": get_setting("database", "pool_prewarm", 2, int),
+        "connect_timeout": get_setting("database", "connect_timeout", 5, int),
+        "statement_timeout": get_setting("database", "statement_timeout_ms", 30000, int),
+        # Проверка простаивающих соединений и ограничение их возраста
+        "ping_after": get_setting("database", "ping_after", 60, float),
+        "max_age": get_setting("database", "max_connection_age", 3600, float),
+        # Повтор читающих запросов после обрыва соединения
+        "read_retries": get_setting("database", "read_retries", 3, int),
+        "retry_backoff": get_setting("database", "retry_backoff", 0.2, float),
+    }
+
+
+class ConnectionPoolManager:
+    """
+    Ленивый пул соединений: пул создаётся при первом обращении или при фоновом прогреве,
+    а не при импорте модуля.
+    Перед выдачей соединения проверяет его: соединения старше max_age пересоздаются,
+    простаивавшие дольше ping_after проверяются запросом SELECT 1.
+    """
+
+    def __init__(self):
+        self._pool = None
+        self._settings = None
+        self._lock = threading.Lock()
+        self._prewarm_thread = None
+        # id(conn) -> [срок жизни до, время последнего использования]
+        self._conn_meta = {}
+        self._meta_lock = threading.Lock()
+        self.healthy = True
+
+    @property
+    def settings(self):
+        if self._settings is None:
+            self._settings = load_db_settings()
+        return self._settings
+
+    def get_pool(self):
+        """Возвращает пул соединений, создавая его при первом обращении."""
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    settings = self.settings
+                    start = time.monotonic()
+                    # Пул закрывает возвращённые соединения сверх minconn, поэтому прогретые соединения
+                    # входят в минимум пула, иначе они закрылись бы сразу после прогрева
+                    min_size = min(max(settings["min_size"], settings["prewarm"]), settings["max_size"])
+                    self._pool = psycopg2.pool.ThreadedConnectionPool(
+                        min_size, settings["max_size"],
+                        settings["dsn"],
+                        connect_timeout=settings["connect_timeout"],
+                        options=f"-c statement_timeout={settings['statement_timeout']}"
+                    )
+                    logger.info(f"Пул соединений создан за {time.monotonic() - start:.2f} с")
+        return self._pool
+
+    def getconn(self):
+        """
+        Выдаёт проверенное соединение из пула.
+        Устаревшие и оборванные соединения закрываются и заменяются новыми.
+        """
+        pool_ = self.get_pool()
+        attempts = self.settings["max_size"] + 1
+        for _ in range(attempts):
+            conn = pool_.getconn()
+            if self._is_usable(conn):
+                return conn
+            self.putconn(conn, close=True)
+        # Все соединения пула оказались негодными — последнее открывается заново
+        return pool_.getconn()
+
+    def _is_usable(self, conn):
+        if conn.closed:
+            return False
+        now = time.monotonic()
+        with self._meta_lock:
+            meta = self._conn_meta.get(id(conn))
+            if meta is None:
+                # Срок жизни слегка разбрасывается, чтобы соединения, открытые одновременно,
+                # не пересоздавались все разом
+                max_age = self.settings["max_age"] * random.uniform(0.8, 1.0)
+                self._conn_meta[id(conn)] = [now + max_age, now]
+                return True
+            expires_at, last_used = meta
+        if now >= expires_at:
+            logger.debug(f"Соединение {id(conn)} превысило максимальный возраст и будет пересоздано")
+            return False
+        if now - last_used >= self.settings["ping_after"]:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error as e:
+                logger.warning(f"Соединение {id(conn)} не отвечает и будет пересоздано: {e}")
+                return False
+        return True
+
+    def putconn(self, conn, close=False):
+        if self._pool is None:
+            return
+        close = close or bool(conn.closed)
+        if not close:
+            with self._meta_lock:
+                if id(conn) in self._conn_meta:
+                    self._conn_meta[id(conn)][1] = time.monotonic()
+        try:
+            self._pool.putconn(conn, close=close)
+        except psycopg2.pool.PoolError as e:
+            logger.error(f"Ошибка возврата соединения в пул: {e}")
+        # Пул сам закрывает соединения сверх minconn. Запись закрытого соединения удаляется,
+        # иначе словарь растёт, а новое соединение с тем же id() получит чужой срок жизни
+        if conn.closed:
+            with self._meta_lock:
+                self._conn_meta.pop(id(conn), None)
+
+    def mark_healthy(self, healthy):
+        if self.healthy != healthy:
+            logger.warning("Соединение с базой данных восстановлено" if healthy
+                           else "Потеряно соединение с базой данных")
+        self.healthy = healthy
+
+    def prewarm(self):
+        """Создаёт пул и открывает соединения в фоновом потоке, пока пользователь вводит логин и пароль."""
+        if self._prewarm_thread is not None and self._prewarm_thread.is_alive():
+            return
+        self._prewarm_thread = threading.Thread(target=self._prewarm, name="db-prewarm", daemon=True)
+        self._prewarm_thread.start()
+
+    def _prewarm(self):
+        # Пул открывает minconn соединений при создании, а minconn не меньше pool_prewarm (см. get_pool)
+        try:
+            pool_ = self.get_pool()
+            logger.info(f"Пул соединений прогрет: {pool_.minconn} соединений")
+        except Exception as e:
+            logger.error(f"Ошибка прогрева пула соединений: {e}")
+
+    def status(self):
+        if self._pool is None:
+            return "пул ещё не создан"
+        return f"минимальное={self._pool.minconn}, максимальное={self._pool.maxconn}"
+
+    def closeall(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+            with self._meta_lock:
+                self._conn_meta.clear()
+
 
 # Настройка пула соединений
-connection_pool = psycopg2.pool.ThreadedConnectionPool(
-    1, 20,  # Минимальное и максимальное количество соединений
-    user='2024_psql_m_usr',
-    password='EUVMc7ilIbi8uZQA',
-    host='5.183.188.132',
-    port='5432',
-    database='2024_psql_miros'
-)
+pool_manager = ConnectionPoolManager()
+
+
+def prewarm_pool():
+    """Запускает фоновый прогрев пула соединений."""
+    pool_manager.prewarm()
 
 
 def log_connection_pool_status():
     try:
-        logger.info(f"Пул соединений: минимальное={connection_pool.minconn}, максимальное={connection_pool.maxconn}")
+        logger.info(f"Пул соединений: {pool_manager.status()}")
     except Exception as e:
         logger.error(f"Ошибка проверки состояния пула: {e}")
 
 
-def execute_query(query, params=None, fetch=True, fetch_one=False):
-    conn = None
+# Отмена запроса (cancel() или statement_timeout) — тоже OperationalError, но соединение после неё исправно
+QueryCanceledError = psycopg2.extensions.QueryCanceledError
+# Коды SQLSTATE, с которыми сервер сам закрывает соединение: остановка сервера и запрет подключений
+_CONNECTION_SQLSTATES = ("57P01", "57P02", "57P03")
+
+
+def is_connection_error(error, conn=None):
+    """
+    Проверяет, что ошибка означает потерю связи с базой, а не ошибку запроса.
+    OperationalError также сообщает об отмене по statement_timeout, взаимоблокировках и ошибках блокировок:
+    у них есть код SQLSTATE, и соединение после них исправно.
+    """
+    if isinstance(error, psycopg2.InterfaceError):
+        return True
+    if not isinstance(error, psycopg2.OperationalError):
+        return False
+    if conn is not None and conn.closed:
+        return True
+    pgcode = error.pgcode
+    return pgcode is None or pgcode.startswith("08") or pgcode in _CONNECTION_SQLSTATES
+
+
+class CancelToken:
+    """
+    Отмена запросов фоновой задачи. Пока задача выполняет запрос, соединение зарегистрировано
+    в токене, и cancel() прерывает запрос на сервере (conn.cancel(), то же, что pg_cancel_backend).
+    После отмены новые запросы задачи не выполняются.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        # Соединение отменяется под блокировкой: вернуть его в пул, пока идёт отмена, нельзя,
+        # иначе отмена может прервать чужой запрос
+        with self._lock:
+            self.cancelled = True
+            if self._conn is not None and not self._conn.closed:
+                try:
+                    self._conn.cancel()
+                except psycopg2.Error as e:
+                    logger.warning(f"Не удалось отменить запрос: {e}")
+
+    @contextmanager
+    def attach(self, conn):
+        with self._lock:
+            if self.cancelled:
+                raise QueryCanceledError("запрос отменён до выполнения")
+            self._conn = conn
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._conn = None
+
+
+_cancel_scope = threading.local()
+
+
+@contextmanager
+def cancellable(token):
+    """Запросы, выполняемые в этом потоке внутри блока, отменяются через token.cancel()."""
+    previous = getattr(_cancel_scope, "token", None)
+    _cancel_scope.token = token
     try:
-        conn = connection_pool.getconn()
-        logger.info(f"Получено соединение из пула: {id(conn)}")
-        with conn.cursor() as cursor:
-            logger.info(f"Выполнение запроса: {query} с параметрами {params}")
-            cursor.execute(query, params)
-            conn.commit()
-            if fetch:
-                if fetch_one:
-                    result = cursor.fetchone()
-                    logger.info(f"Получена одна запись: {result}")
-                else:
-                    result = cursor.fetchall()
-                    logger.info(f"Получено {len(result)} записей")
+        yield token
+    finally:
+        _cancel_scope.token = previous
+
+
+@contextmanager
+def _attach_to_cancel_scope(conn):
+    token = getattr(_cancel_scope, "token", None)
+    if token is None:
+        yield
+    else:
+        with token.attach(conn):
+            yield
+
+_READ_QUERY_RE = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+_WRITE_KEYWORDS_RE = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|TRUNCATE|CALL)\b|\bFOR\s+UPDATE\b|\bnextval\s*\(",
+                                re.IGNORECASE)
+
+
+def is_idempotent_read(query):
+    """Проверяет, что запрос только читает данные и его можно безопасно повторить."""
+    return bool(_READ_QUERY_RE.match(query)) and not _WRITE_KEYWORDS_RE.search(query)
+
+
+def load_query_log_settings():
+    """
+    Режим журнала запросов (секция [logging]):
+    off — запросы не журналируются, timing — только время выполнения,
+    sql — время и текст запроса с параметрами для выборки sql_sample_rate запросов.
+    """
+    mode = get_setting("logging", "db_log_mode", "timing").strip().lower()
+    if mode not in ("off", "timing", "sql"):
+        logger.warning(f"Неизвестный режим журнала запросов {mode!r}, используется timing")
+        mode = "timing"
+    return {
+        "mode": mode,
+        "sample_rate": get_setting("logging", "sql_sample_rate", 0.01, float),
+        "slow_ms": get_setting("logging", "slow_query_ms", 500, float),
+        "max_value_length": get_setting("logging", "max_value_length", 100, int),
+    }
+
+
+query_log_settings = load_query_log_settings()
+
+
+def redact_value(value, max_length=None):
+    """Заменяет двоичные данные их размером и обрезает длинные значения для записи в журнал."""
+    if max_length is None:
+        max_length = query_log_settings["max_value_length"]
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<двоичные данные: {len(value)} байт>"
+    if isinstance(value, (list, tuple)):
+        return type(value)(redact_value(item, max_length) for item in value)
+    if isinstance(value, dict):
+        return {key: redact_value(item, max_length) for key, item in value.items()}
+    text = repr(value)
+    if len(text) > max_length:
+        return f"{text[:max_length]}...<{len(text)} символов>"
+    return value
+
+
+def _query_label(query):
+    """Короткое описание запроса без параметров: первые слова без переводов строк."""
+    return " ".join(query.split())[:60]
+
+
+def log_query(query, params, elapsed, rowcount):
+    """Записывает выполненный запрос в журнал согласно режиму db_log_mode."""
+    mode = query_log_settings["mode"]
+    if mode == "off":
+        return
+    elapsed_ms = elapsed * 1000
+    if elapsed_ms >= query_log_settings["slow_ms"]:
+        sql_logger.warning(f"Медленный запрос ({elapsed_ms:.0f} мс, строк: {rowcount}): {_query_label(query)}")
+        return
+    if not sql_logger.isEnabledFor(logging.INFO):
+        return
+    if mode == "sql" and random.random() < query_log_settings["sample_rate"]:
+        sql_logger.info(f"{elapsed_ms:.1f} мс, строк: {rowcount}: {' '.join(query.split())} "
+                        f"параметры: {redact_value(params)}")
+    else:
+        sql_logger.info(f"{elapsed_ms:.1f} мс, строк: {rowcount}: {_query_label(query)}")
+
+
+def execute_query(query, params=None, fetch=True, fetch_one=False):
+    """
+    Выполняет запрос на соединении из пула.
+    Читающие запросы при обрыве соединения повторяются на новом соединении с экспоненциальной задержкой.
+    :return: результат запроса или None при ошибке
+    """
+    settings = pool_manager.settings
+    retries = settings["read_retries"] if is_idempotent_read(query) else 0
+    for attempt in range(retries + 1):
+        conn = None
+        broken = False
+        try:
+            conn = pool_manager.getconn()
+            start = time.perf_counter()
+            with _attach_to_cancel_scope(conn), conn.cursor() as cursor:
+                cursor.execute(query, params)
+                conn.commit()
+                pool_manager.mark_healthy(True)
+                result = None
+                if fetch:
+                    result = cursor.fetchone() if fetch_one else cursor.fetchall()
+                log_query(query, params, time.perf_counter() - start, cursor.rowcount)
                 return result
+        except QueryCanceledError as e:
+            if conn and not conn.closed:
+                conn.rollback()
+            logger.info(f"Запрос отменён: {str(e).strip()} ({_query_label(query)})")
+            return None
+        except Exception as e:
+            if is_connection_error(e, conn):
+                broken = True
+                pool_manager.mark_healthy(False)
+                if attempt < retries:
+                    delay = settings["retry_backoff"] * (2 ** attempt) * random.uniform(1.0, 1.5)
+                    logger.warning(f"Соединение оборвано ({e}), повтор запроса через {delay:.2f} с")
+                    time.sleep(delay)
+                    continue
+                logger.error(f"Ошибка выполнения запроса: {e}")
+                return None
+            if conn and not conn.closed:
+                conn.rollback()
+            logger.error(f"Ошибка выполнения запроса: {e} ({_query_label(query)})")
+            return None
+        finally:
+            if conn:
+                pool_manager.putconn(conn, close=broken)
+    return None
+
+
+class Transaction:
+    """Выполняет запросы внутри одной транзакции на одном соединении (см. transaction())."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = conn.cursor()
+
+    def execute(self, query, params=None, fetch=False, fetch_one=False):
+        """
+        Выполняет запрос без фиксации транзакции.
+        :return: одна запись при fetch_one, список записей при fetch, иначе None
+        """
+        start = time.perf_counter()
+        self.cursor.execute(query, params)
+        result = None
+        if fetch_one:
+            result = self.cursor.fetchone()
+        elif fetch:
+            result = self.cursor.fetchall()
+        log_query(query, params, time.perf_counter() - start, self.cursor.rowcount)
+        return result
+
+
+@contextmanager
+def transaction():
+    """
+    Контекстный менеджер транзакции: все запросы выполняются на одном соединении из пула
+    и фиксируются одним COMMIT при выходе из блока. При исключении транзакция откатывается,
+    а исключение передаётся вызывающему коду.
+
+        with transaction() as tx:
+            visit_id = tx.execute("INSERT ... RETURNING visit_id", params, fetch_one=True)[0]
+            tx.execute("UPDATE ...", (visit_id,))
+    """
+    try:
+        conn = pool_manager.getconn()
     except Exception as e:
-        if conn:
+        if is_connection_error(e):
+            pool_manager.mark_healthy(False)
+        raise
+    broken = False
+    tx = Transaction(conn)
+    try:
+        with _attach_to_cancel_scope(conn):
+            yield tx
+        conn.commit()
+        pool_manager.mark_healthy(True)
+    except QueryCanceledError:
+        if not conn.closed:
             conn.rollback()
-        logger.error(f"Ошибка выполнения запроса: {e}")
-        return None
+        raise
+    except Exception as e:
+        if is_connection_error(e, conn):
+            broken = True
+            pool_manager.mark_healthy(False)
+        elif not conn.closed:
+            conn.rollback()
+        raise
     finally:
-        if conn:
-            connection_pool.putconn(conn)
-            logger.info(f"Соединение возвращено в пул: {id(conn)}")
+        if not conn.closed:
+            tx.cursor.close()
+        pool_manager.putconn(conn, close=broken)
 
 
 def check_card_in_database(card_number):
@@ -127,9 +554,12 @@ def count_all_trainers():
 
 
 
-def fetch_visit_history(client_id):
-    query = """
-    SELECT 
+VISIT_HISTORY_PAGE_SIZE = 50
+
+# Колонки строки истории посещений: visit_id, дата, время, тип, период абонемента.
+# Ожидают посещение под псевдонимом v и его абонемент под псевдонимом s.
+VISIT_HISTORY_COLUMNS = """
+        v.visit_id,
         TO_CHAR(v.time_start, 'DD.MM.YY') AS date,
         TO_CHAR(v.time_start, 'HH24:MI') || ' - ' || TO_CHAR(v.time_end, 'HH24:MI') AS time,
         CASE 
@@ -140,14 +570,44 @@ def fetch_visit_history(client_id):
             WHEN s.tariff IS NOT NULL AND s.tariff != 'one_time' THEN 
                 TO_CHAR(s.valid_since, 'DD.MM.YY') || ' - ' || TO_CHAR(s.valid_until, 'DD.MM.YY')
             ELSE ''
-        END AS period
+        END AS period"""
+
+
+def fetch_visit_history(client_id, before=None, limit=VISIT_HISTORY_PAGE_SIZE):
+    """
+    Возвращает страницу завершённых посещений клиента, сначала новые.
+    :param before: курсор последнего посещения предыдущей страницы или None для первой страницы
+    :return: кортеж (строки (visit_id, дата, время, тип, период), курсор следующей страницы или None)
+             либо None при ошибке
+    """
+    params = [client_id]
+    keyset = ""
+    if before is not None:
+        keyset = "AND (v.time_start, v.visit_id) < (%s, %s)"
+        params.extend(before)
+    params.append(limit + 1)
+
+    query = f"""
+    SELECT {VISIT_HISTORY_COLUMNS},
+        v.time_start
     FROM visit_fitness_room v
-    LEFT JOIN client c ON v.client = c.client_id
-    LEFT JOIN subscription s ON c.subscription = s.subscription_id
+    LEFT JOIN subscription s ON v.subscription = s.subscription_id
     WHERE v.client = %s
-    ORDER BY v.time_start DESC;
+      AND v.time_end IS NOT NULL
+      {keyset}
+    ORDER BY v.time_start DESC, v.visit_id DESC
+    LIMIT %s;
     """
-    return execute_query(query, (client_id,))
+    result = execute_query(query, tuple(params))
+    if result is None:
+        logger.error(f"Не удалось загрузить историю посещений клиента {client_id}.")
+        return None
+
+    next_cursor = None
+    if len(result) > limit:
+        result = result[:limit]
+        next_cursor = (result[-1][-1], result[-1][0])
+    return [row[:-1] for row in result], next_cursor
 
 
 def check_admin_username_in_database(username):
@@ -177,43 +637,126 @@ def check_admin_phone_in_database(phone_number):
     return result[0][0] if result else None
 
 
-def get_schedule_for_week(trainer_id, start_date, end_date):
+# Слоты тренера за период. Период задаётся полуоткрытым интервалом [начало, конец) по самому start_time,
+# без приведения столбца к дате, — так условие обслуживает индекс (trainer, start_time).
+SCHEDULE_SLOTS_QUERY = """
+    SELECT 
+        ts.slot_id, 
+        ts.start_time::date AS day_date,
+        ts.start_time,
+        ts.end_time,
+        c.client_id,  
+        c.first_name || ' ' || c.surname AS client_name
+    FROM 
+        training_slots ts
+    LEFT JOIN 
+        client c ON ts.client = c.client_id
+    WHERE 
+        ts.trainer = %s AND ts.start_time >= %s AND ts.start_time < %s
+    ORDER BY 
+        ts.start_time;
+"""
+
+# Версия расписания за период: MD5 слотов. Пустой период тоже получает версию — MD5 пустой строки
+SCHEDULE_HASH_QUERY = """
+    SELECT MD5(COALESCE(STRING_AGG(
+               CONCAT_WS(',', ts.slot_id, ts.start_time, ts.end_time, ts.client, c.first_name, c.surname),
+               ';' ORDER BY ts.start_time, ts.slot_id), '')) AS hash
+    FROM training_slots ts
+    LEFT JOIN client c ON ts.client = c.client_id
+    WHERE ts.trainer = %s AND ts.start_time >= %s AND ts.start_time < %s;
+"""
+
+
+def day_range(start_date, end_date=None):
+    """Полуоткрытый интервал [start_date, end_date + 1 день) для условий по времени начала."""
+    return start_date, (end_date or start_date) + datetime.timedelta(days=1)
+
+
+# Слоты тренера, пересекающиеся с интервалом [начало, конец). Условие совпадает с ограничением
+# training_slots_no_overlap (migrations/008) и выполняется по его GiST-индексу.
+SLOT_CONFLICTS_QUERY = """
+    SELECT 
+        ts.slot_id, 
+        ts.start_time::date AS day_date,
+        ts.start_time,
+        ts.end_time,
+        c.client_id,  
+        c.first_name || ' ' || c.surname AS client_name
+    FROM 
+        training_slots ts
+    LEFT JOIN 
+        client c ON ts.client = c.client_id
+    WHERE 
+        ts.trainer = %s AND tsrange(ts.start_time, ts.end_time, '[)') && tsrange(%s, %s, '[)')
+    ORDER BY 
+        ts.start_time;
+"""
+
+
+def _slot_from_row(row):
+    return {
+        "slot_id": row[0],
+        "start_time": row[2],
+        "end_time": row[3],
+        "client_id": row[4],
+        "client": row[5]
+    }
+
+
+def find_slot_conflicts(trainer_id, start_time, end_time):
+    """
+    Возвращает слоты тренера, пересекающиеся с интервалом [start_time, end_time).
+    :return: список слотов (пустой, если пересечений нет) или None при ошибке
+    """
+    result = execute_query(SLOT_CONFLICTS_QUERY, (trainer_id, start_time, end_time))
+    if result is None:
+        return None
+    return [_slot_from_row(row) for row in result]
+
+
+def add_training_slot(trainer_id, client_id, start_time, end_time):
     """
-    Получает расписание тренера за неделю.
+    Записывает клиента к тренеру. Пересечение с другими слотами тренера проверяет база
+    ограничением training_slots_no_overlap, поэтому одновременная запись с двух рабочих мест
+    не приведёт к двойному бронированию.
+    :return: {"status": "ok", "slot_id": ...}, {"status": "conflict", "conflicts": [слоты]} или None при ошибке
     """
-    logger.info(f"Запрос расписания для тренера {trainer_id}: {start_date} - {end_date}")
     query = """
-        SELECT 
-            ts.slot_id, 
-            ts.start_time::date AS day_date,
-            ts.start_time,
-            ts.end_time,
-            c.client_id,  
-            c.first_name || ' ' || c.surname AS client_name
-        FROM 
-            training_slots ts
-        LEFT JOIN 
-            client c ON ts.client = c.client_id
-        WHERE 
-            ts.trainer = %s AND ts.start_time::date BETWEEN %s AND %s;
+        INSERT INTO training_slots (trainer, client, start_time, end_time)
+        VALUES (%s, %s, %s, %s)
+        RETURNING slot_id;
     """
-    result = execute_query(query, (trainer_id, start_date, end_date))
-    logger.info(f"Получено {len(result) if result else 0} записей для тренера {trainer_id}")
+    try:
+        with transaction() as tx:
+            row = tx.execute(query, (trainer_id, client_id, start_time, end_time), fetch_one=True)
+    except psycopg2.errors.ExclusionViolation:
+        conflicts = find_slot_conflicts(trainer_id, start_time, end_time)
+        logger.info(f"Слот тренера {trainer_id} {start_time} - {end_time} пересекается с {conflicts}")
+        return {"status": "conflict", "conflicts": conflicts or []}
+    except Exception as e:
+        logger.error(f"Ошибка добавления слота тренера {trainer_id}: {e}")
+        return None
+    return {"status": "ok", "slot_id": row[0]}
+
+
+def get_schedule_for_week(trainer_id, start_date, end_date):
+    """
+    Получает расписание тренера за неделю.
+    """
+    logger.debug(f"Запрос расписания для тренера {trainer_id}: {start_date} - {end_date}")
+    result = execute_query(SCHEDULE_SLOTS_QUERY, (trainer_id, *day_range(start_date, end_date)))
+    if result is None:
+        return None
+    logger.debug(f"Получено {len(result) if result else 0} записей для тренера {trainer_id}")
 
     if result:
         schedule_by_day = {}
         for row in result:
-            slot_id = row[0]
             day_date = row[1]
             if day_date not in schedule_by_day:
                 schedule_by_day[day_date] = []
-            schedule_by_day[day_date].append({
-                "slot_id": slot_id,  # Теперь сохраняем slot_id
-                "start_time": row[2],
-                "end_time": row[3],
-                "client_id": row[4],
-                "client": row[5]
-            })
+            schedule_by_day[day_date].append(_slot_from_row(row))
         return schedule_by_day
     return {}
 
@@ -249,6 +792,111 @@ def add_user_to_db(surname, first_name, patronymic, phone_number):
     except Exception as e:
         logger.error(f"Ошибка при добавлении пользователя: {e}, Query: {query}, Params: {params}")
         return None
+
+
+CLIENT_SEARCH_PAGE_SIZE = 50
+
+
+def _like_pattern(text):
+    """Экранирует спецсимволы LIKE и оборачивает строку в % для поиска подстроки."""
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def search_clients(search_text="", after=None, limit=CLIENT_SEARCH_PAGE_SIZE):
+    """
+    Возвращает страницу списка клиентов, отсортированного по дате начала членства (сначала новые).
+    Поиск идёт по подстроке фамилии и имени (с вариантами раскладки и транслитерации),
+    по цифрам телефона и по ID клиента
+    (индексы из migrations/005_client_search_indexes.sql и 006_client_name_search_yo.sql).
+    :param after: курсор последней строки предыдущей страницы или None для первой страницы
+    :return: кортеж (строки, курсор следующей страницы или None) либо None при ошибке
+    """
+    conditions = []
+    params = []
+
+    text = normalize(search_text)
+    if text:
+        matches = []
+        # Имя ищется и в других раскладке и алфавите: "bdfyjd" и "ivanov" находят Иванова
+        for variant in search_variants(text):
+            matches.append("replace(lower(c.surname || ' ' || c.first_name), 'ё', 'е') LIKE %s")
+            params.append(_like_pattern(variant))
+        digits = phone_digits(text)
+        if digits:
+            matches.append("regexp_replace(c.phone_number, '\\D', '', 'g') LIKE %s")
+            params.append(_like_pattern(digits))
+        if text.isdigit():
+            matches.append("c.client_id = %s")
+            params.append(int(text))
+        conditions.append("(" + " OR ".join(matches) + ")")
+
+    if after is not None:
+        conditions.append("(COALESCE(c.membership_start_date, DATE '0001-01-01'), c.client_id) < (%s, %s)")
+        params.extend(after)
+
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    # Берём на одну строку больше, чтобы узнать, есть ли следующая страница
+    params.append(limit + 1)
+
+    query = f"""
+        SELECT
+            c.client_id,
+            c.surname || ' ' || c.first_name AS name,
+            c.phone_number AS phone,
+            CASE
+                WHEN s.is_valid = TRUE THEN
+                    'Абонемент ' || TO_CHAR(s.valid_since, 'DD.MM.YY') || ' - ' || TO_CHAR(s.valid_until, 'DD.MM.YY')
+                ELSE 'Абонемент отсутствует'
+            END AS subscription,
+            COALESCE(t.surname || ' ' || t.first_name, 'Нет закрепленных тренеров') AS trainer,
+            TO_CHAR(c.membership_start_date, 'DD.MM.YY') AS start_date,
+            CASE
+                WHEN lv.in_gym = TRUE THEN '● В зале'
+                ELSE '○ Вне зала'
+            END AS status,
+            COALESCE(TO_CHAR(ns.start_time, 'DD.MM.YYYY HH24:MI'), 'Нет ближайших слотов') AS nearest_slot_start,
+            COALESCE(TO_CHAR(ns.end_time, 'DD.MM.YYYY HH24:MI'), '') AS nearest_slot_end,
+            c.sort_date
+        FROM (
+            SELECT c.*, COALESCE(c.membership_start_date, DATE '0001-01-01') AS sort_date
+            FROM client c
+            {where}
+            ORDER BY sort_date DESC, c.client_id DESC
+            LIMIT %s
+        ) c
+        LEFT JOIN subscription s ON c.subscription = s.subscription_id
+        LEFT JOIN LATERAL (
+            SELECT ts.start_time, ts.end_time, ts.trainer
+            FROM training_slots ts
+            WHERE ts.client = c.client_id
+              AND ts.start_time >= NOW()
+            ORDER BY ts.start_time
+            LIMIT 1
+        ) ns ON TRUE
+        LEFT JOIN trainer t ON ns.trainer = t.trainer_id
+        LEFT JOIN LATERAL (
+            SELECT v.in_gym
+            FROM visit_fitness_room v
+            WHERE v.client = c.client_id
+            ORDER BY v.time_start DESC
+            LIMIT 1
+        ) lv ON TRUE
+        ORDER BY c.sort_date DESC, c.client_id DESC;
+    """
+    result = execute_query(query, tuple(params))
+    if result is None:
+        logger.error("Не удалось выполнить поиск клиентов.")
+        return None
+
+    next_cursor = None
+    if len(result) > limit:
+        result = result[:limit]
+        last = result[-1]
+        next_cursor = (last[-1], last[0])
+    return [row[:-1] for row in result], next_cursor
+
+
 def get_client_id_by_card(card_number):
     query = "SELECT client_id FROM public.client WHERE member_card = %s"
     result = execute_query(query, (card_number,), fetch_one=True)
@@ -257,7 +905,7 @@ def get_client_id_by_card(card_number):
 
 def get_subscription_info(client_id):
     query = """
-        SELECT s.subscription_id, s.tariff, s.valid_since, s.valid_until, s.is_valid, s.visit_ids
+        SELECT s.subscription_id, s.tariff, s.valid_since, s.valid_until, s.is_valid, s.visits_used
         FROM public.subscription s
         JOIN public.client c ON c.subscription = s.subscription_id
         WHERE c.client_id = %s
@@ -266,29 +914,242 @@ def get_subscription_info(client_id):
     return result if result else None
 
 
+CLIENT_PROFILE_FIELDS = ("client_id", "name", "phone", "start_date", "subscription_type", "subscription_period",
+                         "visits_count", "is_valid", "frozen_from", "frozen_until", "in_gym", "has_active_visit",
+                         "next_training_start", "next_training_end", "next_trainer_name")
+
+
+def get_client_profile(client_id):
+    """
+    Загружает данные шапки профиля клиента одним запросом: клиент, абонемент, заморозка,
+    нахождение в зале, незавершённое посещение и ближайшая тренировка.
+    Посещения проверяются через EXISTS, без соединения со всеми посещениями клиента.
+    :return: словарь с ключами CLIENT_PROFILE_FIELDS или None, если клиент не найден или произошла ошибка
+    """
+    query = """
+        SELECT
+            c.client_id,
+            c.surname || ' ' || c.first_name AS name,
+            c.phone_number AS phone,
+            TO_CHAR(c.membership_start_date, 'DD.MM.YY') AS start_date,
+            s.tariff AS subscription_type,
+            TO_CHAR(s.valid_since, 'DD.MM.YY') || ' - ' || TO_CHAR(s.valid_until, 'DD.MM.YY') AS subscription_period,
+            COALESCE(s.visits_used, 0) AS visits_count,
+            s.is_valid,
+            s.frozen_from,
+            s.frozen_until,
+            EXISTS (
+                SELECT 1 FROM visit_fitness_room v
+                WHERE v.client = c.client_id AND v.in_gym = TRUE
+            ) AS in_gym,
+            EXISTS (
+                SELECT 1 FROM visit_fitness_room v
+                WHERE v.client = c.client_id AND v.in_gym = TRUE AND v.time_end IS NULL
+            ) AS has_active_visit,
+            TO_CHAR(ts.start_time, 'DD.MM.YY HH24:MI') AS next_training_start,
+            TO_CHAR(ts.end_time, 'DD.MM.YY HH24:MI') AS next_training_end,
+            tr.surname || ' ' || tr.first_name AS next_trainer_name
+        FROM client c
+        LEFT JOIN subscription s ON c.subscription = s.subscription_id
+        LEFT JOIN LATERAL (
+            SELECT ts.start_time, ts.end_time, ts.trainer
+            FROM training_slots ts
+            WHERE ts.client = c.client_id
+              AND ts.start_time > NOW()
+            ORDER BY ts.start_time ASC
+            LIMIT 1
+        ) ts ON TRUE
+        LEFT JOIN trainer tr ON ts.trainer = tr.trainer_id
+        WHERE c.client_id = %s;
+    """
+    result = execute_query(query, (client_id,), fetch_one=True)
+    if result is None:
+        logger.error(f"Не удалось загрузить профиль клиента {client_id}.")
+        return None
+    return dict(zip(CLIENT_PROFILE_FIELDS, result))
+
+
 def check_today_visits(client_id):
-    query = "SELECT visit_id FROM public.visit_fitness_room WHERE client = %s AND time_start::date = CURRENT_DATE"
+    query = """
+        SELECT visit_id FROM public.visit_fitness_room
+        WHERE client = %s AND time_start >= CURRENT_DATE AND time_start < CURRENT_DATE + 1
+    """
     result = execute_query(query, (client_id,), fetch=True)
     return result if result else None
 
 
 def register_visit(client_id, subscription_id):
-    """Фиксируем вход/выход в зал"""
-    query_check = "SELECT visit_id, in_gym FROM public.visit_fitness_room WHERE client = %s AND in_gym = TRUE"
-    result = execute_query(query_check, (client_id,), fetch_one=True)
+    """Фиксируем вход/выход в зал. Все изменения выполняются одной транзакцией."""
+    try:
+        with transaction() as tx:
+            result = tx.execute(
+                "SELECT visit_id FROM public.visit_fitness_room WHERE client = %s AND in_gym = TRUE FOR UPDATE",
+                (client_id,), fetch_one=True)
+
+            if result:
+                visit_id = result[0]
+                tx.execute("UPDATE public.visit_fitness_room SET time_end = NOW(), in_gym = FALSE WHERE visit_id = %s",
+                           (visit_id,))
+            else:
+                # Счётчик visits_used абонемента увеличивает триггер
+                visit_id = tx.execute(
+                    "INSERT INTO public.visit_fitness_room (client, time_start, in_gym, subscription) "
+                    "VALUES (%s, NOW(), TRUE, %s) RETURNING visit_id",
+                    (client_id, subscription_id), fetch_one=True)[0]
+        return visit_id
+    except Exception as e:
+        logger.error(f"Не удалось зарегистрировать посещение клиента {client_id}: {e}")
+        return None
+
+
+CHECKIN_FIELDS = ("status", "client_id", "subscription_id", "visit_id", "visits_used", "max_visits")
+
+
+def card_checkin(card_number):
+    """
+    Проверяет карту и фиксирует вход или выход за один запрос серверной функцией card_checkin
+    (migrations/001_card_checkin.sql). Абонемент проверяется по местному времени рабочего места.
+    Запрос изменяет данные, поэтому при обрыве соединения не повторяется.
+    :return: словарь с кодом результата status и данными визита, {"status": "offline"} без связи с базой
+             или None при другой ошибке (в том числе statement_timeout и взаимоблокировке)
+    """
+    query = f"SELECT {', '.join(CHECKIN_FIELDS)} FROM public.card_checkin(%s, %s)"
+    try:
+        with transaction() as tx:
+            row = tx.execute(query, (card_number, datetime.datetime.now()), fetch_one=True)
+    except Exception as e:
+        if is_connection_error(e):
+            logger.warning(f"Нет связи с базой при отметке карты {card_number}: {e}")
+            return {"status": "offline"}
+        logger.error(f"Ошибка отметки карты {card_number}: {e}")
+        return None
+    return dict(zip(CHECKIN_FIELDS, row))
+
+
+# Результат отметки, которую сервер не смог применить из-за ошибки в данных
+TAP_ERROR = "error"
+# Ошибки, после которых пачку можно передать позже: отмена по statement_timeout, взаимоблокировка
+# или сбой сериализации, ожидание блокировки
+_TRANSIENT_TAP_ERRORS = (QueryCanceledError, psycopg2.extensions.TransactionRollbackError,
+                         psycopg2.errors.LockNotAvailable)
 
-    if result:
-        visit_id = result[0]
-        query_exit = "UPDATE public.visit_fitness_room SET time_end = NOW(), in_gym = FALSE WHERE visit_id = %s"
-        execute_query(query_exit, (visit_id,), fetch=False)
-    else:
-        query_entry = "INSERT INTO public.visit_fitness_room (client, time_start, in_gym) VALUES (%s, NOW(), TRUE) RETURNING visit_id"
-        visit_id = execute_query(query_entry, (client_id,), fetch_one=True)[0]
 
-        query_update_subscription = "UPDATE public.subscription SET visit_ids = array_append(visit_ids, %s) WHERE subscription_id = %s"
-        execute_query(query_update_subscription, (visit_id, subscription_id), fetch=False)
+def _is_transient_tap_error(error):
+    return is_connection_error(error) or isinstance(error, _TRANSIENT_TAP_ERRORS)
 
-    return visit_id
+
+def apply_taps(taps, live):
+    """
+    Применяет пачку отметок, решённых на рабочем месте, одним запросом: для каждой отметки по порядку
+    вызывается replay_offline_checkin (migrations/010_offline_checkin_replay.sql).
+    Повторная передача отметки с тем же tap_id возвращает прежний результат, не изменяя данных,
+    поэтому пачку после обрыва соединения можно передать ещё раз.
+    Если пачка не применилась из-за ошибки в данных, отметки передаются по одной: отметка,
+    которую сервер не может применить, получает результат TAP_ERROR и не задерживает остальные.
+    При потере связи, отмене по таймауту или взаимоблокировке возвращается None: отметки остаются
+    непереданными и уйдут при следующей попытке.
+    :param taps: список словарей с ключами tap_id, card, action, tapped_at
+    :param live: True — текущие отметки: вход проверяется по абонементу, как в card_checkin, и записывается
+        временем сервера; False — отметки из локального журнала, записываются временем касания
+    :return: список (status, visit_id) в порядке отметок или None, если пачку нужно передать позже
+    """
+    if not taps:
+        return []
+    try:
+        return _apply_tap_batch(taps, live)
+    except Exception as e:
+        if _is_transient_tap_error(e):
+            logger.warning(f"Пачка из {len(taps)} отметок карт будет передана позже: {str(e).strip()}")
+            return None
+        logger.error(f"Ошибка передачи пачки из {len(taps)} отметок карт, отметки передаются по одной: {e}")
+
+    results = []
+    for tap in taps:
+        try:
+            results.extend(_apply_tap_batch([tap], live))
+        except Exception as e:
+            if _is_transient_tap_error(e):
+                logger.warning(f"Отметка {tap['tap_id']} будет передана позже: {str(e).strip()}")
+                return None
+            logger.error(f"Сервер не применил отметку {tap['tap_id']} карты {tap['card']}: {e}")
+            results.append((TAP_ERROR, None))
+    return results
+
+
+def _apply_tap_batch(taps, live):
+    query = """
+        SELECT r.status, r.visit_id
+        FROM unnest(%s::uuid[], %s::text[], %s::text[], %s::timestamp[])
+             WITH ORDINALITY AS t(tap_id, card, action, tapped_at, n)
+        CROSS JOIN LATERAL public.replay_offline_checkin(t.tap_id, t.card, t.action, t.tapped_at, %s) r
+        ORDER BY t.n
+    """
+    params = ([tap["tap_id"] for tap in taps], [tap["card"] for tap in taps],
+              [tap["action"] for tap in taps], [tap["tapped_at"] for tap in taps], live)
+    with transaction() as tx:
+        return tx.execute(query, params, fetch=True)
+
+
+CARD_INDEX_QUERY = """
+    SELECT
+        c.member_card,
+        c.client_id,
+        c.surname || ' ' || c.first_name AS name,
+        s.subscription_id,
+        s.tariff,
+        s.valid_until,
+        s.is_valid,
+        COALESCE(s.visits_used, 0) AS visits_used,
+        s.frozen_from,
+        s.frozen_until,
+        EXISTS (
+            SELECT 1 FROM visit_fitness_room v
+            WHERE v.client = c.client_id AND v.in_gym = TRUE
+        ) AS in_gym
+    FROM client c
+    LEFT JOIN subscription s ON c.subscription = s.subscription_id
+"""
+
+# Запас при дочитывании изменений: транзакция, начатая до прошлой синхронизации,
+# могла зафиксироваться после неё с более ранним updated_at
+CARD_INDEX_SYNC_OVERLAP = datetime.timedelta(minutes=1)
+
+
+def load_card_index_rows(since=None):
+    """
+    Выгружает строки индекса карт (card_index.CARD_INDEX_FIELDS).
+    :param since: время сервера прошлой синхронизации; None — полная выгрузка клиентов с картами.
+        Иначе возвращаются клиенты, у которых с этого момента изменились запись, абонемент или посещения,
+        включая клиентов, у которых карту отвязали.
+    :return: (время сервера на момент выгрузки, список строк) или None при ошибке
+    """
+    if since is None:
+        query = CARD_INDEX_QUERY + " WHERE c.member_card IS NOT NULL"
+        params = None
+    else:
+        # Каждая ветка объединения выбирает изменённые строки по своему индексу updated_at;
+        # OR по столбцам обеих таблиц соединения индексы использовать не может
+        query = CARD_INDEX_QUERY + """
+            WHERE c.client_id IN (
+                SELECT ch.client_id FROM client ch WHERE ch.updated_at > %(since)s
+                UNION
+                SELECT cs.client_id
+                FROM subscription sh
+                JOIN client cs ON cs.subscription = sh.subscription_id
+                WHERE sh.updated_at > %(since)s
+                UNION
+                SELECT v.client FROM visit_fitness_room v WHERE v.updated_at > %(since)s
+            )
+        """
+        params = {"since": since - CARD_INDEX_SYNC_OVERLAP}
+    try:
+        with transaction() as tx:
+            synced_at = tx.execute("SELECT NOW()", fetch_one=True)[0]
+            rows = tx.execute(query, params, fetch=True)
+    except Exception as e:
+        logger.error(f"Ошибка загрузки индекса карт: {e}")
+        return None
+    return synced_at, rows
 
 
 def deactivate_subscription(subscription_id):
@@ -317,8 +1178,8 @@ def add_subscription_to_existing_user(user_id, subscription_data):
         else:
             price = float(price_raw)  # Если это уже число
         query_subscription = """
-            INSERT INTO public.subscription (tariff, valid_since, valid_until, is_valid, price, visit_ids, frozen_from, frozen_until)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            INSERT INTO public.subscription (tariff, valid_since, valid_until, is_valid, price, frozen_from, frozen_until)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
             RETURNING subscription_id;
         """
         frozen_from = None
@@ -329,27 +1190,19 @@ def add_subscription_to_existing_user(user_id, subscription_data):
             valid_until,
             subscription_data["is_valid"],
             price,
-            [],  # Изначально пустой массив для visit_ids
             frozen_from,  # NULL для начала заморозки
             frozen_until  # NULL для окончания заморозки
         )
-        result = execute_query(query_subscription, params_subscription, fetch=True)
-        if not result:
-            logger.error("Не удалось добавить абонемент.")
-            return None
-
-        subscription_id = result[0][0]
-        logger.info(f"Абонемент добавлен с ID {subscription_id}.")
-
         # Привязываем абонемент к пользователю
         query_update_user = """
             UPDATE public.client
             SET subscription = %s
             WHERE client_id = %s;
         """
-        params_update_user = (subscription_id, user_id)
-        execute_query(query_update_user, params_update_user, fetch=False)
-        logger.info(f"Абонемент с ID {subscription_id} привязан к клиенту с ID {user_id}.")
+        with transaction() as tx:
+            subscription_id = tx.execute(query_subscription, params_subscription, fetch_one=True)[0]
+            tx.execute(query_update_user, (subscription_id, user_id))
+        logger.info(f"Абонемент с ID {subscription_id} добавлен и привязан к клиенту с ID {user_id}.")
         return subscription_id
     except Exception as e:
         logger.error(f"Ошибка при добавлении абонемента: {e}")
@@ -506,60 +1359,37 @@ def add_user_with_subscription(first_name, last_name, patronymic, phone_number,
         logger.error(f"Не удалось добавить пользователя {first_name} {last_name}.")
 
 
-def get_schedule_data_with_hash(trainer_id, start_date, end_date):
+def get_schedule_data_with_hash(trainer_id, start_date, end_date, known_hash=None):
     """
-    Получает данные расписания и хэш для заданного тренера и периода.
+    Получает версию (MD5 слотов) расписания тренера за период и, если она изменилась, само расписание.
     :param trainer_id: ID тренера.
     :param start_date: Начальная дата недели.
     :param end_date: Конечная дата недели.
-    :return: Кортеж (хэш, данные расписания) или None.
+    :param known_hash: Версия, уже имеющаяся у клиента.
+    :return: Кортеж (хэш, данные расписания); данные None, если хэш совпал с known_hash.
+             None при ошибке запроса.
     """
-    # Запрос на получение хэша
-    query_hash = """
-        SELECT MD5(STRING_AGG(CONCAT_WS(',', ts.start_time, ts.end_time, c.first_name, c.surname), ',')) AS hash
-        FROM training_slots ts
-        LEFT JOIN client c ON ts.client = c.client_id
-        WHERE ts.trainer = %s AND ts.start_time::date BETWEEN %s AND %s;
-    """
-    hash_result = execute_query(query_hash, (trainer_id, start_date, end_date))
-    if not hash_result or not hash_result[0][0]:
+    hash_result = execute_query(SCHEDULE_HASH_QUERY, (trainer_id, *day_range(start_date, end_date)))
+    if not hash_result:
         return None
 
     db_hash = hash_result[0][0]
+    if db_hash == known_hash:
+        return db_hash, None
 
-    # Запрос на получение данных
-    query_data = """
-        SELECT ts.start_time, ts.end_time, CONCAT(c.first_name, ' ', c.surname) AS client
-        FROM training_slots ts
-        LEFT JOIN client c ON ts.client = c.client_id
-        WHERE ts.trainer = %s AND ts.start_time::date BETWEEN %s AND %s
-        ORDER BY ts.start_time;
-    """
-    data_result = execute_query(query_data, (trainer_id, start_date, end_date))
-
-    # Преобразуем данные в формат словаря, сгруппированного по дням
-    schedule_data = {}
-    for row in data_result:
-        day_date = row[0].date()  # Дата из start_time
-        slot = {
-            "start_time": row[0],
-            "end_time": row[1],
-            "client": row[2]
-        }
-        if day_date not in schedule_data:
-            schedule_data[day_date] = []
-        schedule_data[day_date].append(slot)
-
+    schedule_data = get_schedule_for_week(trainer_id, start_date, end_date)
+    if schedule_data is None:
+        return None
     return db_hash, schedule_data
 
 def get_all_admins():
     """
     Возвращает список всех администраторов из базы данных, исключая тех, у кого роль 'managing_director'.
-    Включает логин, пароль и описание администратора.
+    Включает логин, пароль и описание администратора. Вместо фотографии возвращается её хэш (photo_store.py).
     :return: Список словарей с информацией об администраторах.
     """
     query = """
-        SELECT a.admin_id, a.first_name, a.surname, a.patronymic, a.phone_number, a.photo, a.description, u.username, u.password_hash, u.user_id
+        SELECT a.admin_id, a.first_name, a.surname, a.patronymic, a.phone_number, a.photo_hash, a.description, u.username, u.password_hash, u.user_id
         FROM administrators a
         JOIN users u ON a.user_id = u.user_id
         WHERE u.role != 'managing_director';
@@ -573,7 +1403,7 @@ def get_all_admins():
                 "surname": row[2],
                 "patronymic": row[3],
                 "phone_number": row[4],
-                "photo": row[5],  # Байтовое изображение
+                "photo_hash": row[5],
                 "description": row[6],  # Описание администратора
                 "username": row[7],
                 "password_hash": row[8],
@@ -587,18 +1417,15 @@ def get_all_admins():
 
 def get_all_trainers():
     """
-    Возвращает список всех тренеров из базы данных.
+    Возвращает список всех тренеров из базы данных. Вместо фотографии возвращается её хэш (photo_store.py).
     :return: Список словарей с информацией о тренерах.
     """
-    print("get_all_trainers: старт функции")
     query = """
-        SELECT trainer_id, first_name, surname, photo, description, phone_number, patronymic
+        SELECT trainer_id, first_name, surname, photo_hash, description, phone_number, patronymic
         FROM trainer;
     """
     try:
-        print("get_all_trainers: выполнение запроса")
         result = execute_query(query)
-        print(f"get_all_trainers: результат запроса - {result}")
         if result:
             trainers = []
             for row in result:
@@ -606,18 +1433,15 @@ def get_all_trainers():
                     "id": row[0],
                     "name": f"{row[1]}",
                     "surname": f"{row[2]}",
-                    "image": row[3],  # Байтовое изображение
+                    "photo_hash": row[3],
                     "description": f"{row[4]}",
                     "phone": f"{row[5]}",
                     "patronymic": f"{row[6]}"
                 })
-            print(f"get_all_trainers: список тренеров - {trainers}")
             return trainers
-        print("get_all_trainers: результат пустой")
         return []
     except Exception as e:
-        print(f"Ошибка в get_all_trainers: {e}")
-        traceback.print_exc()
+        logger.exception(f"Ошибка в get_all_trainers: {e}")
         return []
 
 
@@ -673,7 +1497,7 @@ def close_pool():
     Закрывает все соединения в пуле. Вызывается при завершении работы приложения.
     """
     try:
-        connection_pool.closeall()
+        pool_manager.closeall()
         logger.info("Пул соединений закрыт")
     except psycopg2.DatabaseError as e:
         logger.error(f"Ошибка при закрытии пула соединений: {e}")
@@ -682,13 +1506,8 @@ def close_pool():
 # Функция для подключения к базе данных PostgreSQL
 def connect_to_db():
     try:
-        connection = psycopg2.connect(
-            dbname="2024_psql_miros",
-            user="2024_psql_m_usr",
-            password="EUVMc7ilIbi8uZQA",
-            host="5.183.188.132",
-            port="5432"
-        )
+        settings = pool_manager.settings
+        connection = psycopg2.connect(settings["dsn"], connect_timeout=settings["connect_timeout"])
         return connection
     except Exception as error:
         print(f"ошибка подключения к базе данных: {error}")
@@ -753,7 +1572,7 @@ def get_duty_trainers():
             t.patronymic, 
             t.phone_number, 
             t.description, 
-            t.photo
+            t.photo_hash
         FROM 
             trainer t
         JOIN 
@@ -768,6 +1587,114 @@ def get_duty_trainers():
     return result
 
 
+def get_dashboard_snapshot():
+    """
+    Возвращает данные главной панели одним запросом: количество активных клиентов, клиентов в зале,
+    всех тренеров и список тренеров на смене. Вместо фотографий тренеров возвращается их версия —
+    хэш фотографии, по которому уменьшенная копия берётся из кэша (photo_store.py).
+    :return: словарь с ключами active_clients, visitors_in_gym, trainers_total, duty_trainers или None
+    """
+    query = """
+        SELECT
+            (SELECT COUNT(*)
+             FROM client c
+             JOIN subscription s ON c.subscription = s.subscription_id
+             WHERE s.is_valid = TRUE
+               AND s.valid_until >= CURRENT_DATE) AS active_clients,
+            (SELECT COUNT(*)
+             FROM visit_fitness_room
+             WHERE in_gym = TRUE) AS visitors_in_gym,
+            (SELECT COUNT(*) FROM trainer) AS trainers_total,
+            (SELECT COALESCE(json_agg(json_build_object(
+                        'trainer_id', d.trainer_id,
+                        'surname', d.surname,
+                        'first_name', d.first_name,
+                        'patronymic', d.patronymic,
+                        'phone_number', d.phone_number,
+                        'description', d.description,
+                        'photo_version', d.photo_version
+                    ) ORDER BY d.surname), '[]'::json)
+             FROM (SELECT DISTINCT t.trainer_id, t.surname, t.first_name, t.patronymic,
+                                   t.phone_number, t.description, t.photo_hash AS photo_version
+                   FROM trainer t
+                   JOIN training_slots ts ON t.trainer_id = ts.trainer
+                   WHERE NOW() BETWEEN COALESCE(ts.start_time, NOW()) AND COALESCE(ts.end_time, NOW())) d
+            ) AS duty_trainers;
+    """
+    result = execute_query(query, fetch_one=True)
+    if result is None:
+        logger.error("Не удалось получить данные главной панели.")
+        return None
+    active_clients, visitors_in_gym, trainers_total, duty_trainers = result
+    return {
+        "active_clients": active_clients,
+        "visitors_in_gym": visitors_in_gym,
+        "trainers_total": trainers_total,
+        "duty_trainers": duty_trainers,
+    }
+
+
+def get_photo_thumbnails(photo_hashes, size):
+    """
+    Загружает уменьшенные копии фотографий (migrations/011_photo_store.sql).
+    :return: словарь {photo_hash: PNG} для найденных копий или None при ошибке
+    """
+    query = "SELECT photo_hash, image FROM photo_thumbnail WHERE photo_hash = ANY(%s) AND size = %s"
+    result = execute_query(query, (list(photo_hashes), size))
+    if result is None:
+        logger.error("Не удалось загрузить уменьшенные копии фотографий.")
+        return None
+    return {photo_hash: bytes(image) for photo_hash, image in result}
+
+
+def save_photo_thumbnails(thumbnails):
+    """
+    Сохраняет уменьшенные копии фотографий. Копия с тем же хэшем и размером уже не меняется.
+    :param thumbnails: список (photo_hash, size, PNG)
+    """
+    if not thumbnails:
+        return True
+    query = """
+        INSERT INTO photo_thumbnail (photo_hash, size, image)
+        SELECT * FROM unnest(%s::text[], %s::integer[], %s::bytea[])
+        ON CONFLICT (photo_hash, size) DO NOTHING
+    """
+    params = ([photo_hash for photo_hash, _, _ in thumbnails], [size for _, size, _ in thumbnails],
+              [psycopg2.Binary(image) for _, _, image in thumbnails])
+    return execute_query(query, params, fetch=False) is not None
+
+
+def get_photos_by_hash(photo_hashes):
+    """
+    Загружает полные фотографии тренеров и администраторов по хэшам,
+    чтобы создать уменьшенные копии фотографий, сохранённых без них.
+    :return: словарь {photo_hash: байты фото} или None при ошибке
+    """
+    query = """
+        SELECT DISTINCT ON (photo_hash) photo_hash, photo
+        FROM (SELECT photo_hash, photo FROM trainer WHERE photo_hash = ANY(%(hashes)s)
+              UNION ALL
+              SELECT photo_hash, photo FROM administrators WHERE photo_hash = ANY(%(hashes)s)) photos
+    """
+    result = execute_query(query, {"hashes": list(photo_hashes)})
+    if result is None:
+        logger.error("Не удалось загрузить фотографии.")
+        return None
+    return {photo_hash: bytes(photo) for photo_hash, photo in result}
+
+
+def get_trainer_photo_data(trainer_id):
+    """Полная фотография тренера для окна редактирования: байты, None — фото нет или ошибка."""
+    result = execute_query("SELECT photo FROM trainer WHERE trainer_id = %s", (trainer_id,), fetch_one=True)
+    return bytes(result[0]) if result and result[0] is not None else None
+
+
+def get_admin_photo_data(admin_id):
+    """Полная фотография администратора для окна редактирования: байты, None — фото нет или ошибка."""
+    result = execute_query("SELECT photo FROM administrators WHERE admin_id = %s", (admin_id,), fetch_one=True)
+    return bytes(result[0]) if result and result[0] is not None else None
+
+
 def check_visitor_in_gym(client_id):
     """
     Проверяет, находится ли посетитель в зале по client_id.
@@ -820,21 +1747,23 @@ def end_attendance(visit_id):
         logger.info(f"Посещение ID {visit_id} успешно завершено")
 
 
+# Диаграммы посещаемости строятся по почасовой сводке visit_hourly_rollup
+# (migrations/004_visit_hourly_rollup.sql), выборки идут по диапазону первичного ключа bucket
+
 def get_max_visitors_per_hour(start_date):
     """
     Возвращает максимальное количество людей за день в интервалах 2 часа (08-10, 10-12 ... 20-22).
     """
-    start_datetime = datetime.datetime.combine(start_date, datetime.time(0, 0, 0))  # 00:00:00
-    end_datetime = datetime.datetime.combine(start_date, datetime.time(23, 59, 59))  # 23:59:59
+    start_datetime = datetime.datetime.combine(start_date, datetime.time(0, 0, 0))
+    end_datetime = start_datetime + datetime.timedelta(days=1)
 
     query = """
         SELECT 
-            EXTRACT(HOUR FROM time_start) AS hour,
-            COUNT(DISTINCT client) AS visitor_count
-        FROM visit_fitness_room
-        WHERE time_start BETWEEN %s AND %s
-        GROUP BY EXTRACT(HOUR FROM time_start)
-        ORDER BY hour
+            EXTRACT(HOUR FROM bucket) AS hour,
+            visitors
+        FROM visit_hourly_rollup
+        WHERE bucket >= %s AND bucket < %s
+        ORDER BY bucket
     """
     results = execute_query(query, (start_datetime, end_datetime))
 
@@ -855,17 +1784,19 @@ def get_max_visitors_per_hour(start_date):
 def get_average_visitors_per_weekday(start_date, end_date):
     """
     Возвращает среднее количество посещений по дням недели (Пн-Вс) за указанный период.
+    :param end_date: последний день периода (включительно)
     """
     query = """
         SELECT 
-            EXTRACT(DOW FROM time_start) AS weekday, 
-            COUNT(client) / COUNT(DISTINCT DATE(time_start)) AS avg_visitors
-        FROM visit_fitness_room
-        WHERE time_start BETWEEN %s AND %s
-        GROUP BY EXTRACT(DOW FROM time_start)
+            EXTRACT(DOW FROM bucket) AS weekday, 
+            SUM(visits) / COUNT(DISTINCT bucket::date) AS avg_visitors
+        FROM visit_hourly_rollup
+        WHERE bucket >= %s AND bucket < %s
+          AND visits > 0
+        GROUP BY EXTRACT(DOW FROM bucket)
         ORDER BY weekday
     """
-    results = execute_query(query, (start_date, end_date))
+    results = execute_query(query, (start_date, end_date + datetime.timedelta(days=1)))
 
     day_counts = {i: 0 for i in range(7)}  # 0 - воскресенье, 6 - суббота
 
@@ -884,18 +1815,20 @@ def get_average_visitors_per_week_in_month(month, year):
     Возвращает среднее количество посещений по неделям в месяце.
     """
     start_date = datetime.date(year, month, 1)
-    end_date = (start_date.replace(day=28) + datetime.timedelta(days=4)).replace(day=1) - datetime.timedelta(days=1)
+    next_month = (start_date.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    end_date = next_month - datetime.timedelta(days=1)
 
     query = """
         SELECT 
-            FLOOR((EXTRACT(DAY FROM time_start) - 1) / 7) + 1 AS week_number,
-            COUNT(client) / COUNT(DISTINCT DATE(time_start)) AS avg_visitors
-        FROM visit_fitness_room
-        WHERE time_start BETWEEN %s AND %s
+            FLOOR((EXTRACT(DAY FROM bucket) - 1) / 7) + 1 AS week_number,
+            SUM(visits) / COUNT(DISTINCT bucket::date) AS avg_visitors
+        FROM visit_hourly_rollup
+        WHERE bucket >= %s AND bucket < %s
+          AND visits > 0
         GROUP BY week_number
         ORDER BY week_number
     """
-    results = execute_query(query, (start_date, end_date))
+    results = execute_query(query, (start_date, next_month))
 
     num_weeks = ((end_date.day - 1) // 7) + 1
     week_visitors = {f"Нед {i}": 0 for i in range(1, num_weeks + 1)}
@@ -915,14 +1848,15 @@ def get_average_visitors_per_month(year):
     """
     query = """
         SELECT 
-            EXTRACT(MONTH FROM time_start) AS month,
-            COUNT(client) / COUNT(DISTINCT DATE(time_start)) AS avg_visitors
-        FROM visit_fitness_room
-        WHERE EXTRACT(YEAR FROM time_start) = %s
-        GROUP BY EXTRACT(MONTH FROM time_start)
+            EXTRACT(MONTH FROM bucket) AS month,
+            SUM(visits) / COUNT(DISTINCT bucket::date) AS avg_visitors
+        FROM visit_hourly_rollup
+        WHERE bucket >= %s AND bucket < %s
+          AND visits > 0
+        GROUP BY EXTRACT(MONTH FROM bucket)
         ORDER BY month
     """
-    results = execute_query(query, (year,))
+    results = execute_query(query, (datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)))
 
     months_order = [
         'Янв', 'Фев', 'Март', 'Апр', 'Май', 'Июнь',
@@ -1346,12 +2280,6 @@ def get_trainer_photo(trainer_id):
         return None
 
 
-# 17. Максимальное количество посетителей за определённые часы на протяжении дня
-
-
-# 18. Среднее число посетителей по дням недели
-
-
 # Добавление нового посетителя в базу данных
 def add_new_visitor(first_name, last_name, phone_number, email, subscription_start, subscription_end):
     # Генерация пароля и его хэширование
@@ -0,0 +1,77 @@
+import logging
+import select
+import time
+
+import psycopg2
+import psycopg2.extensions
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from database import pool_manager
+
+logger = logging.getLogger(__name__)
+
+# Канал, в который триггеры базы данных отправляют уведомления (migrations/003_change_notifications.sql)
+CHANGES_CHANNEL = "crm_changes"
+
+
+class DatabaseListener(QThread):
+    """
+    Держит одно отдельное соединение с LISTEN crm_changes и превращает уведомления базы в сигналы Qt.
+    При обрыве соединения переподключается с нарастающей задержкой.
+    """
+    # имя таблицы и уточнение из полезной нагрузки (например "5:2024-03-01" для training_slots)
+    table_changed = pyqtSignal(str, str)
+    # True — уведомления поступают, False — соединение потеряно и нужен опрос по таймеру
+    connection_changed = pyqtSignal(bool)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._stop_requested = False
+        self.connected = False
+
+    def run(self):
+        delay = 1
+        while not self._stop_requested:
+            conn = None
+            try:
+                settings = pool_manager.settings
+                conn = psycopg2.connect(settings["dsn"], connect_timeout=settings["connect_timeout"],
+                                        keepalives=1, keepalives_idle=30, keepalives_interval=10,
+                                        keepalives_count=3)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CHANGES_CHANNEL}")
+                logger.info("Подписка на уведомления базы данных установлена")
+                self._set_connected(True)
+                delay = 1
+                self._listen(conn)
+            except psycopg2.Error as e:
+                logger.warning(f"Соединение для уведомлений потеряно: {e}")
+            finally:
+                self._set_connected(False)
+                if conn is not None and not conn.closed:
+                    conn.close()
+            # Пауза перед переподключением с проверкой запроса на остановку
+            deadline = time.monotonic() + delay
+            while not self._stop_requested and time.monotonic() < deadline:
+                time.sleep(0.2)
+            delay = min(delay * 2, 60)
+
+    def _listen(self, conn):
+        while not self._stop_requested:
+            # Короткий тайм-аут, чтобы поток быстро реагировал на остановку
+            if select.select([conn], [], [], 1.0) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                table, _, detail = notify.payload.partition(":")
+                self.table_changed.emit(table, detail)
+
+    def _set_connected(self, connected):
+        if self.connected != connected:
+            self.connected = connected
+            self.connection_changed.emit(connected)
+
+    def stop(self):
+        self._stop_requested = True
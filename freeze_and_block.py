@@ -2,7 +2,7 @@ from datetime import datetime, timedelta
 
 from PyQt5.QtWidgets import QDialog, QVBoxLayout, QLabel, QLineEdit, QPushButton, QMessageBox
 from PyQt5.QtCore import Qt
-from database import execute_query
+from database import execute_query, transaction
 
 class RevokeSubscriptionWindow(QDialog):
     def __init__(self, client_id, parent_window, parent=None):
@@ -47,38 +47,36 @@ class RevokeSubscriptionWindow(QDialog):
             return
 
         try:
-
             query_check_subscription = """
-                SELECT subscription FROM client WHERE client_id = %s
+                SELECT subscription FROM client WHERE client_id = %s FOR UPDATE
             """
-            subscription_result = execute_query(query_check_subscription, (self.client_id,), fetch=True)
-            if not subscription_result or not subscription_result[0][0]:
-                QMessageBox.warning(self, "Ошибка", "У клиента нет активного абонемента.")
-                return
-
-
             query_update_subscription = """
                 UPDATE subscription
                 SET revoke_reason = %s, is_valid = FALSE
-                WHERE subscription_id = (
-                    SELECT subscription FROM client WHERE client_id = %s
-                )
+                WHERE subscription_id = %s
             """
             query_update_client = """
                 UPDATE client
                 SET subscription = NULL
                 WHERE client_id = %s
             """
-            execute_query(query_update_subscription, (reason, self.client_id))
-            execute_query(query_update_client, (self.client_id,))
-
-
             query_log_action = """
                 INSERT INTO logs (action, details, client_id, timestamp)
                 VALUES (%s, %s, %s, NOW())
             """
             log_details = f"Клиенту {self.client_id} был лишён абонемент. Причина: {reason}"
-            execute_query(query_log_action, ("Лишение абонемента", log_details, self.client_id))
+
+            with transaction() as tx:
+                subscription_result = tx.execute(query_check_subscription, (self.client_id,), fetch_one=True)
+                has_subscription = bool(subscription_result and subscription_result[0])
+                if has_subscription:
+                    tx.execute(query_update_subscription, (reason, subscription_result[0]))
+                    tx.execute(query_update_client, (self.client_id,))
+                    tx.execute(query_log_action, ("Лишение абонемента", log_details, self.client_id))
+
+            if not has_subscription:
+                QMessageBox.warning(self, "Ошибка", "У клиента нет активного абонемента.")
+                return
 
             self.parent_window.update_client_in_list(self.client_id, None)
             QMessageBox.information(self, "Успех", "Абонемент успешно лишён!")
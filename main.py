@@ -1,28 +1,52 @@
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
 import sys
 
 from PyQt5.QtCore import QLocale, QTranslator, QLibraryInfo
 from PyQt5.QtGui import QFontDatabase, QFont
 from PyQt5.QtWidgets import QApplication, QDialog, QMessageBox
 
-from database import close_pool
+from config import get_setting
+from database import close_pool, prewarm_pool, load_db_settings, DatabaseConfigError
 from login import LoginWidget
 from main_window import MainWindow
 from utils import resources_path
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("app.log"),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
-
-
+# Слушатель очереди журнала, пишет записи в файл и консоль в отдельном потоке
+log_listener = None
+
+
+def setup_logging():
+    """
+    Настраивает журналирование через очередь: потоки интерфейса и рабочие потоки только кладут
+    запись в очередь, а запись в файл выполняет отдельный поток QueueListener.
+    """
+    global log_listener
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    file_handler = logging.handlers.RotatingFileHandler(
+        get_setting("logging", "file", "app.log"),
+        maxBytes=get_setting("logging", "max_bytes", 10 * 1024 * 1024, int),
+        backupCount=get_setting("logging", "backup_count", 5, int),
+        encoding="utf-8"
+    )
+    file_handler.setFormatter(formatter)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(get_setting("logging", "level", "INFO").upper())
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+
+    log_listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler,
+                                                  respect_handler_level=True)
+    log_listener.start()
+    atexit.register(log_listener.stop)
 
 
 def load_fonts():
@@ -93,6 +117,7 @@ def set_locale():
 
 def main():
     global app  # Нужно для установки трансляторов
+    setup_logging()
     app = QApplication(sys.argv)
 
     # **Загружаем локаль и шрифты**
@@ -100,6 +125,16 @@ def main():
     font = load_fonts()
     app.setFont(font)
 
+    try:
+        load_db_settings()
+    except DatabaseConfigError as e:
+        logger.error(str(e))
+        QMessageBox.critical(None, "Ошибка настроек", str(e))
+        sys.exit(1)
+
+    # Пул соединений создаётся в фоне, пока пользователь вводит логин и пароль
+    prewarm_pool()
+
     login_widget = LoginWidget()
     result = login_widget.exec_()
 
@@ -17,14 +17,20 @@ from babel.dates import format_date
 from add_trainer_slot import AddSlotWindow
 from add_visitor_window import AddVisitorWindow, AddTrainerWindow, AddAdministratorWindow
 from chart import ChartWidget
+from card_index import card_index, CARD_INDEX_FIELDS
+from card_reader import get_card_reader, stop_card_reader
+from checkin_journal import checkin_journal, replay_journal, describe_conflict
+from config import get_setting
 from constants import MAX_ACTIVE_THREADS
-from database import get_active_visitors, get_duty_trainers, count_visitors_in_gym, check_visitor_in_gym, \
-    end_attendance, \
-    start_attendance, execute_query, count_all_trainers, get_all_trainers, get_schedule_for_week, get_all_admins
+from database import get_dashboard_snapshot, execute_query, get_all_trainers, get_schedule_data_with_hash, get_all_admins, \
+    load_card_index_rows
+from db_listener import DatabaseListener
 from hover_button import HoverButton, TrainerButton, SvgHoverButton, CustomAddTrainerOrAdminButton
+from photo_store import load_thumbnails, load_thumbnail, AVATAR_SIZE, PORTRAIT_SIZE
+from schedule_cache import ScheduleCache
 from search_client import ClientSearchWindow
-from utils import scan_card, WorkerThread, ResizablePhoto, FillPhoto, ClickableLabelForSlots, resources_path, \
-    correct_to_nominative_case, LoadAdminsThread, ScanCardDialog
+from utils import WorkerThread, ResizablePhoto, FillPhoto, ClickableLabelForSlots, resources_path, \
+    correct_to_nominative_case, LoadAdminsThread, ScanCardDialog, RequestScheduler, get_tap_pipeline
 from subscription import SubscriptionWidget, SelectionGroupWidget
 
 logger = logging.getLogger(__name__)
@@ -39,7 +45,6 @@ class MainWindow(QWidget):
         self.subscription_data = None
         self.from_add_client = False
         self.active_requests = {}
-        self.active_threads = {}  # Словарь для хранения активных потоков
 
         # Установка локали
         try:
@@ -54,6 +59,10 @@ class MainWindow(QWidget):
         self.setGeometry(100, 100, 1200, 800)
         self.setStyleSheet("background-color: white;")
 
+        # Кэш фотографий дежурных тренеров: trainer_id -> (версия фото, QPixmap)
+        self.trainer_photo_cache = {}
+        self.displayed_duty_key = None
+
         self.load_admin_data()
         self.chart_widget = ChartWidget()
         self.chart_widget.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
@@ -61,13 +70,58 @@ class MainWindow(QWidget):
 
         self.initUI()
 
-        # Таймер для регулярного обновления данных
+        # Таймер для регулярного обновления данных. Пока работают уведомления базы данных,
+        # он остаётся редким резервным опросом
+        self.poll_interval = get_setting("notifications", "poll_interval_ms", 10000, int)
+        self.fallback_poll_interval = get_setting("notifications", "fallback_poll_interval_ms", 60000, int)
         self.timer = QTimer(self)
         self.timer.timeout.connect(self.fetch_and_update_data)
-        self.timer.start(10000)  # обновление каждые 10 секунд
+        self.timer.timeout.connect(self.sync_card_index)
+        self.timer.start(self.poll_interval)
+
+        # Серии уведомлений объединяются в одно обновление
+        self.dashboard_refresh_timer = QTimer(self)
+        self.dashboard_refresh_timer.setSingleShot(True)
+        self.dashboard_refresh_timer.setInterval(300)
+        self.dashboard_refresh_timer.timeout.connect(self.fetch_and_update_data)
+        self.clients_refresh_timer = QTimer(self)
+        self.clients_refresh_timer.setSingleShot(True)
+        self.clients_refresh_timer.setInterval(2000)
+        self.clients_refresh_timer.timeout.connect(self.refresh_client_list)
+        self.chart_refresh_timer = QTimer(self)
+        self.chart_refresh_timer.setSingleShot(True)
+        self.chart_refresh_timer.setInterval(5000)
+        self.chart_refresh_timer.timeout.connect(self.chart_widget.invalidate_open_periods)
+        self.card_index_sync_timer = QTimer(self)
+        self.card_index_sync_timer.setSingleShot(True)
+        self.card_index_sync_timer.setInterval(500)
+        self.card_index_sync_timer.timeout.connect(self.sync_card_index)
+        # Изменения индекса карт отложены до передачи отметок, решённых на рабочем месте
+        self.card_index_sync_deferred = False
+
+        # Отметки, записанные без связи с базой, передаются на сервер, как только связь появится
+        self.journal_replay_timer = QTimer(self)
+        self.journal_replay_timer.timeout.connect(self.replay_checkin_journal)
+        self.journal_replay_timer.start(get_setting("offline", "replay_interval_ms", 30000, int))
+
+        self.db_listener = DatabaseListener(self)
+        self.db_listener.table_changed.connect(self.on_table_changed)
+        self.db_listener.connection_changed.connect(self.on_listener_connection_changed)
+        if get_setting("notifications", "enabled", True, bool):
+            self.db_listener.start()
+
+        # Считыватель карт ищется сразу, чтобы первое касание не ждало поиска порта.
+        # Все касания проходят через конвейер: решение по индексу карт, передача на сервер пачками
+        self.tap_pipeline = get_tap_pipeline()
+        self.tap_pipeline.acknowledged.connect(self.on_tap_acknowledged)
+        self.tap_pipeline.flushed.connect(self.on_taps_flushed)
+        self.tap_pipeline.flush_failed.connect(self.on_taps_flush_failed)
+        get_card_reader().card_scanned.connect(self.tap_pipeline.submit)
 
         # Первоначальная загрузка данных
         self.fetch_and_update_data()
+        self.sync_card_index()
+        self.replay_checkin_journal()
 
     def load_admin_data(self):
         """
@@ -79,7 +133,7 @@ class MainWindow(QWidget):
                 a.surname,
                 a.first_name,
                 a.patronymic,
-                a.photo,
+                a.photo_hash,
                 u.role
             FROM
                 public.users u
@@ -91,7 +145,7 @@ class MainWindow(QWidget):
         params = (self.current_user_id,)
         result = execute_query(query, params)
         if result and len(result) > 0:
-            username, surname, first_name, patronymic, photo, role = result[0]
+            username, surname, first_name, patronymic, photo_hash, role = result[0]
             full_name = f"{surname} {first_name}"
 
             # Определение роли
@@ -102,34 +156,186 @@ class MainWindow(QWidget):
 
             self.admin_full_name = full_name
             self.admin_role = display_role
-            self.admin_photo_data = photo
+            self.admin_photo_data = load_thumbnail(photo_hash, PORTRAIT_SIZE)
         else:
             logger.error("Администратор не найден в базе данных")
             self.admin_full_name = "Администратор не найден"
             self.admin_role = ""
             self.admin_photo_data = None
 
-    def fetch_data(self):
+    def fetch_data(self, known_photo_versions):
+        """
+        Получает данные главной панели одним запросом и догружает уменьшенные копии только изменившихся
+        фотографий тренеров. Версия фотографии — её хэш (photo_store.py).
+        :param known_photo_versions: словарь {trainer_id: версия фото}, уже загруженных в интерфейс
+        """
         try:
-            total_visitors = get_active_visitors()
-            visitors_in_gym = count_visitors_in_gym()
-            all_trainers = count_all_trainers()
-            duty_trainers = get_duty_trainers()
-            return (total_visitors, visitors_in_gym, all_trainers, duty_trainers)
+            snapshot = get_dashboard_snapshot()
+            if snapshot is None:
+                return None
+            changed = {
+                trainer["trainer_id"]: trainer["photo_version"] for trainer in snapshot["duty_trainers"]
+                if trainer["photo_version"] and known_photo_versions.get(trainer["trainer_id"]) != trainer["photo_version"]
+            }
+            thumbnails = load_thumbnails(changed.values(), AVATAR_SIZE)
+            snapshot["photos"] = {
+                trainer_id: (version, thumbnails[version])
+                for trainer_id, version in changed.items() if version in thumbnails
+            }
+            return snapshot
         except Exception as e:
             logger.error(f"Ошибка при получении данных: {e}")
             return None
 
     def fetch_and_update_data(self):
-        self.fetch_data_thread = WorkerThread(self.fetch_data)
+        # Пока предыдущий запрос не завершён, новый не запускаем
+        if getattr(self, "fetch_data_thread", None) is not None and self.fetch_data_thread.isRunning():
+            return
+        known_photo_versions = {trainer_id: version for trainer_id, (version, _) in self.trainer_photo_cache.items()}
+        self.fetch_data_thread = WorkerThread(self.fetch_data, known_photo_versions)
         self.fetch_data_thread.result_signal.connect(self.update_data)
         self.fetch_data_thread.start()
 
+    def on_table_changed(self, table, detail):
+        """Обрабатывает уведомление базы данных об изменении таблицы."""
+        if table in ("visit_fitness_room", "subscription", "training_slots"):
+            self.dashboard_refresh_timer.start()
+        if table in ("visit_fitness_room", "subscription"):
+            self.clients_refresh_timer.start()
+        if table == "visit_fitness_room":
+            self.chart_refresh_timer.start()
+        if table in ("client", "subscription", "visit_fitness_room"):
+            self.card_index_sync_timer.start()
+        if table == "training_slots" and detail:
+            self.on_training_slot_changed(detail)
+
+    def on_listener_connection_changed(self, connected):
+        if connected:
+            logger.info("Уведомления базы данных доступны, опрос переведён в резервный режим")
+            self.timer.setInterval(self.fallback_poll_interval)
+            # Изменения, пропущенные во время переподключения
+            self.fetch_and_update_data()
+            self.sync_card_index()
+            self.replay_checkin_journal()
+        else:
+            logger.warning("Уведомления базы данных недоступны, включён опрос по таймеру")
+            self.timer.setInterval(self.poll_interval)
+
+    def sync_card_index(self):
+        """Загружает индекс карт целиком или, если он уже загружен, дочитывает изменения."""
+        if getattr(self, "card_index_thread", None) is not None and self.card_index_thread.isRunning():
+            # Изменения, пришедшие во время синхронизации, дочитываются следующей
+            self.card_index_sync_timer.start()
+            return
+        since = card_index.synced_at
+        self.card_index_thread = WorkerThread(load_card_index_rows, since)
+        self.card_index_thread.result_signal.connect(partial(self.apply_card_index_rows, since))
+        self.card_index_thread.start()
+
+    def apply_card_index_rows(self, since, result):
+        if result is None:
+            return
+        synced_at, rows = result
+        # Строки сервера ещё не учитывают отметки, которые не переданы: они затёрли бы вход или выход,
+        # отмеченный в индексе на рабочем месте. Индекс дочитывается с того же момента после передачи
+        unconfirmed = self.tap_pipeline.unconfirmed_clients()
+        if unconfirmed and any(row[CARD_INDEX_FIELDS.index("client_id")] in unconfirmed for row in rows):
+            logger.info("Обновление индекса карт отложено до передачи отметок")
+            self.card_index_sync_deferred = True
+            self.replay_checkin_journal()
+            return
+        self.card_index_sync_deferred = False
+        if since is None:
+            card_index.load(rows, synced_at)
+        else:
+            card_index.update(rows, synced_at)
+
+    def replay_checkin_journal(self):
+        """Передаёт на сервер отметки из локального журнала, если они есть."""
+        if getattr(self, "journal_replay_thread", None) is not None and self.journal_replay_thread.isRunning():
+            return
+        if not checkin_journal.pending_count():
+            return
+        self.journal_replay_thread = WorkerThread(replay_journal, checkin_journal)
+        self.journal_replay_thread.result_signal.connect(self.on_checkin_journal_replayed)
+        self.journal_replay_thread.start()
+
+    def on_checkin_journal_replayed(self, result):
+        replayed, conflicts = result
+        if not replayed:
+            return
+        self.fetch_and_update_data()
+        self.sync_card_index()
+        self.show_tap_conflicts(conflicts, "Переданы отметки, сделанные без связи с базой.")
+
+    def on_tap_acknowledged(self, card_number, accepted, message):
+        self.tap_status_label.setText(message)
+        self.tap_status_label.setStyleSheet("color: #75A9A7;" if accepted else "color: #d9534f;")
+
+    def on_taps_flushed(self, conflicts):
+        self.dashboard_refresh_timer.start()
+        # Пачка могла уйти в локальный журнал
+        self.replay_checkin_journal()
+        if conflicts or self.card_index_sync_deferred:
+            self.sync_card_index()
+            self.show_tap_conflicts(conflicts, "Сервер не подтвердил часть отметок карт.")
+
+    def on_taps_flush_failed(self, error):
+        self.tap_status_label.setText("Отметки карт не сохранены, передача повторяется")
+        self.tap_status_label.setStyleSheet("color: #d9534f;")
+        self.show_tap_report(QMessageBox.Critical,
+                             "Отметки карт не удалось передать на сервер и сохранить в локальном журнале: "
+                             f"{error}\nОтметки хранятся в памяти, передача будет повторяться. "
+                             "Не закрывайте приложение, пока ошибка не устранена.")
+
+    def show_tap_conflicts(self, conflicts, title):
+        """Добавляет расхождения в отчёт; кнопка под сканером показывает их число и открывает отчёт."""
+        if not conflicts:
+            return
+        self.tap_conflict_lines.append(title)
+        self.tap_conflict_lines.extend(describe_conflict(tap, status) for tap, status in conflicts)
+        self.tap_conflict_count += len(conflicts)
+        self.tap_conflicts_button.setText(f"Расхождения отметок карт: {self.tap_conflict_count}")
+        self.tap_conflicts_button.show()
+
+    def show_tap_conflicts_report(self):
+        self.show_tap_report(QMessageBox.Warning, "Расхождения отметок карт:\n" + "\n".join(self.tap_conflict_lines))
+        self.tap_conflict_lines = []
+        self.tap_conflict_count = 0
+        self.tap_conflicts_button.hide()
+
+    def show_tap_report(self, icon, text):
+        """Немодальное сообщение: окно не блокирует обработку касаний карт, пока его не закроют."""
+        report = QMessageBox(icon, "Отметки карт", text, QMessageBox.Ok, self)
+        report.setWindowModality(Qt.NonModal)
+        report.setAttribute(Qt.WA_DeleteOnClose)
+        report.show()
+
+    def refresh_client_list(self):
+        """Перезагружает открытый список клиентов."""
+        window = getattr(self, "view_visitors_window", None)
+        if window is not None and window.isVisible():
+            window.refresh_clients()
+
     def update_data(self, result):
         if result is None:
             logger.error("Нет данных для обновления")
             return
-        total_visitors, visitors_in_gym, all_trainers, duty_trainers = result
+        total_visitors = result["active_clients"]
+        visitors_in_gym = result["visitors_in_gym"]
+        all_trainers = result["trainers_total"]
+        duty_trainers = result["duty_trainers"]
+
+        # Фотографии масштабируются один раз и хранятся до смены версии
+        for trainer_id, (version, photo) in result["photos"].items():
+            pixmap = None
+            if photo:
+                pixmap = QPixmap()
+                if pixmap.loadFromData(photo):
+                    pixmap = pixmap.scaled(90, 90, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+                else:
+                    pixmap = None
+            self.trainer_photo_cache[trainer_id] = (version, pixmap)
 
         def get_plural_form(number, forms):
             """
@@ -164,7 +370,12 @@ class MainWindow(QWidget):
         # Установка текста в QLabel
         self.visitors_label.setText(visitors_label_text)
         self.trainers_label.setText(trainers_label_text)
-        self.update_duty_trainers_ui(duty_trainers)
+
+        # Полоса дежурных тренеров перестраивается только при изменении состава или фотографий
+        duty_key = [(trainer["trainer_id"], trainer["photo_version"]) for trainer in duty_trainers[:3]]
+        if duty_key != self.displayed_duty_key:
+            self.displayed_duty_key = duty_key
+            self.update_duty_trainers_ui(duty_trainers)
 
     def show_add_visitor_window(self):
         if not hasattr(self, 'add_visitor_window') or not self.add_visitor_window.isVisible():
@@ -179,57 +390,6 @@ class MainWindow(QWidget):
             self.view_visitors_window.show()
             self.view_visitors_window.raise_()
 
-    def scan_card_for_attendance(self):
-        if hasattr(self, 'scan_thread') and self.scan_thread.isRunning():
-            self.scan_thread.stop()  # Останавливаем старый поток
-            self.scan_thread.wait()  # Ждем завершения
-
-        self.card_number = None  # Сбрасываем перед каждым сканированием
-        self.scan_thread = WorkerThread(self._scan_card_and_update_attendance)
-        self.scan_thread.result_signal.connect(self.handle_scan_result)
-        self.scan_thread.start()
-
-    def _scan_card_and_update_attendance(self):
-        card_number = scan_card()
-
-        if self.scan_thread._stop_requested:  # Проверяем, был ли поток остановлен
-            return None
-
-        if not card_number:
-            return None
-
-        attendance_data = check_visitor_in_gym(card_number)
-
-        if self.scan_thread._stop_requested:  # Проверяем снова перед возвратом результата
-            return None
-
-        return card_number, attendance_data
-
-    def handle_scan_result(self, result):
-        if not result:
-            QMessageBox.warning(self, "Ошибка", "Карта не была отсканирована.")
-            return
-        if result is None:
-            logger.error("Ошибка при сканировании карты или получении данных")
-            QMessageBox.critical(self, "Ошибка", "Произошла ошибка при сканировании карты.")
-            return
-
-        card_number, attendance_data = result
-        if attendance_data:
-            visit_id, in_gym, time_start, time_end = attendance_data
-            if in_gym:
-                end_attendance(visit_id)
-                logger.info(f"Посещение ID {visit_id} завершено.")
-                QMessageBox.information(self, "Статус посещения", "Посещение завершено.")
-            else:
-                start_attendance(visit_id)
-                logger.info(f"Посещение клиента ID {visit_id} начато.")
-                QMessageBox.information(self, "Статус посещения", "Посещение начато.")
-            self.fetch_and_update_data()
-        else:
-            logger.warning("Посетитель не найден или произошла ошибка при проверке.")
-            QMessageBox.warning(self, "Проблема", "Посетитель не найден или произошла ошибка.")
-
     def initUI(self):
         main_layout = QVBoxLayout(self)
         self.stack = QStackedWidget()
@@ -347,6 +507,20 @@ class MainWindow(QWidget):
         left_panel.addWidget(new_visitor_button)
         left_panel.addSpacing(20)
         left_panel.addWidget(scan_card_button)
+        # Подтверждение последнего касания карты
+        self.tap_status_label = QLabel("")
+        self.tap_status_label.setWordWrap(True)
+        left_panel.addWidget(self.tap_status_label)
+        # Расхождения отметок копятся в отчёт, который открывается по кнопке и не прерывает работу сканера
+        self.tap_conflict_lines = []
+        self.tap_conflict_count = 0
+        self.tap_conflicts_button = QPushButton("")
+        self.tap_conflicts_button.setFlat(True)
+        self.tap_conflicts_button.setCursor(Qt.PointingHandCursor)
+        self.tap_conflicts_button.setStyleSheet("color: #d9534f; text-align: left; border: 0px;")
+        self.tap_conflicts_button.clicked.connect(self.show_tap_conflicts_report)
+        self.tap_conflicts_button.hide()
+        left_panel.addWidget(self.tap_conflicts_button)
         left_panel.addSpacing(20)
         left_panel.addWidget(visitor_list_button)
         left_panel.addStretch()
@@ -500,11 +674,6 @@ class MainWindow(QWidget):
         with open("path_to_image.png", "rb") as file:
             return file.read()
 
-    def load_duty_trainers(self):
-        self.duty_trainers_thread = WorkerThread(get_duty_trainers)
-        self.duty_trainers_thread.result_signal.connect(self.update_duty_trainers_ui)
-        self.duty_trainers_thread.start()
-
     def update_duty_trainers_ui(self, duty_trainers):
         # Очищаем текущие виджеты
         # self.trainers_container.addWidget(self.duty_trainers_label)
@@ -516,6 +685,7 @@ class MainWindow(QWidget):
         for widget in self.displayed_trainers:
             self.trainers_grid.removeWidget(widget)
             widget.setParent(None)
+        self.displayed_trainers = []
 
 
         if duty_trainers:
@@ -531,7 +701,10 @@ class MainWindow(QWidget):
             self.duty_trainers_label.setText("Нет тренеров на смене")
 
     def create_trainer_widget(self, trainer):
-        trainer_id, first_name, surname, patronymic, phone_number, description, photo = trainer
+        surname = trainer["surname"]
+        version, pixmap = self.trainer_photo_cache.get(trainer["trainer_id"], (None, None))
+        if version != trainer["photo_version"]:
+            pixmap = None
 
         layout = QVBoxLayout()
         layout.setAlignment(Qt.AlignCenter)
@@ -543,20 +716,17 @@ class MainWindow(QWidget):
             border-radius:10px;
         """)
 
-        if photo:
-            pixmap = QPixmap()
-            pixmap.loadFromData(photo)
-            pixmap = pixmap.scaled(90, 90, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        if pixmap:
             photo_label.setPixmap(pixmap)
             photo_label.setAlignment(Qt.AlignCenter)
         else:
-            photo_label.setText(first_name)
+            photo_label.setText(surname)
             photo_label.setAlignment(Qt.AlignCenter)
             photo_label.setStyleSheet("font-size: 14px; font-weight: bold;")
 
         layout.addWidget(photo_label)
 
-        name_label = QLabel(f"{first_name}")
+        name_label = QLabel(f"{surname}")
         name_label.setFont(QFont("Unbounded", 10, QFont.Bold))
         name_label.setFixedWidth(100)
         name_label.setAlignment(Qt.AlignLeft)
@@ -571,6 +741,17 @@ class MainWindow(QWidget):
 
         return trainer_widget
 
+    @staticmethod
+    def fetch_trainers():
+        """
+        Список тренеров с уменьшенными копиями фотографий. Выполняется в фоновом потоке.
+        """
+        trainers = get_all_trainers()
+        thumbnails = load_thumbnails([trainer["photo_hash"] for trainer in trainers], AVATAR_SIZE)
+        for trainer in trainers:
+            trainer["image"] = thumbnails.get(trainer["photo_hash"])
+        return trainers
+
     def load_trainers(self):
 
         """
@@ -605,7 +786,7 @@ class MainWindow(QWidget):
             self.trainer_buttons.append(add_trainer_widget)
             self.update_scrollbar_visibility()
 
-        self.worker = WorkerThread(get_all_trainers)
+        self.worker = WorkerThread(self.fetch_trainers)
         print(1123)
         self.worker.result_signal.connect(handle_result)
         self.worker.finished_signal.connect(self.worker.deleteLater)
@@ -853,7 +1034,16 @@ class MainWindow(QWidget):
     def init_schedule_page(self):
         self.selected_trainer_id = None
         self.day_widgets = {}  # Словарь для хранения виджетов дней по дате
-        self.schedule_cache = {}  # Структура: {(trainer_id, day_date): {"data": [...], "hash": "..."}}
+        self.schedule_cache = ScheduleCache()
+        self.displayed_week = None  # (trainer_id, start_date, end_date) недели на экране
+        # Уведомления об изменении слотов приходят пачками — перезагружаем неделю один раз
+        self.schedule_refresh_timer = QTimer(self)
+        self.schedule_refresh_timer.setSingleShot(True)
+        self.schedule_refresh_timer.setInterval(300)
+        self.schedule_refresh_timer.timeout.connect(lambda: self.refresh_displayed_week(reload=True))
+        # Загрузка месяца на экране и фоновая загрузка следующего: новый запрос отменяет прежний
+        self.schedule_requests = RequestScheduler(self)
+        self.schedule_prefetch_requests = RequestScheduler(self)
 
         self.current_date = datetime.date.today()
         month_calendar = calendar.monthcalendar(self.current_date.year, self.current_date.month)
@@ -1291,6 +1481,8 @@ class MainWindow(QWidget):
         self.week_buttons_group.set_selected_option(f"{self.current_week} неделя")
 
         self.update_days(self.current_week, trainer_id)
+        # Месяц на экране из кэша сверяется с сервером; следующий месяц загружается заранее
+        self.refresh_displayed_week()
 
     def update_week_selection(self):
         """Обрабатывает выбор недели через SelectionGroupWidget."""
@@ -1314,34 +1506,6 @@ class MainWindow(QWidget):
 
         return week_frame
 
-    def extract_slots_from_scroll_area(self, scroll_area):
-        """
-        Извлекает список слотов (временных интервалов) из `scroll_area`.
-        :param scroll_area: Объект QScrollArea, содержащий виджеты слотов.
-        :return: Список слотов в формате [(start_time, end_time), ...].
-        """
-        container_widget = scroll_area
-        if not container_widget:
-            return []
-
-        container_layout = container_widget.layout()
-        slots = []
-        for i in range(container_layout.count()):
-            entry_widget = container_layout.itemAt(i).widget()
-            if entry_widget:
-                time_label = entry_widget.findChild(QLabel)
-                if time_label:
-                    try:
-                        start_time, end_time = map(
-                            lambda t: QTime.fromString(t.strip(), "hh:mm"),
-                            time_label.text().split('-')
-                        )
-                        if start_time.isValid() and end_time.isValid():
-                            slots.append((start_time, end_time))
-                    except ValueError:
-                        continue
-        return slots
-
     def create_day_widget(self, day_name, day, schedule_data=None, is_enabled=True):
 
         schedule_data = schedule_data or []
@@ -1514,7 +1678,7 @@ class MainWindow(QWidget):
             add_button.disable_button()
 
         container_layout.addWidget(add_button, alignment=Qt.AlignCenter)
-        add_button.clicked.connect(lambda: self.open_add_slot_window(container_layout, day))
+        add_button.clicked.connect(lambda: self.open_add_slot_window(day))
 
         container_widget.setLayout(container_layout)
         scroll_area.setWidget(container_widget)
@@ -1523,14 +1687,10 @@ class MainWindow(QWidget):
 
         return day_frame
 
-    def open_add_slot_window(self, scroll_area, day):
-
-        existing_slots = self.extract_slots_from_scroll_area(scroll_area)
-
+    def open_add_slot_window(self, day):
         self.add_slot_window = AddSlotWindow(
             selected_client=self.selected_client,
             subscription_data=self.subscription_data,
-            existing_slots=existing_slots,
             selected_date=day,
             trainer_id=self.selected_trainer_id  # Передаем ID тренера
         )
@@ -1551,46 +1711,17 @@ class MainWindow(QWidget):
         if isinstance(slot_data["end_time"], QTime):
             slot_data["end_time"] = slot_data["end_time"].toString("HH:mm")
 
-        # **Находим существующий cache_key (по неделе)**
-        cache_key = None
-        for key in self.schedule_cache.keys():
-            # Смотрим, что тренер и дата совпадают
-            if key[0] == self.selected_trainer_id and day_date in self.schedule_cache[key]:
-                cache_key = key
-                break
-
-        # Если нужного cache_key нет, создаём новый
-        if cache_key is None:
-            cache_key = (self.selected_trainer_id, day_date)
-            self.schedule_cache[cache_key] = {}
-
-        # **Добавляем слот в день (создаем если еще нет)**
-        if day_date not in self.schedule_cache[cache_key]:
-            self.schedule_cache[cache_key][day_date] = []
-
-        # **Проверяем, что слот ещё не добавлен**
-        existing_slot = next((s for s in self.schedule_cache[cache_key][day_date]
-                              if s["start_time"] == slot_data["start_time"] and s["end_time"] == slot_data["end_time"]),
-                             None)
-
-        if existing_slot:
-            print(f"Слот {slot_data['start_time']} - {slot_data['end_time']} уже существует!")
-        else:
-            self.schedule_cache[cache_key][day_date].append(slot_data)
-            print(f"Слот добавлен в кэш: {slot_data}")
-
-        print(f"Обновленный кэш: {self.schedule_cache}")
+        slots = self.schedule_cache.add_slot(self.selected_trainer_id, day_date, slot_data)
+        if slots is None:
+            # Неделя ещё не загружена — берём её с сервера целиком
+            self.refresh_displayed_week()
+            return
 
-        # **Обновляем UI**
         if day_date in self.day_widgets:
-            print(f"Обновляем виджет для {day_date}")
-            self.update_day_widget(self.day_widgets[day_date], self.schedule_cache[cache_key][day_date],
-                                   is_enabled=True, day=day_date)
+            self.update_day_widget(self.day_widgets[day_date], slots, is_enabled=True, day=day_date)
         else:
             print(f"Ошибка: виджет для {day_date} не найден")
 
-        print(f"После обновления UI: {self.schedule_cache.get(cache_key, {})}")
-
     def display_added_slot(self, slot_data):
         print(f"Добавленный слот: {slot_data}")
 
@@ -1714,8 +1845,8 @@ class MainWindow(QWidget):
                 self.day_widgets[day_date] = day_widget
 
         if start_date and end_date:  # Если даты корректны
-            # Загрузка данных для всей недели
-            self.load_schedule_for_week(trainer_id, start_date, end_date)
+            # Неделя берётся из расписания месяца в памяти
+            self.show_week_schedule(trainer_id, start_date, end_date)
 
         self.replace_week_layout(buffer_layout)
 
@@ -1775,81 +1906,118 @@ class MainWindow(QWidget):
             else:
                 print(f"Ошибка: виджет для {day_date} не найден.")
 
-    def terminate_all_threads(self):
+    def stop_all_threads(self):
         """
-        Завершает все активные потоки.
+        Отменяет фоновые запросы расписания и дожидается завершения их потоков, синхронизации индекса карт и передачи локального журнала отметок.
         """
-
-        for cache_key, worker in self.active_threads.items():
-            logger.info(f"Завершение потока: {id(worker)} для {cache_key}")
-            worker.terminate()
-        self.active_threads.clear()
-
-    def load_schedule_for_week(self, trainer_id, start_date, end_date):
+        self.schedule_requests.shutdown()
+        self.schedule_prefetch_requests.shutdown()
+        if getattr(self, "card_index_thread", None) is not None:
+            self.card_index_thread.wait(2000)
+        if getattr(self, "journal_replay_thread", None) is not None:
+            self.journal_replay_thread.wait(2000)
+
+    @staticmethod
+    def month_range(year, month):
+        """Период загрузки месяца: с понедельника его первой недели по воскресенье последней."""
+        first_day = datetime.date(year, month, 1)
+        last_day = datetime.date(year, month, calendar.monthrange(year, month)[1])
+        return (first_day - datetime.timedelta(days=first_day.weekday()),
+                last_day + datetime.timedelta(days=6 - last_day.weekday()))
+
+    def show_week_schedule(self, trainer_id, start_date, end_date):
         """
-        Загружает расписание для тренера за неделю.
+        Показывает неделю из расписания месяца в памяти.
+        Месяц загружается с сервера, только если его нет в кэше или его версия сброшена.
         """
-        if hasattr(self, "is_loading_week") and self.is_loading_week:
-            logger.info("Запрос расписания уже выполняется. Ожидание завершения.")
+        self.displayed_week = (trainer_id, start_date, end_date)
+        month_start, month_end = self.month_range(start_date.year, start_date.month)
+        entry = self.schedule_cache.get(trainer_id, month_start, month_end)
+        if entry is not None:
+            self.update_schedule_ui(self.week_schedule(entry.data, start_date, end_date))
+        if entry is None or entry.version is None:
+            self.load_schedule_for_month(trainer_id, start_date.year, start_date.month)
+
+    def load_schedule_for_month(self, trainer_id, year, month, prefetch=False, reload=False):
+        """
+        Загружает расписание тренера за месяц вместе с соседними неделями одним запросом.
+        Если месяц уже в кэше, сервер проверяет его версию и присылает слоты, только если расписание изменилось.
+        Новый запрос отменяет прежний: действует только последний выбранный месяц.
+        :param prefetch: Фоновая загрузка следующего месяца, её результат только кладётся в кэш.
+        :param reload: Перезапустить запрос, даже если этот месяц уже загружается.
+        """
+        month_start, month_end = self.month_range(year, month)
+        cache_key = (trainer_id, month_start, month_end)
+        requests = self.schedule_prefetch_requests if prefetch else self.schedule_requests
+        if requests.current_key == cache_key and not reload:
+            logger.info(f"Расписание {cache_key} уже загружается")
             return
+        if not prefetch and self.schedule_prefetch_requests.current_key == cache_key:
+            self.schedule_prefetch_requests.cancel()
 
-        self.is_loading_week = True
-
-        cache_key = (trainer_id, start_date, end_date)
-
-        if cache_key in self.schedule_cache:
-            self.update_schedule_ui(self.schedule_cache[cache_key])
-            self.is_loading_week = False
-            return
+        entry = self.schedule_cache.get(trainer_id, month_start, month_end)
+        known_hash = entry.version if entry is not None else None
 
         # Обработчик результата
-        def handle_result(schedule_data):
-            try:
-                if not schedule_data:
-                    logger.warning(f"Пустое расписание для {cache_key}.")
-                else:
-                    self.schedule_cache[cache_key] = schedule_data
-                    self.update_schedule_ui(schedule_data)
-            except Exception as e:
-                logger.error(f"Ошибка в обработчике результата: {e}")
-            finally:
-                self.is_loading_week = False
-                logger.info(f"Флаг is_loading_week сброшен для {cache_key}")
+        def handle_result(result):
+            if result is None:
+                logger.warning(f"Не удалось получить расписание для {cache_key}.")
+                return
+            version, schedule_data = result
+            if schedule_data is None:
+                logger.info(f"Расписание {cache_key} не изменилось")
+            else:
+                self.schedule_cache.put(trainer_id, month_start, month_end, schedule_data, version)
+                if self.displayed_week is not None:
+                    displayed_trainer, start_date, end_date = self.displayed_week
+                    if displayed_trainer == trainer_id and month_start <= start_date and end_date <= month_end:
+                        self.update_schedule_ui(self.week_schedule(schedule_data, start_date, end_date))
+            if not prefetch:
+                self.prefetch_next_month(trainer_id, year, month)
 
         def handle_error(error_message):
             logger.error(f"Ошибка в потоке загрузки расписания: {error_message}")
-            self.is_loading_week = False
-            logger.info(f"Флаг is_loading_week сброшен после ошибки для {cache_key}")
-
-        worker = WorkerThread(get_schedule_for_week, trainer_id, start_date, end_date)
-        logger.info(f"Создан поток: {id(worker)} для {cache_key}")
-
-        worker.result_signal.connect(handle_result)
-        worker.error_signal.connect(handle_error)
-        worker.finished_signal.connect(lambda: logger.info(f"Поток завершён: {id(worker)}"))
-        worker.finished_signal.connect(lambda: self.active_threads.pop(cache_key, None))
-
-        worker.finished_signal.connect(lambda: setattr(self, "is_loading_week", False))  # Сбрасываем флаг выполнения
-
-        worker.start()
 
-        self.active_threads[cache_key] = worker
-
-    def get_schedule_hash_for_day(self, trainer_id, day_date):
-        """
-        Получает хэш расписания для тренера на определённый день.
-        :param trainer_id: ID тренера.
-        :param day_date: Дата дня.
-        :return: Хэш данных (например, md5) или временная метка.
+        requests.submit(cache_key, get_schedule_data_with_hash, trainer_id, month_start, month_end, known_hash,
+                        on_result=handle_result, on_error=handle_error)
+
+    def prefetch_next_month(self, trainer_id, year, month):
+        """Загружает в фоне следующий месяц, если его ещё нет в кэше."""
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        month_start, month_end = self.month_range(year, month)
+        if self.schedule_cache.get(trainer_id, month_start, month_end) is None:
+            self.load_schedule_for_month(trainer_id, year, month, prefetch=True)
+
+    @staticmethod
+    def week_schedule(schedule_data, start_date, end_date):
+        """Расписание по всем дням недели: дни без слотов получают пустой список, чтобы очистить их виджеты."""
+        days = (start_date + datetime.timedelta(days=i) for i in range((end_date - start_date).days + 1))
+        return {day: schedule_data.get(day, []) for day in days}
+
+    def refresh_displayed_week(self, reload=False):
+        """Проверяет у сервера версию месяца, неделя которого на экране."""
+        if self.displayed_week is not None and self.displayed_week[0] == self.selected_trainer_id:
+            trainer_id, start_date, _ = self.displayed_week
+            self.load_schedule_for_month(trainer_id, start_date.year, start_date.month, reload=reload)
+
+    def on_training_slot_changed(self, detail):
         """
-        query = """
-            SELECT MD5(STRING_AGG(CONCAT_WS(',', ts.start_time, ts.end_time, c.first_name, c.surname), ',')) AS hash
-            FROM training_slots ts
-            LEFT JOIN client c ON ts.client = c.client_id
-            WHERE ts.trainer = %s AND DATE(ts.start_time) = %s;
+        Обрабатывает уведомление об изменении слота: training_slots:<trainer>:<YYYY-MM-DD>.
+        Сбрасывает версию месяцев этого тренера с этим днём и перезагружает месяц, если он на экране.
         """
-        result = execute_query(query, (trainer_id, day_date))
-        return result[0][0] if result else None
+        trainer_id, _, day = detail.partition(":")
+        try:
+            trainer_id = int(trainer_id)
+            day = datetime.date.fromisoformat(day)
+        except ValueError:
+            logger.warning(f"Неизвестный формат уведомления о слоте: {detail!r}")
+            return
+        self.schedule_cache.invalidate(trainer_id, day)
+        if self.displayed_week is not None:
+            displayed_trainer, start_date, _ = self.displayed_week
+            month_start, month_end = self.month_range(start_date.year, start_date.month)
+            if displayed_trainer == trainer_id and month_start <= day <= month_end:
+                self.schedule_refresh_timer.start()
 
     def update_day_widget(self, day_widget, schedule_data, is_enabled, day):
         """
@@ -1976,7 +2144,7 @@ class MainWindow(QWidget):
 
         print("Добавляем кнопку '+'")
         add_button = HoverButton("+", 30, 30, 40, '#75A9A7', True, '', '', 5, '#5DEBE6')
-        add_button.clicked.connect(lambda: self.open_add_slot_window(container_layout, day))
+        add_button.clicked.connect(lambda: self.open_add_slot_window(day))
 
         if not is_enabled:
             add_button.disable_button()
@@ -2004,27 +2172,8 @@ class MainWindow(QWidget):
             slot_widget.setParent(None)
             slot_widget.deleteLater()
 
-            # 3. Удаление из `schedule_cache`
-            cache_key = None
-            for key in self.schedule_cache.keys():
-                if key[0] == self.selected_trainer_id and day_date in self.schedule_cache[key]:
-                    cache_key = key
-                    break
-
-            if cache_key:
-                updated_slots = [slot for slot in self.schedule_cache[cache_key][day_date] if
-                                 slot["slot_id"] != slot_id]
-
-                if updated_slots:
-                    self.schedule_cache[cache_key][day_date] = updated_slots
-                else:
-                    del self.schedule_cache[cache_key][day_date]  # Удаляем день, если слоты закончились
-
-                    # Если после удаления `day_date` больше нет данных, удаляем `cache_key`
-                    if not self.schedule_cache[cache_key]:
-                        del self.schedule_cache[cache_key]
-
-                print(f"Слот {slot_id} удалён из кэша для {day_date}")
+            # 3. Удаление из кэша расписания
+            self.schedule_cache.remove_slot(self.selected_trainer_id, day_date, slot_id)
 
             QMessageBox.information(self, "Удаление", "Слот успешно удалён.")
 
@@ -2062,5 +2211,9 @@ class MainWindow(QWidget):
 
 
     def closeEvent(self, event):
-        self.terminate_all_threads()
+        self.db_listener.stop()
+        self.db_listener.wait(2000)
+        stop_card_reader()
+        self.tap_pipeline.shutdown()
+        self.stop_all_threads()
         event.accept()
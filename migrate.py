@@ -0,0 +1,127 @@
+"""
+Применяет SQL-миграции из папки migrations к базе данных.
+Файлы применяются по порядку имён, применённые миграции записываются в таблицу schema_migrations.
+
+    python migrate.py                — применить новые миграции
+    python migrate.py --list         — показать состояние миграций
+    python migrate.py --check-plans  — проверить, что запросы расписания используют индексы
+"""
+import datetime
+import json
+import logging
+import sys
+
+from constants import DIR_APPLICATION
+from database import pool_manager, day_range, SCHEDULE_SLOTS_QUERY, SCHEDULE_HASH_QUERY
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = DIR_APPLICATION / "migrations"
+
+
+def get_migration_files():
+    return sorted(MIGRATIONS_DIR.glob("*.sql"))
+
+
+def get_applied_migrations(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS public.schema_migrations (
+            name       text PRIMARY KEY,
+            applied_at timestamp NOT NULL DEFAULT NOW()
+        )
+    """)
+    cursor.execute("SELECT name FROM public.schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def apply_migrations():
+    """Применяет все ещё не применённые миграции, каждую в своей транзакции."""
+    conn = pool_manager.getconn()
+    try:
+        with conn.cursor() as cursor:
+            applied = get_applied_migrations(cursor)
+            conn.commit()
+            for path in get_migration_files():
+                if path.name in applied:
+                    continue
+                logger.info(f"Применение миграции {path.name}")
+                try:
+                    cursor.execute(path.read_text(encoding="utf-8"))
+                    cursor.execute("INSERT INTO public.schema_migrations (name) VALUES (%s)", (path.name,))
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    logger.error(f"Ошибка применения миграции {path.name}: {e}")
+                    return False
+        return True
+    finally:
+        pool_manager.putconn(conn)
+
+
+def list_migrations():
+    conn = pool_manager.getconn()
+    try:
+        with conn.cursor() as cursor:
+            applied = get_applied_migrations(cursor)
+            conn.commit()
+        for path in get_migration_files():
+            mark = "+" if path.name in applied else " "
+            print(f"[{mark}] {path.name}")
+    finally:
+        pool_manager.putconn(conn)
+
+
+# Запросы, план которых проверяет --check-plans: (название, запрос, параметры, таблица, индекс, столбец условия)
+_today = datetime.date.today()
+PLAN_CHECKS = (
+    ("расписание тренера", SCHEDULE_SLOTS_QUERY, (0, *day_range(_today, _today + datetime.timedelta(days=41))),
+     "training_slots", "training_slots_trainer_start_idx", "start_time"),
+    ("версия расписания", SCHEDULE_HASH_QUERY, (0, *day_range(_today, _today + datetime.timedelta(days=41))),
+     "training_slots", "training_slots_trainer_start_idx", "start_time"),
+)
+
+
+def _plan_nodes(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+def check_query_plans():
+    """
+    Проверяет по EXPLAIN, что условие по времени начала в запросах расписания
+    выполняется индексом, а не перебором таблицы. Последовательное сканирование
+    на время проверки запрещено, чтобы на маленькой базе план не отличался от рабочего.
+    """
+    conn = pool_manager.getconn()
+    ok = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            for name, query, params, table, index, column in PLAN_CHECKS:
+                cursor.execute("EXPLAIN (FORMAT JSON) " + query.strip(), params)
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                nodes = [node for node in _plan_nodes(plan[0]["Plan"]) if node.get("Relation Name") == table
+                         or node.get("Index Name") == index]
+                uses_index = any(node.get("Index Name") == index and column in node.get("Index Cond", "")
+                                 for node in nodes)
+                mark = "+" if uses_index else "!"
+                print(f"[{mark}] {name}: " + ", ".join(f"{node['Node Type']} {node.get('Index Name', table)}"
+                                                     for node in nodes))
+                ok = ok and uses_index
+        conn.rollback()
+    finally:
+        pool_manager.putconn(conn)
+    return ok
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if "--list" in sys.argv:
+        list_migrations()
+    elif "--check-plans" in sys.argv:
+        sys.exit(0 if check_query_plans() else 1)
+    else:
+        sys.exit(0 if apply_migrations() else 1)
@@ -0,0 +1,137 @@
+-- Проверка карты и фиксация входа/выхода за один запрос.
+-- Возвращает код результата:
+--   entered       — вход зафиксирован
+--   exited        — выход зафиксирован
+--   unknown_card  — карта не привязана к клиенту
+--   no_subscription — у клиента нет абонемента
+--   expired       — абонемент просрочен и деактивирован
+--   invalid       — абонемент недействителен
+--   morning_only  — абонемент действует только до 16:00
+--   evening_only  — абонемент действует только после 16:00
+--   limit_reached — лимит посещений исчерпан
+-- Выход из зала фиксируется всегда, проверки абонемента выполняются только при входе.
+-- p_local_time — местное время рабочего места: по нему, а не по часовому поясу сервера,
+-- проверяются срок действия абонемента и время тарифа (как в индексе карт рабочего места).
+-- Время посещения записывается по часам сервера.
+
+CREATE OR REPLACE FUNCTION public.card_checkin(p_card text, p_local_time timestamp)
+    RETURNS TABLE (
+        status          text,
+        client_id       integer,
+        subscription_id integer,
+        visit_id        integer,
+        visits_used     integer,
+        max_visits      integer
+    )
+    LANGUAGE plpgsql
+AS
+$$
+#variable_conflict use_variable
+DECLARE
+    v_tariff      text;
+    v_valid_until date;
+    v_is_valid    boolean;
+    v_time_type   text;
+    v_today       date    := p_local_time::date;
+    v_hour        integer := EXTRACT(HOUR FROM p_local_time);
+BEGIN
+    SELECT c.client_id, c.subscription
+    INTO client_id, subscription_id
+    FROM public.client c
+    WHERE c.member_card = p_card;
+
+    IF NOT FOUND THEN
+        status := 'unknown_card';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    -- Клиент в зале: фиксируем выход
+    UPDATE public.visit_fitness_room v
+    SET time_end = NOW(),
+        in_gym   = FALSE
+    WHERE v.visit_id = (SELECT o.visit_id
+                        FROM public.visit_fitness_room o
+                        WHERE o.client = client_id
+                          AND o.in_gym = TRUE
+                        ORDER BY o.time_start DESC
+                        LIMIT 1
+                        FOR UPDATE)
+    RETURNING v.visit_id INTO visit_id;
+
+    IF visit_id IS NOT NULL THEN
+        status := 'exited';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    IF subscription_id IS NULL THEN
+        status := 'no_subscription';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    -- Блокируем абонемент, чтобы одновременные отметки одной карты не превысили лимит
+    SELECT s.tariff, s.valid_until, s.is_valid, COALESCE(array_length(s.visit_ids, 1), 0)
+    INTO v_tariff, v_valid_until, v_is_valid, visits_used
+    FROM public.subscription s
+    WHERE s.subscription_id = subscription_id
+        FOR UPDATE;
+
+    IF NOT FOUND THEN
+        status := 'no_subscription';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    IF v_valid_until < v_today AND v_is_valid THEN
+        UPDATE public.subscription s SET is_valid = FALSE WHERE s.subscription_id = subscription_id;
+        status := 'expired';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    IF NOT v_is_valid THEN
+        status := 'invalid';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    -- Тариф вида <кол-во>_<время>_<период>, например 8_mrn_mnth или unlim_evn_yr
+    IF split_part(v_tariff, '_', 1) ~ '^\d+$' THEN
+        max_visits := split_part(v_tariff, '_', 1)::integer;
+    END IF;
+    v_time_type := split_part(v_tariff, '_', 2);
+
+    IF v_time_type = 'mrn' AND v_hour >= 16 THEN
+        status := 'morning_only';
+        RETURN NEXT;
+        RETURN;
+    ELSIF v_time_type = 'evn' AND v_hour < 16 THEN
+        status := 'evening_only';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    IF max_visits IS NOT NULL AND visits_used >= max_visits THEN
+        status := 'limit_reached';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    INSERT INTO public.visit_fitness_room (client, time_start, in_gym)
+    VALUES (client_id, NOW(), TRUE)
+    RETURNING public.visit_fitness_room.visit_id INTO visit_id;
+
+    visits_used := visits_used + 1;
+
+    -- Абонемент с исчерпанным лимитом деактивируется
+    UPDATE public.subscription s
+    SET visit_ids = array_append(s.visit_ids, visit_id),
+        is_valid  = (max_visits IS NULL OR visits_used < max_visits)
+    WHERE s.subscription_id = subscription_id;
+
+    status := 'entered';
+    RETURN NEXT;
+END;
+$$;
@@ -0,0 +1,180 @@
+-- Посещения ссылаются на абонемент внешним ключом, а абонемент хранит счётчик visits_used
+-- вместо массива visit_ids. Счётчик поддерживается триггером при добавлении, удалении
+-- и переносе посещений между абонементами.
+
+ALTER TABLE public.visit_fitness_room
+    ADD COLUMN IF NOT EXISTS subscription integer
+        REFERENCES public.subscription (subscription_id) ON DELETE SET NULL;
+
+ALTER TABLE public.subscription
+    ADD COLUMN IF NOT EXISTS visits_used integer NOT NULL DEFAULT 0;
+
+-- Перенос связей из массива visit_ids
+UPDATE public.visit_fitness_room v
+SET subscription = s.subscription_id
+FROM (SELECT subscription_id, unnest(visit_ids) AS visit_id
+      FROM public.subscription) s
+WHERE v.visit_id = s.visit_id
+  AND v.subscription IS NULL;
+
+CREATE INDEX IF NOT EXISTS visit_fitness_room_subscription_idx
+    ON public.visit_fitness_room (subscription);
+
+UPDATE public.subscription s
+SET visits_used = counts.visits
+FROM (SELECT subscription, COUNT(*) AS visits
+      FROM public.visit_fitness_room
+      WHERE subscription IS NOT NULL
+      GROUP BY subscription) counts
+WHERE s.subscription_id = counts.subscription;
+
+CREATE OR REPLACE FUNCTION public.subscription_visits_used_trg()
+    RETURNS trigger
+    LANGUAGE plpgsql
+AS
+$$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.subscription IS NOT NULL THEN
+        UPDATE public.subscription
+        SET visits_used = visits_used - 1
+        WHERE subscription_id = OLD.subscription;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'INSERT') AND NEW.subscription IS NOT NULL THEN
+        UPDATE public.subscription
+        SET visits_used = visits_used + 1
+        WHERE subscription_id = NEW.subscription;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS visit_fitness_room_visits_used ON public.visit_fitness_room;
+CREATE TRIGGER visit_fitness_room_visits_used
+    AFTER INSERT OR DELETE OR UPDATE OF subscription
+    ON public.visit_fitness_room
+    FOR EACH ROW
+EXECUTE FUNCTION public.subscription_visits_used_trg();
+
+ALTER TABLE public.subscription DROP COLUMN IF EXISTS visit_ids;
+
+-- Отметка карты: посещение записывается с ссылкой на абонемент, счётчик обновляет триггер
+CREATE OR REPLACE FUNCTION public.card_checkin(p_card text, p_local_time timestamp)
+    RETURNS TABLE (
+        status          text,
+        client_id       integer,
+        subscription_id integer,
+        visit_id        integer,
+        visits_used     integer,
+        max_visits      integer
+    )
+    LANGUAGE plpgsql
+AS
+$$
+#variable_conflict use_variable
+DECLARE
+    v_tariff      text;
+    v_valid_until date;
+    v_is_valid    boolean;
+    v_time_type   text;
+    v_today       date    := p_local_time::date;
+    v_hour        integer := EXTRACT(HOUR FROM p_local_time);
+BEGIN
+    SELECT c.client_id, c.subscription
+    INTO client_id, subscription_id
+    FROM public.client c
+    WHERE c.member_card = p_card;
+
+    IF NOT FOUND THEN
+        status := 'unknown_card';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    -- Клиент в зале: фиксируем выход
+    UPDATE public.visit_fitness_room v
+    SET time_end = NOW(),
+        in_gym   = FALSE
+    WHERE v.visit_id = (SELECT o.visit_id
+                        FROM public.visit_fitness_room o
+                        WHERE o.client = client_id
+                          AND o.in_gym = TRUE
+                        ORDER BY o.time_start DESC
+                        LIMIT 1
+                        FOR UPDATE)
+    RETURNING v.visit_id INTO visit_id;
+
+    IF visit_id IS NOT NULL THEN
+        status := 'exited';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    IF subscription_id IS NULL THEN
+        status := 'no_subscription';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    -- Блокируем абонемент, чтобы одновременные отметки одной карты не превысили лимит
+    SELECT s.tariff, s.valid_until, s.is_valid, s.visits_used
+    INTO v_tariff, v_valid_until, v_is_valid, visits_used
+    FROM public.subscription s
+    WHERE s.subscription_id = subscription_id
+        FOR UPDATE;
+
+    IF NOT FOUND THEN
+        status := 'no_subscription';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    IF v_valid_until < v_today AND v_is_valid THEN
+        UPDATE public.subscription s SET is_valid = FALSE WHERE s.subscription_id = subscription_id;
+        status := 'expired';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    IF NOT v_is_valid THEN
+        status := 'invalid';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    -- Тариф вида <кол-во>_<время>_<период>, например 8_mrn_mnth или unlim_evn_yr
+    IF split_part(v_tariff, '_', 1) ~ '^\d+$' THEN
+        max_visits := split_part(v_tariff, '_', 1)::integer;
+    END IF;
+    v_time_type := split_part(v_tariff, '_', 2);
+
+    IF v_time_type = 'mrn' AND v_hour >= 16 THEN
+        status := 'morning_only';
+        RETURN NEXT;
+        RETURN;
+    ELSIF v_time_type = 'evn' AND v_hour < 16 THEN
+        status := 'evening_only';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    IF max_visits IS NOT NULL AND visits_used >= max_visits THEN
+        status := 'limit_reached';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    INSERT INTO public.visit_fitness_room (client, time_start, in_gym, subscription)
+    VALUES (client_id, NOW(), TRUE, subscription_id)
+    RETURNING public.visit_fitness_room.visit_id INTO visit_id;
+
+    visits_used := visits_used + 1;
+
+    -- Абонемент с исчерпанным лимитом деактивируется
+    IF max_visits IS NOT NULL AND visits_used >= max_visits THEN
+        UPDATE public.subscription s SET is_valid = FALSE WHERE s.subscription_id = subscription_id;
+    END IF;
+
+    status := 'entered';
+    RETURN NEXT;
+END;
+$$;
@@ -0,0 +1,54 @@
+-- Уведомления об изменениях через LISTEN/NOTIFY, канал crm_changes.
+-- Полезная нагрузка — имя таблицы; для training_slots дополнительно тренер и дата слота
+-- в виде training_slots:<trainer>:<YYYY-MM-DD>, чтобы сбрасывать кэш расписания выборочно.
+-- Одинаковые уведомления в пределах одной транзакции PostgreSQL объединяет сам.
+
+CREATE OR REPLACE FUNCTION public.notify_table_change()
+    RETURNS trigger
+    LANGUAGE plpgsql
+AS
+$$
+BEGIN
+    PERFORM pg_notify('crm_changes', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.notify_training_slot_change()
+    RETURNS trigger
+    LANGUAGE plpgsql
+AS
+$$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM pg_notify('crm_changes',
+                          'training_slots:' || OLD.trainer || ':' || to_char(OLD.start_time, 'YYYY-MM-DD'));
+    END IF;
+    IF TG_OP IN ('UPDATE', 'INSERT') THEN
+        PERFORM pg_notify('crm_changes',
+                          'training_slots:' || NEW.trainer || ':' || to_char(NEW.start_time, 'YYYY-MM-DD'));
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS visit_fitness_room_notify ON public.visit_fitness_room;
+CREATE TRIGGER visit_fitness_room_notify
+    AFTER INSERT OR UPDATE OR DELETE
+    ON public.visit_fitness_room
+    FOR EACH STATEMENT
+EXECUTE FUNCTION public.notify_table_change();
+
+DROP TRIGGER IF EXISTS subscription_notify ON public.subscription;
+CREATE TRIGGER subscription_notify
+    AFTER INSERT OR UPDATE OR DELETE
+    ON public.subscription
+    FOR EACH STATEMENT
+EXECUTE FUNCTION public.notify_table_change();
+
+DROP TRIGGER IF EXISTS training_slots_notify ON public.training_slots;
+CREATE TRIGGER training_slots_notify
+    AFTER INSERT OR UPDATE OR DELETE
+    ON public.training_slots
+    FOR EACH ROW
+EXECUTE FUNCTION public.notify_training_slot_change();
@@ -0,0 +1,134 @@
+-- Почасовая сводка посещений для диаграмм посещаемости.
+-- bucket — начало часа, visits — количество посещений, начатых в этот час,
+-- visitors — количество различных клиентов, пришедших в этот час.
+-- Сводка обновляется триггером при добавлении, удалении и переносе посещений;
+-- refresh_visit_hourly_rollup пересчитывает её за период (например, ночным заданием).
+
+CREATE TABLE IF NOT EXISTS public.visit_hourly_rollup (
+    bucket   timestamp PRIMARY KEY,
+    visits   integer NOT NULL DEFAULT 0,
+    visitors integer NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION public.refresh_visit_hourly_rollup(p_from timestamp, p_to timestamp)
+    RETURNS void
+    LANGUAGE plpgsql
+AS
+$$
+DECLARE
+    v_from timestamp := date_trunc('hour', p_from);
+    -- Границы округляются до целых часов: час, в который попадает p_to, пересчитывается целиком
+    v_to   timestamp := CASE WHEN p_to = date_trunc('hour', p_to) THEN p_to
+                             ELSE date_trunc('hour', p_to) + interval '1 hour' END;
+BEGIN
+    DELETE FROM public.visit_hourly_rollup
+    WHERE bucket >= v_from
+      AND bucket < v_to;
+
+    INSERT INTO public.visit_hourly_rollup (bucket, visits, visitors)
+    SELECT date_trunc('hour', v.time_start), COUNT(*), COUNT(DISTINCT v.client)
+    FROM public.visit_fitness_room v
+    WHERE v.time_start >= v_from
+      AND v.time_start < v_to
+    GROUP BY 1;
+END;
+$$;
+
+SELECT public.refresh_visit_hourly_rollup('-infinity', 'infinity');
+
+-- Пересчёт часа выбирает его посещения по диапазону time_start
+CREATE INDEX IF NOT EXISTS visit_fitness_room_time_start_idx
+    ON public.visit_fitness_room (time_start);
+
+-- Триггер уровня оператора пересчитывает затронутые часы целиком по таблицам переходов:
+-- построчный триггер видит соседние строки того же оператора и ошибается в visitors
+-- при добавлении или удалении нескольких посещений одного клиента за час
+CREATE OR REPLACE FUNCTION public.visit_hourly_rollup_trg()
+    RETURNS trigger
+    LANGUAGE plpgsql
+AS
+$$
+DECLARE
+    v_buckets timestamp[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(DISTINCT date_trunc('hour', n.time_start) ORDER BY date_trunc('hour', n.time_start))
+        INTO v_buckets
+        FROM new_visits n
+        WHERE n.time_start IS NOT NULL;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(DISTINCT date_trunc('hour', o.time_start) ORDER BY date_trunc('hour', o.time_start))
+        INTO v_buckets
+        FROM old_visits o
+        WHERE o.time_start IS NOT NULL;
+    ELSE
+        -- Отметка выхода меняет только time_end и in_gym: такие строки сводку не затрагивают
+        SELECT array_agg(DISTINCT b.bucket ORDER BY b.bucket)
+        INTO v_buckets
+        FROM old_visits o
+                 JOIN new_visits n ON n.visit_id = o.visit_id
+                 CROSS JOIN LATERAL (VALUES (date_trunc('hour', o.time_start)),
+                                            (date_trunc('hour', n.time_start))) AS b(bucket)
+        WHERE (o.time_start, o.client) IS DISTINCT FROM (n.time_start, n.client)
+          AND b.bucket IS NOT NULL;
+    END IF;
+
+    IF v_buckets IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    -- Строки часов блокируются по порядку: параллельная транзакция, меняющая тот же час,
+    -- ждёт фиксации этой, и её пересчёт (новый снимок) уже видит эти посещения
+    INSERT INTO public.visit_hourly_rollup (bucket)
+    SELECT unnest(v_buckets)
+    ON CONFLICT (bucket) DO NOTHING;
+
+    PERFORM 1
+    FROM public.visit_hourly_rollup r
+    WHERE r.bucket = ANY (v_buckets)
+    ORDER BY r.bucket
+    FOR UPDATE;
+
+    UPDATE public.visit_hourly_rollup r
+    SET visits   = c.visits,
+        visitors = c.visitors
+    FROM (SELECT b.bucket, COUNT(v.visit_id) AS visits, COUNT(DISTINCT v.client) AS visitors
+          FROM unnest(v_buckets) AS b(bucket)
+                   LEFT JOIN public.visit_fitness_room v
+                             ON v.time_start >= b.bucket
+                                 AND v.time_start < b.bucket + interval '1 hour'
+          GROUP BY b.bucket) c
+    WHERE r.bucket = c.bucket;
+
+    -- Как и refresh_visit_hourly_rollup, сводка не хранит часы без посещений
+    DELETE FROM public.visit_hourly_rollup r
+    WHERE r.bucket = ANY (v_buckets)
+      AND r.visits = 0;
+
+    RETURN NULL;
+END;
+$$;
+
+-- Таблицы переходов нельзя объявить у триггера на несколько событий, поэтому триггеров три
+DROP TRIGGER IF EXISTS visit_fitness_room_hourly_rollup ON public.visit_fitness_room;
+DROP TRIGGER IF EXISTS visit_fitness_room_hourly_rollup_ins ON public.visit_fitness_room;
+DROP TRIGGER IF EXISTS visit_fitness_room_hourly_rollup_del ON public.visit_fitness_room;
+DROP TRIGGER IF EXISTS visit_fitness_room_hourly_rollup_upd ON public.visit_fitness_room;
+CREATE TRIGGER visit_fitness_room_hourly_rollup_ins
+    AFTER INSERT
+    ON public.visit_fitness_room
+    REFERENCING NEW TABLE AS new_visits
+    FOR EACH STATEMENT
+EXECUTE FUNCTION public.visit_hourly_rollup_trg();
+CREATE TRIGGER visit_fitness_room_hourly_rollup_del
+    AFTER DELETE
+    ON public.visit_fitness_room
+    REFERENCING OLD TABLE AS old_visits
+    FOR EACH STATEMENT
+EXECUTE FUNCTION public.visit_hourly_rollup_trg();
+CREATE TRIGGER visit_fitness_room_hourly_rollup_upd
+    AFTER UPDATE
+    ON public.visit_fitness_room
+    REFERENCING OLD TABLE AS old_visits NEW TABLE AS new_visits
+    FOR EACH STATEMENT
+EXECUTE FUNCTION public.visit_hourly_rollup_trg();
@@ -0,0 +1,21 @@
+-- Индексы для постраничного поиска клиентов (database.search_clients).
+-- Поиск по подстроке имени и телефона обслуживают триграммные индексы pg_trgm,
+-- порядок страниц (дата начала членства, client_id) — составной btree-индекс,
+-- ближайший слот и последнее посещение клиента — индексы по (client, время).
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS client_name_trgm_idx
+    ON public.client USING gin (lower(surname || ' ' || first_name) gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS client_phone_digits_trgm_idx
+    ON public.client USING gin (regexp_replace(phone_number, '\D', '', 'g') gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS client_keyset_idx
+    ON public.client ((COALESCE(membership_start_date, DATE '0001-01-01')) DESC, client_id DESC);
+
+CREATE INDEX IF NOT EXISTS training_slots_client_start_idx
+    ON public.training_slots (client, start_time);
+
+CREATE INDEX IF NOT EXISTS visit_fitness_room_client_start_idx
+    ON public.visit_fitness_room (client, time_start);
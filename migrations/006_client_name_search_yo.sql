@@ -0,0 +1,7 @@
+-- Поиск по имени не различает «е» и «ё»: индекс строится по имени, где «ё» заменена на «е»
+-- (та же нормализация, что в client_search_index.normalize).
+
+DROP INDEX IF EXISTS public.client_name_trgm_idx;
+
+CREATE INDEX IF NOT EXISTS client_name_trgm_idx
+    ON public.client USING gin (replace(lower(surname || ' ' || first_name), 'ё', 'е') gin_trgm_ops);
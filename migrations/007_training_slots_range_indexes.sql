@@ -0,0 +1,7 @@
+-- Индекс для выборок расписания тренера по полуоткрытому интервалу времени начала
+-- (database.SCHEDULE_SLOTS_QUERY, SCHEDULE_HASH_QUERY). Остальные столбцы слота включены в индекс,
+-- чтобы чтение training_slots обходилось без обращения к таблице.
+-- Слоты клиента за день (AddSlotWindow) обслуживает индекс (client, start_time) из 005.
+
+CREATE INDEX IF NOT EXISTS training_slots_trainer_start_idx
+    ON public.training_slots (trainer, start_time) INCLUDE (end_time, client, slot_id);
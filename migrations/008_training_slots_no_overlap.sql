@@ -0,0 +1,23 @@
+-- Слоты одного тренера не могут пересекаться по времени: ограничение-исключение
+-- по (trainer, tsrange(start_time, end_time)) проверяется самой базой, поэтому два рабочих места
+-- не запишут тренера на одно время. Интервал полуоткрытый: слот 10:00-11:00 не пересекается с 11:00-12:00.
+-- Равенство по trainer в GiST-индексе даёт расширение btree_gist.
+-- Индекс ограничения обслуживает и поиск пересечений (database.SLOT_CONFLICTS_QUERY).
+--
+-- Если в базе уже есть пересекающиеся слоты, миграция не применится; найти их можно запросом
+--   SELECT a.slot_id, b.slot_id FROM training_slots a JOIN training_slots b
+--       ON a.trainer = b.trainer AND a.slot_id < b.slot_id
+--      AND tsrange(a.start_time, a.end_time, '[)') && tsrange(b.start_time, b.end_time, '[)');
+
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+ALTER TABLE public.training_slots
+    DROP CONSTRAINT IF EXISTS training_slots_time_order;
+ALTER TABLE public.training_slots
+    ADD CONSTRAINT training_slots_time_order CHECK (start_time < end_time);
+
+ALTER TABLE public.training_slots
+    DROP CONSTRAINT IF EXISTS training_slots_no_overlap;
+ALTER TABLE public.training_slots
+    ADD CONSTRAINT training_slots_no_overlap
+        EXCLUDE USING gist (trainer WITH =, tsrange(start_time, end_time, '[)') WITH &&);
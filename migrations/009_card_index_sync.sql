@@ -0,0 +1,189 @@
+-- Индекс карт в памяти рабочего места (card_index.py) загружается целиком при запуске,
+-- а затем дочитывает только изменения: строки клиентов, абонементов и посещений получают
+-- столбец updated_at, который триггер обновляет при каждом изменении строки.
+-- Изменения клиентов (например, привязка карты) тоже рассылаются уведомлением crm_changes.
+-- card_checkin дополнительно отказывает во входе по замороженному абонементу — так же,
+-- как решает индекс карт на рабочем месте (код результата frozen).
+
+ALTER TABLE public.client
+    ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT NOW();
+ALTER TABLE public.subscription
+    ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT NOW();
+ALTER TABLE public.visit_fitness_room
+    ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT NOW();
+
+CREATE INDEX IF NOT EXISTS client_updated_at_idx ON public.client (updated_at);
+CREATE INDEX IF NOT EXISTS subscription_updated_at_idx ON public.subscription (updated_at);
+CREATE INDEX IF NOT EXISTS visit_fitness_room_updated_at_idx ON public.visit_fitness_room (updated_at);
+-- Клиенты изменённых абонементов при дочитывании изменений
+CREATE INDEX IF NOT EXISTS client_subscription_idx ON public.client (subscription);
+
+CREATE OR REPLACE FUNCTION public.touch_updated_at()
+    RETURNS trigger
+    LANGUAGE plpgsql
+AS
+$$
+BEGIN
+    NEW.updated_at := NOW();
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS client_touch_updated_at ON public.client;
+CREATE TRIGGER client_touch_updated_at
+    BEFORE UPDATE
+    ON public.client
+    FOR EACH ROW
+EXECUTE FUNCTION public.touch_updated_at();
+
+DROP TRIGGER IF EXISTS subscription_touch_updated_at ON public.subscription;
+CREATE TRIGGER subscription_touch_updated_at
+    BEFORE UPDATE
+    ON public.subscription
+    FOR EACH ROW
+EXECUTE FUNCTION public.touch_updated_at();
+
+DROP TRIGGER IF EXISTS visit_fitness_room_touch_updated_at ON public.visit_fitness_room;
+CREATE TRIGGER visit_fitness_room_touch_updated_at
+    BEFORE UPDATE
+    ON public.visit_fitness_room
+    FOR EACH ROW
+EXECUTE FUNCTION public.touch_updated_at();
+
+DROP TRIGGER IF EXISTS client_notify ON public.client;
+CREATE TRIGGER client_notify
+    AFTER INSERT OR UPDATE OR DELETE
+    ON public.client
+    FOR EACH STATEMENT
+EXECUTE FUNCTION public.notify_table_change();
+
+-- Отметка карты: как в 002, плюс отказ по замороженному абонементу
+DROP FUNCTION IF EXISTS public.card_checkin(text);
+CREATE OR REPLACE FUNCTION public.card_checkin(p_card text, p_local_time timestamp)
+    RETURNS TABLE (
+        status          text,
+        client_id       integer,
+        subscription_id integer,
+        visit_id        integer,
+        visits_used     integer,
+        max_visits      integer
+    )
+    LANGUAGE plpgsql
+AS
+$$
+#variable_conflict use_variable
+DECLARE
+    v_tariff      text;
+    v_valid_until date;
+    v_is_valid    boolean;
+    v_frozen_from  date;
+    v_frozen_until date;
+    v_time_type   text;
+    v_today       date    := p_local_time::date;
+    v_hour        integer := EXTRACT(HOUR FROM p_local_time);
+BEGIN
+    SELECT c.client_id, c.subscription
+    INTO client_id, subscription_id
+    FROM public.client c
+    WHERE c.member_card = p_card;
+
+    IF NOT FOUND THEN
+        status := 'unknown_card';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    -- Клиент в зале: фиксируем выход
+    UPDATE public.visit_fitness_room v
+    SET time_end = NOW(),
+        in_gym   = FALSE
+    WHERE v.visit_id = (SELECT o.visit_id
+                        FROM public.visit_fitness_room o
+                        WHERE o.client = client_id
+                          AND o.in_gym = TRUE
+                        ORDER BY o.time_start DESC
+                        LIMIT 1
+                        FOR UPDATE)
+    RETURNING v.visit_id INTO visit_id;
+
+    IF visit_id IS NOT NULL THEN
+        status := 'exited';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    IF subscription_id IS NULL THEN
+        status := 'no_subscription';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    -- Блокируем абонемент, чтобы одновременные отметки одной карты не превысили лимит
+    SELECT s.tariff, s.valid_until, s.is_valid, s.visits_used, s.frozen_from, s.frozen_until
+    INTO v_tariff, v_valid_until, v_is_valid, visits_used, v_frozen_from, v_frozen_until
+    FROM public.subscription s
+    WHERE s.subscription_id = subscription_id
+        FOR UPDATE;
+
+    IF NOT FOUND THEN
+        status := 'no_subscription';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    IF v_valid_until < v_today AND v_is_valid THEN
+        UPDATE public.subscription s SET is_valid = FALSE WHERE s.subscription_id = subscription_id;
+        status := 'expired';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    IF NOT v_is_valid THEN
+        status := 'invalid';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    IF v_today BETWEEN v_frozen_from AND v_frozen_until THEN
+        status := 'frozen';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    -- Тариф вида <кол-во>_<время>_<период>, например 8_mrn_mnth или unlim_evn_yr
+    IF split_part(v_tariff, '_', 1) ~ '^\d+$' THEN
+        max_visits := split_part(v_tariff, '_', 1)::integer;
+    END IF;
+    v_time_type := split_part(v_tariff, '_', 2);
+
+    IF v_time_type = 'mrn' AND v_hour >= 16 THEN
+        status := 'morning_only';
+        RETURN NEXT;
+        RETURN;
+    ELSIF v_time_type = 'evn' AND v_hour < 16 THEN
+        status := 'evening_only';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    IF max_visits IS NOT NULL AND visits_used >= max_visits THEN
+        status := 'limit_reached';
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    INSERT INTO public.visit_fitness_room (client, time_start, in_gym, subscription)
+    VALUES (client_id, NOW(), TRUE, subscription_id)
+    RETURNING public.visit_fitness_room.visit_id INTO visit_id;
+
+    visits_used := visits_used + 1;
+
+    -- Абонемент с исчерпанным лимитом деактивируется
+    IF max_visits IS NOT NULL AND visits_used >= max_visits THEN
+        UPDATE public.subscription s SET is_valid = FALSE WHERE s.subscription_id = subscription_id;
+    END IF;
+
+    status := 'entered';
+    RETURN NEXT;
+END;
+$$;
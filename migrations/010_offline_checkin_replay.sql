@@ -0,0 +1,179 @@
+-- Отметки карт, сделанные рабочим местом без связи с базой, хранятся в локальном журнале
+-- (checkin_journal.py) и передаются на сервер после восстановления связи функцией
+-- replay_offline_checkin. Каждая отметка имеет UUID; результат применения сохраняется
+-- в offline_checkin, поэтому повторная передача той же отметки ничего не меняет
+-- и возвращает прежний результат.
+-- Той же функцией с p_live = TRUE рабочее место передаёт пачки текущих отметок (database.apply_taps):
+-- вход проверяется по абонементу так же, как в card_checkin, а время посещения берётся с часов сервера.
+
+CREATE TABLE IF NOT EXISTS public.offline_checkin
+(
+    tap_id      uuid PRIMARY KEY,
+    card        text        NOT NULL,
+    action      text        NOT NULL CHECK (action IN ('enter', 'exit')),
+    tapped_at   timestamp   NOT NULL,
+    status      text        NOT NULL,
+    visit_id    integer REFERENCES public.visit_fitness_room (visit_id) ON DELETE SET NULL,
+    replayed_at timestamptz NOT NULL DEFAULT NOW()
+);
+
+-- Причина отказа во входе по абонементу в порядке проверок card_checkin или NULL, если вход разрешён.
+-- p_local_time — местное время рабочего места. Просроченный абонемент деактивируется, как в card_checkin.
+CREATE OR REPLACE FUNCTION public.subscription_entry_denial(p_subscription integer, p_local_time timestamp)
+    RETURNS text
+    LANGUAGE plpgsql
+AS
+$$
+DECLARE
+    v_tariff       text;
+    v_valid_until  date;
+    v_is_valid     boolean;
+    v_visits_used  integer;
+    v_frozen_from  date;
+    v_frozen_until date;
+    v_time_type    text;
+    v_today        date    := p_local_time::date;
+    v_hour         integer := EXTRACT(HOUR FROM p_local_time);
+BEGIN
+    IF p_subscription IS NULL THEN
+        RETURN 'no_subscription';
+    END IF;
+
+    SELECT s.tariff, s.valid_until, s.is_valid, s.visits_used, s.frozen_from, s.frozen_until
+    INTO v_tariff, v_valid_until, v_is_valid, v_visits_used, v_frozen_from, v_frozen_until
+    FROM public.subscription s
+    WHERE s.subscription_id = p_subscription
+        FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RETURN 'no_subscription';
+    END IF;
+
+    IF v_valid_until < v_today AND v_is_valid THEN
+        UPDATE public.subscription s SET is_valid = FALSE WHERE s.subscription_id = p_subscription;
+        RETURN 'expired';
+    END IF;
+
+    IF NOT v_is_valid THEN
+        RETURN 'invalid';
+    END IF;
+
+    IF v_today BETWEEN v_frozen_from AND v_frozen_until THEN
+        RETURN 'frozen';
+    END IF;
+
+    v_time_type := split_part(v_tariff, '_', 2);
+    IF v_time_type = 'mrn' AND v_hour >= 16 THEN
+        RETURN 'morning_only';
+    ELSIF v_time_type = 'evn' AND v_hour < 16 THEN
+        RETURN 'evening_only';
+    END IF;
+
+    IF split_part(v_tariff, '_', 1) ~ '^\d+$' AND v_visits_used >= split_part(v_tariff, '_', 1)::integer THEN
+        RETURN 'limit_reached';
+    END IF;
+
+    RETURN NULL;
+END;
+$$;
+
+-- Результаты: entered, exited — отметка применена;
+-- over_limit — посещение записано, но лимит абонемента уже был исчерпан (только для журнала);
+-- already_in_gym, not_in_gym, unknown_card — отметка не применена (конфликт с данными сервера);
+-- коды отказа subscription_entry_denial — вход текущей отметки (p_live) не разрешён абонементом.
+-- Отметки из журнала (p_live = FALSE) записываются временем касания: клиент уже прошёл в зал.
+CREATE OR REPLACE FUNCTION public.replay_offline_checkin(p_tap_id uuid, p_card text, p_action text,
+                                                         p_tapped_at timestamp, p_live boolean)
+    RETURNS TABLE (
+        status   text,
+        visit_id integer
+    )
+    LANGUAGE plpgsql
+AS
+$$
+#variable_conflict use_variable
+DECLARE
+    v_client       integer;
+    v_subscription integer;
+    v_open_start   timestamp;
+    v_tariff       text;
+    v_visits_used  integer;
+    v_max_visits   integer;
+BEGIN
+    -- Блокировка клиента упорядочивает одновременную передачу отметок одной карты
+    SELECT c.client_id, c.subscription
+    INTO v_client, v_subscription
+    FROM public.client c
+    WHERE c.member_card = p_card
+        FOR UPDATE;
+
+    SELECT o.status, o.visit_id
+    INTO status, visit_id
+    FROM public.offline_checkin o
+    WHERE o.tap_id = p_tap_id;
+
+    IF FOUND THEN
+        RETURN NEXT;
+        RETURN;
+    END IF;
+
+    IF v_client IS NULL THEN
+        status := 'unknown_card';
+    ELSE
+        SELECT v.visit_id, v.time_start
+        INTO visit_id, v_open_start
+        FROM public.visit_fitness_room v
+        WHERE v.client = v_client
+          AND v.in_gym = TRUE
+        ORDER BY v.time_start DESC
+        LIMIT 1
+            FOR UPDATE;
+
+        IF p_action = 'enter' THEN
+            -- Текущая отметка проверяется по абонементу; код отказа возвращается вместо входа
+            IF visit_id IS NULL AND p_live THEN
+                status := public.subscription_entry_denial(v_subscription, p_tapped_at);
+            END IF;
+
+            IF visit_id IS NOT NULL THEN
+                status := 'already_in_gym';
+            ELSIF status IS NULL THEN
+                INSERT INTO public.visit_fitness_room (client, time_start, in_gym, subscription)
+                VALUES (v_client, CASE WHEN p_live THEN NOW() ELSE p_tapped_at END, TRUE, v_subscription)
+                RETURNING public.visit_fitness_room.visit_id INTO visit_id;
+                status := 'entered';
+
+                -- Счётчик visits_used увеличил триггер; лимит проверяется по уже записанному посещению
+                SELECT s.tariff, s.visits_used
+                INTO v_tariff, v_visits_used
+                FROM public.subscription s
+                WHERE s.subscription_id = v_subscription;
+
+                IF split_part(v_tariff, '_', 1) ~ '^\d+$' THEN
+                    v_max_visits := split_part(v_tariff, '_', 1)::integer;
+                    IF v_visits_used > v_max_visits THEN
+                        status := 'over_limit';
+                    END IF;
+                    IF v_visits_used >= v_max_visits THEN
+                        UPDATE public.subscription s SET is_valid = FALSE WHERE s.subscription_id = v_subscription;
+                    END IF;
+                END IF;
+            END IF;
+        ELSIF visit_id IS NULL OR (NOT p_live AND v_open_start > p_tapped_at) THEN
+            visit_id := NULL;
+            status := 'not_in_gym';
+        ELSE
+            UPDATE public.visit_fitness_room v
+            SET time_end = CASE WHEN p_live THEN NOW() ELSE p_tapped_at END,
+                in_gym   = FALSE
+            WHERE v.visit_id = visit_id;
+            status := 'exited';
+        END IF;
+    END IF;
+
+    INSERT INTO public.offline_checkin (tap_id, card, action, tapped_at, status, visit_id)
+    VALUES (p_tap_id, p_card, p_action, p_tapped_at, status, visit_id);
+
+    RETURN NEXT;
+END;
+$$;
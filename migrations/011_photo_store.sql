@@ -0,0 +1,48 @@
+-- Фотографии тренеров и администраторов адресуются по содержимому: photo_hash — MD5 фотографии,
+-- его поддерживает триггер при любой записи photo. Списки выбирают только photo_hash,
+-- а уменьшенные копии берутся из таблицы photo_thumbnail по (photo_hash, size) и кэшируются
+-- на рабочем месте в файлах (photo_store.py). Полная фотография загружается только окном редактирования.
+-- Уменьшенные копии создаёт приложение: при сохранении фотографии или, для фотографий,
+-- записанных раньше, при первой загрузке списка.
+
+ALTER TABLE public.trainer
+    ADD COLUMN IF NOT EXISTS photo_hash text;
+ALTER TABLE public.administrators
+    ADD COLUMN IF NOT EXISTS photo_hash text;
+
+UPDATE public.trainer SET photo_hash = md5(photo) WHERE photo IS NOT NULL;
+UPDATE public.administrators SET photo_hash = md5(photo) WHERE photo IS NOT NULL;
+
+CREATE OR REPLACE FUNCTION public.photo_hash_trg()
+    RETURNS trigger
+    LANGUAGE plpgsql
+AS
+$$
+BEGIN
+    NEW.photo_hash := md5(NEW.photo);
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trainer_photo_hash ON public.trainer;
+CREATE TRIGGER trainer_photo_hash
+    BEFORE INSERT OR UPDATE OF photo
+    ON public.trainer
+    FOR EACH ROW
+EXECUTE FUNCTION public.photo_hash_trg();
+
+DROP TRIGGER IF EXISTS administrators_photo_hash ON public.administrators;
+CREATE TRIGGER administrators_photo_hash
+    BEFORE INSERT OR UPDATE OF photo
+    ON public.administrators
+    FOR EACH ROW
+EXECUTE FUNCTION public.photo_hash_trg();
+
+-- Уменьшенная копия фотографии: size — наибольшая сторона в пикселях, image — PNG
+CREATE TABLE IF NOT EXISTS public.photo_thumbnail
+(
+    photo_hash text    NOT NULL,
+    size       integer NOT NULL,
+    image      bytea   NOT NULL,
+    PRIMARY KEY (photo_hash, size)
+);
@@ -0,0 +1,157 @@
+"""
+Хранилище фотографий тренеров и администраторов.
+
+Фотография адресуется по содержимому — MD5, который сервер хранит в столбце photo_hash
+(migrations/011_photo_store.sql). Списки получают только хэши, а уменьшенные копии берутся
+из файлового кэша рабочего места; копии, которых нет в кэше, загружаются из таблицы photo_thumbnail
+одним запросом. Копия с данным хэшем никогда не меняется, поэтому кэш не нужно сбрасывать.
+Полная фотография загружается только окном редактирования.
+
+Для фотографий, сохранённых раньше или в обход окон редактирования, копии создаются
+при первой загрузке и сохраняются на сервере для остальных рабочих мест.
+
+Настройки (секция [photos] config.ini):
+    cache_dir — папка кэша уменьшенных копий, по умолчанию photo_cache рядом с приложением
+"""
+import hashlib
+import logging
+import os
+from pathlib import Path
+
+from PyQt5.QtCore import QBuffer, QByteArray, QIODevice, Qt
+from PyQt5.QtGui import QImage
+
+from config import get_setting
+from constants import DIR_APPLICATION
+from database import get_photo_thumbnails, save_photo_thumbnails, get_photos_by_hash
+
+logger = logging.getLogger(__name__)
+
+# Аватарки в списках и на панели дежурных тренеров (до 100 px)
+AVATAR_SIZE = 128
+# Фото администратора на главной странице (320x400)
+PORTRAIT_SIZE = 400
+THUMBNAIL_SIZES = (AVATAR_SIZE, PORTRAIT_SIZE)
+
+
+def photo_bytes(data):
+    if isinstance(data, QByteArray):
+        return data.data()
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    return data
+
+
+def hash_photo(data):
+    """Хэш фотографии, совпадающий с серверным md5(photo)."""
+    return hashlib.md5(photo_bytes(data)).hexdigest()
+
+
+def make_thumbnail(data, size):
+    """
+    Уменьшает фотографию так, чтобы большая сторона не превышала size. QImage, в отличие от QPixmap,
+    можно использовать в фоновых потоках.
+    :return: PNG или None, если фотографию не удалось прочитать
+    """
+    image = QImage.fromData(photo_bytes(data))
+    if image.isNull():
+        return None
+    if image.width() > size or image.height() > size:
+        image = image.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    buffer = QBuffer()
+    buffer.open(QIODevice.WriteOnly)
+    image.save(buffer, "PNG")
+    return buffer.data().data()
+
+
+class PhotoDiskCache:
+    """Файловый кэш уменьшенных копий: <photo_hash>_<size>.png."""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def path(self, photo_hash, size):
+        return self.directory / f"{photo_hash}_{size}.png"
+
+    def get(self, photo_hash, size):
+        try:
+            return self.path(photo_hash, size).read_bytes()
+        except OSError:
+            return None
+
+    def put(self, photo_hash, size, data):
+        path = self.path(photo_hash, size)
+        # Запись через временный файл: оборванная запись не оставит в кэше испорченную копию
+        temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            temp_path.write_bytes(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить фото {photo_hash} в кэш: {e}")
+
+
+disk_cache = PhotoDiskCache(get_setting("photos", "cache_dir", DIR_APPLICATION / "photo_cache"))
+
+
+def _store_thumbnails(photo_hash, data):
+    thumbnails = {size: make_thumbnail(data, size) for size in THUMBNAIL_SIZES}
+    thumbnails = {size: image for size, image in thumbnails.items() if image}
+    save_photo_thumbnails([(photo_hash, size, image) for size, image in thumbnails.items()])
+    for size, image in thumbnails.items():
+        disk_cache.put(photo_hash, size, image)
+    return thumbnails
+
+
+def load_thumbnails(photo_hashes, size):
+    """
+    Уменьшенные копии фотографий: из файлового кэша, затем с сервера, затем создаются из полных фотографий.
+    Выполняет запросы к базе, поэтому вызывается в фоновом потоке.
+    :return: словарь {photo_hash: PNG}; фотографии, которые не удалось загрузить, пропускаются
+    """
+    thumbnails = {}
+    missing = []
+    for photo_hash in {h for h in photo_hashes if h}:
+        image = disk_cache.get(photo_hash, size)
+        if image:
+            thumbnails[photo_hash] = image
+        else:
+            missing.append(photo_hash)
+    if not missing:
+        return thumbnails
+
+    fetched = get_photo_thumbnails(missing, size) or {}
+    for photo_hash, image in fetched.items():
+        disk_cache.put(photo_hash, size, image)
+        thumbnails[photo_hash] = image
+    missing = [h for h in missing if h not in fetched]
+    if not missing:
+        return thumbnails
+
+    logger.info(f"Создание уменьшенных копий для {len(missing)} фотографий")
+    for photo_hash, data in (get_photos_by_hash(missing) or {}).items():
+        image = _store_thumbnails(photo_hash, data).get(size)
+        if image:
+            thumbnails[photo_hash] = image
+    return thumbnails
+
+
+def load_thumbnail(photo_hash, size):
+    """Уменьшенная копия одной фотографии или None."""
+    if not photo_hash:
+        return None
+    return load_thumbnails([photo_hash], size).get(photo_hash)
+
+
+def store_photo(data):
+    """
+    Создаёт уменьшенные копии сохранённой фотографии и кладёт их на сервер и в файловый кэш.
+    Вызывается окнами редактирования после записи фотографии.
+    :return: хэш фотографии или None, если фотографии нет
+    """
+    data = photo_bytes(data)
+    if not data:
+        return None
+    photo_hash = hash_photo(data)
+    _store_thumbnails(photo_hash, data)
+    return photo_hash
@@ -0,0 +1,86 @@
+"""
+Кэш расписания тренеров.
+
+Запись хранит расписание тренера за период — месяц вместе с захваченными соседними
+неделями, — сгруппированное по дням, и его версию: MD5 слотов периода, посчитанный
+сервером. Неделя показывается из периода в памяти без обращения к базе; при повторном
+открытии месяца у сервера проверяется только версия. Изменение слота (своё или
+пришедшее уведомлением от другого рабочего места) сбрасывает версию у всех периодов
+тренера, в которые попадает день слота.
+"""
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Сколько периодов держать в памяти; при переполнении вытесняется давно не открывавшийся
+SCHEDULE_CACHE_SIZE = 12
+
+
+class ScheduleEntry:
+    def __init__(self, data, version):
+        self.data = data  # {date: [слот, ...]}
+        self.version = version  # None — версия неизвестна, период нужно загрузить заново
+
+
+class ScheduleCache:
+    """LRU-кэш периодов: (trainer_id, start_date, end_date) -> ScheduleEntry."""
+
+    def __init__(self, max_entries=SCHEDULE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, trainer_id, start_date, end_date):
+        key = (trainer_id, start_date, end_date)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, trainer_id, start_date, end_date, data, version):
+        key = (trainer_id, start_date, end_date)
+        self.entries[key] = ScheduleEntry(data, version)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            evicted, _ = self.entries.popitem(last=False)
+            logger.debug(f"Период {evicted} вытеснен из кэша расписания")
+
+    def entries_with_day(self, trainer_id, day):
+        """Записи периодов тренера, в которые попадает день."""
+        return [entry for (trainer, start_date, end_date), entry in self.entries.items()
+                if trainer == trainer_id and start_date <= day <= end_date]
+
+    def invalidate(self, trainer_id, day):
+        """Сбрасывает версию периодов с этим днём: при следующем открытии они загрузятся заново."""
+        for entry in self.entries_with_day(trainer_id, day):
+            entry.version = None
+
+    def add_slot(self, trainer_id, day, slot):
+        """
+        Добавляет слот в кэшированные периоды и сбрасывает их версию.
+        :return: Слоты дня после добавления или None, если день не в кэше.
+        """
+        slots = None
+        for entry in self.entries_with_day(trainer_id, day):
+            day_slots = entry.data.setdefault(day, [])
+            if all(s.get("slot_id") != slot.get("slot_id") for s in day_slots):
+                day_slots.append(slot)
+            entry.version = None
+            slots = day_slots
+        return slots
+
+    def remove_slot(self, trainer_id, day, slot_id):
+        """Убирает слот из кэшированных периодов и сбрасывает их версию."""
+        for entry in self.entries_with_day(trainer_id, day):
+            day_slots = [s for s in entry.data.get(day, []) if s.get("slot_id") != slot_id]
+            if day_slots:
+                entry.data[day] = day_slots
+            else:
+                entry.data.pop(day, None)
+            entry.version = None
+
+    def clear(self):
+        self.entries.clear()
@@ -974,7 +974,6 @@ class SubscriptionWidget(QWidget):
                 "start_date": start_date,
                 "end_date": end_date,
                 "price": current_active_widget.price_label.text(),
-                "visit_ids": [],
                 "is_valid": is_valid
             }
 
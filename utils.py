@@ -6,6 +6,7 @@ import random
 import sys
 import hashlib
 import traceback
+from functools import partial
 
 import bcrypt
 from barcode import Code128
@@ -17,16 +18,14 @@ from barcode.writer import ImageWriter
 import psycopg2
 from io import BytesIO
 import psycopg2
-import serial
 import time
-import serial.tools.list_ports
 import psycopg2  # Для подключения к базе данных PostgreSQL
 from PyQt5 import QtWidgets, QtGui, QtCore
 from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QFrame, QPushButton, \
     QGraphicsDropShadowEffect, QSpacerItem, QTableWidgetItem, QLineEdit, QTableWidget, QHeaderView, QListWidget, \
     QSizePolicy, QMenu, QAction, QWidgetAction, QMessageBox, QDialog
 from PyQt5.QtChart import QChartView, QBarSeries, QBarSet, QChart, QBarCategoryAxis, QValueAxis
-from PyQt5.QtCore import Qt, QMargins, QDir, pyqtSignal, QThread, QSettings, QRectF, QPointF, QPoint
+from PyQt5.QtCore import Qt, QMargins, QDir, pyqtSignal, QThread, QObject, QSettings, QRectF, QPointF, QPoint
 from PyQt5.QtGui import QColor, QPainter, QFont, QBrush, QIcon, QFontDatabase, QPixmap, QPainterPath, QRegion, QCursor, \
     QPen
 from PyQt5.QtCore import QTimer
@@ -36,9 +35,14 @@ from email.mime.text import MIMEText
 import datetime
 
 from client_profile import ClientProfileWindow
-from database import connect_to_db, get_all_admins, check_today_visits, register_visit, deactivate_subscription, \
-    get_subscription_info, get_client_id_by_card
+from card_index import card_index, SERVER_STATUSES
+from checkin_journal import checkin_journal, new_tap, tap_conflicts
+from card_reader import get_card_reader
+from config import get_setting
+from database import execute_query, get_all_admins, card_checkin, CancelToken, cancellable, pool_manager, \
+    apply_taps
 from hover_button import HoverButton
+from photo_store import load_thumbnails, AVATAR_SIZE
 
 logger = logging.getLogger(__name__)
 
@@ -200,6 +204,9 @@ class LoadAdminsThread(QThread):
     def run(self):
         try:
             admins = get_all_admins()
+            thumbnails = load_thumbnails([admin["photo_hash"] for admin in admins], AVATAR_SIZE)
+            for admin in admins:
+                admin["photo"] = thumbnails.get(admin["photo_hash"])
             self.result_signal.emit(admins)
         except Exception as e:
             self.error_signal.emit(str(e))
@@ -261,19 +268,269 @@ class WorkerThread(QThread):
         self.args = args
         self.kwargs = kwargs
         self._stop_requested = False  # Флаг для остановки потока
+        self.cancel_token = CancelToken()  # Отмена запросов к базе, выполняемых потоком
 
     def run(self):
         try:
             if not self._stop_requested:  # Проверяем, остановлен ли поток
-                result = self.func(*self.args, **self.kwargs)
-                self.result_signal.emit(result)  # Отправляем результат
+                with cancellable(self.cancel_token):
+                    result = self.func(*self.args, **self.kwargs)
+                if not self._stop_requested:
+                    self.result_signal.emit(result)  # Отправляем результат
         except Exception as e:
             self.error_signal.emit(str(e))  # Отправляем сообщение об ошибке
         finally:
             self.finished_signal.emit()  # Сигнал о завершении потока
 
     def stop(self):
+        """Останавливает поток без terminate(): текущий запрос к базе отменяется, соединение возвращается в пул."""
         self._stop_requested = True
+        self.cancel_token.cancel()
+
+
+class RequestScheduler(QObject):
+    """
+    Планировщик фоновых запросов «побеждает последний»: новый запрос отменяет предыдущий,
+    а результаты устаревших запросов отбрасываются по номеру поколения.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.generation = 0
+        self.current_key = None  # ключ запроса, результат которого ещё ожидается
+        self.workers = []  # запущенные потоки, включая отменённые, до их завершения
+
+    def submit(self, key, func, *args, on_result=None, on_error=None, **kwargs):
+        """Запускает func(*args, **kwargs) в WorkerThread, отменяя предыдущий запрос."""
+        self.cancel()
+        generation = self.generation
+        self.current_key = key
+        # Завершившиеся потоки удаляются здесь, а не по сигналу finished, чтобы объект QThread
+        # не уничтожался, пока поток ещё выходит из run()
+        self.workers = [w for w in self.workers if not w.isFinished()]
+
+        worker = WorkerThread(func, *args, **kwargs)
+        worker.result_signal.connect(lambda result: self._deliver(generation, on_result, result))
+        worker.error_signal.connect(lambda message: self._deliver(generation, on_error, message))
+        self.workers.append(worker)
+        worker.start()
+        return generation
+
+    def cancel(self):
+        """Отменяет ожидаемый запрос: его результат будет отброшен."""
+        self.generation += 1
+        self.current_key = None
+        for worker in self.workers:
+            worker.stop()
+
+    def shutdown(self, msecs=2000):
+        """Отменяет запросы и дожидается завершения потоков, например при закрытии окна."""
+        self.cancel()
+        for worker in list(self.workers):
+            worker.wait(msecs)
+
+    def _deliver(self, generation, callback, value):
+        if generation != self.generation:
+            logger.debug(f"Результат устаревшего запроса (поколение {generation}) отброшен")
+            return
+        self.current_key = None
+        if callback is not None:
+            callback(value)
+
+
+# Сообщения для отказов серверной функции card_checkin
+CHECKIN_ERRORS = {
+    "unknown_card": "Эта карта не привязана ни к одному клиенту.",
+    "no_subscription": "У клиента нет активного абонемента.",
+    "expired": "Абонемент просрочен и был деактивирован.",
+    "invalid": "Абонемент недействителен.",
+    "frozen": "Абонемент клиента заморожен.",
+    "morning_only": "Абонемент клиента действует только до 16:00.",
+    "evening_only": "Абонемент клиента действует только после 16:00.",
+    "limit_reached": "Клиент уже исчерпал лимит посещений.",
+}
+
+# Через сколько повторить передачу пачки, которую не удалось ни передать, ни записать в журнал (мс)
+TAP_FLUSH_RETRY_MS = 5000
+
+
+class TapPipeline(QObject):
+    """
+    Конвейер касаний карт. Повторное касание той же карты в пределах dedupe_window_ms отбрасывается.
+    Решение принимается по индексу карт и сразу подтверждается сигналом acknowledged, а входы и выходы
+    копятся и раз в flush_interval_ms передаются на сервер одним запросом (database.apply_taps).
+    Пачка, которую не удалось передать, записывается в локальный журнал отметок и уйдёт вместе с ним.
+    Пока индекс карт не загружен, а также неизвестные карты и истёкшие абонементы проверяются
+    на сервере функцией card_checkin.
+    """
+    # номер карты, пропущен ли клиент, сообщение для администратора
+    acknowledged = pyqtSignal(str, bool, str)
+    # пачка передана на сервер; список конфликтов [(отметка, status)]
+    flushed = pyqtSignal(list)
+    # пачку не удалось ни передать, ни записать в журнал; текст ошибки
+    flush_failed = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.dedupe_window = get_setting("taps", "dedupe_window_ms", 3000, int) / 1000
+        self.pending = []  # отметки, ожидающие передачи
+        self.last_taps = {}  # номер карты -> время касания (time.monotonic)
+        self.paused = 0  # касания не обрабатываются, пока открыто окно привязки карты
+        self.flush_thread = None
+        self.flush_taps = []  # пачка, которая передаётся сейчас
+        self.flush_failing = False  # о сбое передачи уже сообщено, ждём успешной передачи
+        self.workers = []  # проверки карт на сервере
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_interval = get_setting("taps", "flush_interval_ms", 200, int)
+        self.flush_timer.setInterval(self.flush_interval)
+        self.flush_timer.timeout.connect(self.flush)
+
+    def pause(self):
+        self.paused += 1
+
+    def resume(self):
+        self.paused = max(0, self.paused - 1)
+
+    def is_duplicate(self, card_number):
+        """Касание той же карты в пределах окна от первого касания — дребезг или повторное прикладывание."""
+        now = time.monotonic()
+        self.last_taps = {card: tapped for card, tapped in self.last_taps.items()
+                          if now - tapped < self.dedupe_window}
+        if card_number in self.last_taps:
+            return True
+        self.last_taps[card_number] = now
+        return False
+
+    def submit(self, card_number):
+        if self.paused or not card_number:
+            return
+        if self.is_duplicate(card_number):
+            logger.info(f"Повторное касание карты {card_number} отброшено")
+            return
+
+        decision, record = card_index.decide(card_number) if card_index.loaded else (None, None)
+        if decision in ("enter", "exit"):
+            card_index.apply_local(card_number, decision)
+            self.pending.append(new_tap(card_number, decision, record["client_id"]))
+            if not self.flush_timer.isActive():
+                self.flush_timer.start()
+            message = f"{'Вход' if decision == 'enter' else 'Выход'}: {record['name']}"
+            if not pool_manager.healthy:
+                message += " (без связи с базой, будет передано при её восстановлении)"
+            self.acknowledged.emit(card_number, True, message)
+        elif decision is None or decision in SERVER_STATUSES:
+            self.check_on_server(card_number)
+        else:
+            self.acknowledged.emit(card_number, False,
+                                   CHECKIN_ERRORS.get(decision, f"Неизвестный результат проверки карты: {decision}"))
+
+    def flush(self):
+        if not self.pending:
+            return
+        if self.flush_thread is not None and self.flush_thread.isRunning():
+            # Следующая пачка уйдёт после текущей, чтобы отметки одной карты не обогнали друг друга
+            self.flush_timer.start()
+            return
+        taps, self.pending = self.pending, []
+        self.flush_taps = taps
+        self.flush_thread = WorkerThread(self.send_taps, taps)
+        self.flush_thread.result_signal.connect(self.on_flushed)
+        self.flush_thread.error_signal.connect(partial(self.on_flush_failed, taps))
+        self.flush_thread.start()
+
+    def on_flushed(self, conflicts):
+        self.flush_taps = []
+        if self.flush_failing:
+            self.flush_failing = False
+            self.flush_timer.setInterval(self.flush_interval)
+        self.flushed.emit(conflicts)
+
+    def on_flush_failed(self, taps, error):
+        """
+        Пачку не удалось ни передать, ни записать в журнал (например, ошибка SQLite): отметки возвращаются
+        в начало очереди и передаются повторно реже обычного. Администратору сообщается один раз
+        до успешной передачи.
+        """
+        logger.error(f"Не удалось передать или сохранить {len(taps)} отметок карт: {error}")
+        self.flush_taps = []
+        self.pending[:0] = taps
+        self.flush_timer.start(TAP_FLUSH_RETRY_MS)
+        if not self.flush_failing:
+            self.flush_failing = True
+            self.flush_failed.emit(error)
+
+    def unconfirmed_clients(self):
+        """
+        Клиенты, входы и выходы которых решены на рабочем месте, но ещё не применены сервером:
+        отметки в очереди, в передаваемой пачке и в локальном журнале.
+        """
+        taps = self.pending + self.flush_taps
+        if checkin_journal.pending_count():
+            taps = taps + checkin_journal.pending()
+        return {tap["client_id"] for tap in taps}
+
+    @staticmethod
+    def send_taps(taps):
+        """
+        Передаёт пачку отметок на сервер. Без связи с базой или пока в журнале есть непереданные
+        более ранние отметки пачка записывается в журнал, чтобы порядок отметок сохранился.
+        :return: список конфликтов [(отметка, status)]
+        """
+        results = None
+        if pool_manager.healthy and not checkin_journal.pending_count():
+            results = apply_taps(taps, live=True)
+        if results is None:
+            checkin_journal.append_taps(taps)
+            return []
+        return tap_conflicts(taps, results)
+
+    def check_on_server(self, card_number):
+        # Завершившиеся потоки удаляются здесь, а не по сигналу finished, чтобы объект QThread
+        # не уничтожался, пока поток ещё выходит из run()
+        self.workers = [w for w in self.workers if not w.isFinished()]
+        worker = WorkerThread(card_checkin, card_number)
+        worker.result_signal.connect(partial(self.on_server_checkin, card_number))
+        self.workers.append(worker)
+        worker.start()
+
+    def on_server_checkin(self, card_number, result):
+        if result is None:
+            self.acknowledged.emit(card_number, False, "Ошибка проверки карты в базе данных. Попробуйте ещё раз.")
+            return
+        status = result["status"]
+        if status == "offline":
+            self.acknowledged.emit(card_number, False, "Нет связи с базой данных: карту не удалось проверить.")
+            return
+        card_index.apply_checkin(card_number, result)
+        if status == "entered":
+            self.acknowledged.emit(card_number, True, f"Посещение зафиксировано. ID визита: {result['visit_id']}")
+        elif status == "exited":
+            self.acknowledged.emit(card_number, True, f"Выход из зала зафиксирован. ID визита: {result['visit_id']}")
+        else:
+            self.acknowledged.emit(card_number, False,
+                                   CHECKIN_ERRORS.get(status, f"Неизвестный результат проверки карты: {status}"))
+
+    def shutdown(self, msecs=2000):
+        """Дожидается передачи пачек; отметки, не успевшие уйти, сохраняются в локальном журнале."""
+        self.flush_timer.stop()
+        for worker in [self.flush_thread, *self.workers]:
+            if worker is not None:
+                worker.wait(msecs)
+        if self.pending:
+            checkin_journal.append_taps(self.pending)
+            self.pending = []
+
+
+_tap_pipeline = None
+
+
+def get_tap_pipeline():
+    """Возвращает общий конвейер касаний карт, создавая его при первом обращении."""
+    global _tap_pipeline
+    if _tap_pipeline is None:
+        _tap_pipeline = TapPipeline()
+    return _tap_pipeline
 
 
 class ScanCardDialog(QDialog):
@@ -319,104 +576,41 @@ class ScanCardDialog(QDialog):
 
         self.setLayout(layout)
 
-        # Запускаем сканирование в отдельном потоке
+        # Ждём подтверждения касания карты
         self.start_scan()
 
     def start_scan(self):
-        self.scan_thread = WorkerThread(self.scan_card)
-        self.scan_thread.result_signal.connect(self.process_card)
-        self.scan_thread.error_signal.connect(self.show_error)
-        self.scan_thread.start()
-
-    def scan_card(self):
-        """Сканирование карты с последовательного порта с тайм-аутом"""
-        baudrate = 115200
-        card_number = None
-        timeout_seconds = 5  # Максимальное время ожидания сканирования
-        start_time = time.time()
-
-        available_ports = serial.tools.list_ports.comports()
-        for port_info in available_ports:
-            port = port_info.device
-            try:
-                serial_port = serial.Serial(port, baudrate, timeout=1)
-
-                while time.time() - start_time < timeout_seconds:
-                    if self.scan_thread._stop_requested:  # Проверяем, не остановлен ли поток
-                        return None
-
-                    if serial_port.in_waiting > 0:
-                        data = serial_port.read(serial_port.in_waiting).decode('utf-8')
-                        card_number = data.strip()
-                        break
-                    time.sleep(0.1)  # Ждем данные
-
-                if card_number:
-                    break  # Если получили карту, выходим из цикла портов
-
-            except serial.SerialException as e:
-                print(f"Ошибка работы с портом {port}: {e}")
-                continue
-
-            finally:
-                if 'serial_port' in locals() and serial_port.is_open:
-                    serial_port.close()
-
-        return card_number
-
-    def process_card(self, card_number):
-        """Проверка и регистрация визита"""
-        if not card_number:
-            QMessageBox.warning(self, "Ошибка", "Карта не была отсканирована.")
-            self.reject()
-            return
-
-        self.card_number = card_number  # Сохраняем номер карты
-        self.db_thread = WorkerThread(self.handle_card_processing, card_number)
-        self.db_thread.result_signal.connect(self.visit_registered)
-        self.db_thread.error_signal.connect(self.show_error)
-        self.db_thread.start()
-
-    def handle_card_processing(self, card_number):
-        """Обработка логики регистрации визита"""
-        client_id = get_client_id_by_card(card_number)
-        if not client_id:
-            raise Exception("Эта карта не привязана ни к одному клиенту.")
-
-        subscription_info = get_subscription_info(client_id)
-        if not subscription_info:
-            raise Exception("У клиента нет активного абонемента.")
-
-        subscription_id, tariff, valid_since, valid_until, is_valid, visit_ids = subscription_info
-
-        # Автоматическая деактивация просроченного абонемента
-        today = datetime.date.today()
-        if valid_until < today and is_valid:
-            deactivate_subscription(subscription_id)
-            raise Exception("Абонемент просрочен и был деактивирован.")
-
-        if not is_valid:
-            raise Exception("Абонемент недействителен.")
-
-        tariff_type = tariff.split('_')[1]
-        max_visits = int(tariff.split('_')[0]) if tariff.split('_')[0].isdigit() else None
-
-        current_hour = datetime.datetime.now().hour
-        if tariff_type == "mrn" and current_hour >= 16:
-            raise Exception("Абонемент клиента действует только до 16:00.")
-        elif tariff_type == "evn" and current_hour < 16:
-            raise Exception("Абонемент клиента действует только после 16:00.")
-
-        last_visit_today = check_today_visits(client_id)
-        if last_visit_today and max_visits and len(visit_ids) >= max_visits:
-            raise Exception("Клиент уже исчерпал лимит посещений.")
-
-        visit_id = register_visit(client_id, subscription_id)
+        """Ждёт подтверждения следующего касания от конвейера касаний карт."""
+        self.card_reader = get_card_reader()
+        if not self.card_reader.connected:
+            self.label.setText("Сканер не найден. Подключите устройство.")
+        self.card_reader.connection_changed.connect(self.on_reader_connection_changed)
+        get_tap_pipeline().acknowledged.connect(self.on_tap_acknowledged)
+
+    def stop_scan(self):
+        try:
+            get_tap_pipeline().acknowledged.disconnect(self.on_tap_acknowledged)
+            self.card_reader.connection_changed.disconnect(self.on_reader_connection_changed)
+        except TypeError:
+            pass  # Уже отписаны
+
+    def on_reader_connection_changed(self, connected):
+        if connected:
+            self.label.setText("Ожидание сканирования карты...")
+        else:
+            self.label.setText("Сканер не найден. Подключите устройство.")
 
-        if max_visits and len(visit_ids) + 1 >= max_visits:
-            deactivate_subscription(subscription_id)
+    def done(self, result):
+        self.stop_scan()
+        super().done(result)
 
-        return f"Посещение зафиксировано. ID визита: {visit_id}"
+    def on_tap_acknowledged(self, card_number, accepted, message):
+        self.stop_scan()  # Следующие касания этому окну не нужны
+        self.card_number = card_number
+        if accepted:
+            self.visit_registered(message)
+        else:
+            self.show_error(message)
 
     def visit_registered(self, message):
         QMessageBox.information(self, "Успех", message)
@@ -622,28 +816,29 @@ class ResizablePhoto(QLabel):
 # Пример использования
 class TariffCalculator:
     def __init__(self):
-        # Убираем QSettings, чтобы не использовать кэширование
-        self.tariffs = self.load_tariffs_from_db()
+        # Тарифы загружаются при первом расчёте, а не при импорте модуля,
+        # чтобы не открывать соединение с базой до входа пользователя
+        self._tariffs = None
+
+    @property
+    def tariffs(self):
+        if self._tariffs is None:
+            self._tariffs = self.load_tariffs_from_db()
+        return self._tariffs or {}
 
     def load_tariffs_from_db(self):
         """Загружаем тарифы из базы данных."""
         tariffs = {}
         query = "SELECT k_type, k_time, k_period_or_n FROM tariff"
-
-        # Подключаемся к базе данных
-        connection = connect_to_db()
-        cursor = connection.cursor()
-        cursor.execute(query)
-        rows = cursor.fetchall()
+        rows = execute_query(query)
+        if rows is None:
+            logger.error("Не удалось загрузить тарифы из базы данных")
+            return None
 
         for row in rows:
             k_type, k_time, k_period_or_n = row
             tariffs[k_type] = {'k_time': k_time, 'k_period_or_n': k_period_or_n}
 
-        # Закрываем соединение с БД
-        cursor.close()
-        connection.close()
-
         return tariffs
 
     def calculate_price(self, period, k_class, k_time, base_price):
@@ -786,89 +981,3 @@ def is_valid_visitor_data(data):
         required_fields = ["name", "id", "subscription_status"]
         return all(field in data and bool(data[field]) for field in required_fields)
     return False
-
-
-class ScanCardThread(QThread):
-    """Поток для сканирования карты, чтобы не блокировать UI."""
-    card_scanned = pyqtSignal(str)
-    scanner_not_found = pyqtSignal()
-
-    def run(self):
-        baudrate = 115200
-        card_number = None
-
-        # Получаем список всех доступных портов
-        available_ports = serial.tools.list_ports.comports()
-
-        if not available_ports:
-            self.scanner_not_found.emit()
-            return
-
-        for port_info in available_ports:
-            port = port_info.device  # COM-порт (например, COM3 или /dev/ttyUSB0)
-            print(f"Попытка подключения к {port}")
-
-            try:
-                serial_port = serial.Serial(port, baudrate, timeout=1)
-
-                while True:
-                    if serial_port.in_waiting > 0:
-                        data = serial_port.read(serial_port.in_waiting).decode('utf-8')
-                        print(f"Полученные данные с {port}: {data}")
-                        card_number = data.strip()
-                        break
-                    time.sleep(0.1)
-
-                if card_number:
-                    self.card_scanned.emit(card_number)
-                    break  # Выход после успешного сканирования
-
-            except serial.SerialException as e:
-                print(f"Ошибка подключения к {port}: {e}")
-
-            finally:
-                if 'serial_port' in locals() and serial_port.is_open:
-                    serial_port.close()
-
-        if not card_number:
-            self.scanner_not_found.emit()
-
-
-def scan_card():
-    baudrate = 115200  # Скорость передачи данных может отличаться
-    card_number = None
-
-    # Получаем список всех доступных портов
-    available_ports = serial.tools.list_ports.comports()
-
-    for port_info in available_ports:
-        port = port_info.device  # Имя устройства (например, COM3 или /dev/ttyUSB0)
-        print(f"Попытка подключения к {port}")
-
-        try:
-            serial_port = serial.Serial(port, baudrate, timeout=1)  # Добавлен таймаут для ускорения процесса
-
-            while True:
-                if serial_port.in_waiting > 0:
-                    data = serial_port.read(serial_port.in_waiting).decode('utf-8')  # Чтение и декодирование данных
-                    print(f"Полученные данные с {port}: {data}")
-                    card_number = data.strip()  # Обрезка лишних пробелов или символов
-                    break
-                time.sleep(0.1)
-
-            if card_number:
-                break  # Если карта найдена, выходим из цикла
-
-        except serial.SerialException as e:
-            print(f"Ошибка подключения к {port}: {e}")
-
-        finally:
-            if 'serial_port' in locals() and serial_port.is_open:
-                serial_port.close()
-
-    if card_number:
-        print(f"Карта найдена: {card_number}")
-    else:
-        print("Сканер не найден на доступных портах")
-
-    return card_number